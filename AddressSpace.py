@@ -0,0 +1,227 @@
+import hashlib
+import json
+from collections import namedtuple
+
+from lxml import etree
+from opcua import ua
+from opcua.server.address_space import AttributeValue, NodeData
+from opcua.server.user_manager import UserManager
+
+# One node of the simulator's namespace; vtype is None for folders
+NodeSpec = namedtuple("NodeSpec", "nodeid parent browse_name display_name vtype")
+
+OBJECTS_FOLDER = ua.NodeId(ua.ObjectIds.ObjectsFolder)
+NODESET_NS = "http://opcfoundation.org/UA/2011/03/UANodeSet.xsd"
+TYPES_NS = "http://opcfoundation.org/UA/2008/02/Types.xsd"
+
+
+# === Node Specs from the Plant Config ===
+def line_node_specs(config, idx):
+    """NodeSpecs of every line: LINEnn-MP folder, ASRS folder, one variable per register.
+
+    Folders get string NodeIds next to their variables (ns=2;s=LINE01-MP,
+    ns=2;s=LINE01-MP.ASRS), as on KEPServerEX.
+    """
+    specs = []
+    for line_no in config.line_numbers:
+        folder_name = config.folder_name(line_no)
+        line_folder = ua.NodeId(folder_name, idx)
+        asrs_folder = ua.NodeId(f"{folder_name}.{config.data['folder']}", idx)
+        specs.append(NodeSpec(line_folder, OBJECTS_FOLDER, folder_name, folder_name, None))
+        specs.append(NodeSpec(asrs_folder, line_folder, config.data["folder"], config.data["folder"], None))
+        for name, vtype in config.registers(line_no).items():
+            node_id_str = config.node_id(line_no, name)
+            specs.append(NodeSpec(ua.NodeId(node_id_str, idx), asrs_folder, name,
+                                  f"NS2|String|{node_id_str}", vtype))
+    return specs
+
+
+def topology_version(config):
+    # Changes whenever anything that shapes the address space changes
+    topology = {
+        "namespace_uri": config.namespace_uri,
+        "lines": {line_no: [config.node_id(line_no, ""), config.registers(line_no)]
+                  for line_no in config.line_numbers},
+    }
+    return hashlib.sha1(json.dumps(topology, sort_keys=True).encode()).hexdigest()
+
+
+# === Bulk Node Creation ===
+def _add_nodes_item(spec, idx):
+    item = ua.AddNodesItem()
+    item.RequestedNewNodeId = spec.nodeid
+    item.BrowseName = ua.QualifiedName(spec.browse_name, idx)
+    item.ParentNodeId = spec.parent
+    if spec.vtype is None:
+        item.NodeClass = ua.NodeClass.Object
+        item.ReferenceTypeId = ua.NodeId(ua.ObjectIds.Organizes)
+        item.TypeDefinition = ua.NodeId(ua.ObjectIds.FolderType)
+        attrs = ua.ObjectAttributes()
+        attrs.EventNotifier = 0
+    else:
+        vtype = getattr(ua.VariantType, spec.vtype)
+        item.NodeClass = ua.NodeClass.Variable
+        item.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HasComponent)
+        item.TypeDefinition = ua.NodeId(ua.ObjectIds.BaseDataVariableType)
+        attrs = ua.VariableAttributes()
+        attrs.DataType = ua.NodeId(vtype.value)
+        attrs.Value = ua.Variant(0, vtype)
+        attrs.ValueRank = ua.ValueRank.Scalar
+        attrs.Historizing = False
+        # writable, like node.set_writable()
+        attrs.AccessLevel = ua.AccessLevel.CurrentRead.mask | ua.AccessLevel.CurrentWrite.mask
+        attrs.UserAccessLevel = attrs.AccessLevel
+    attrs.Description = ua.LocalizedText(spec.browse_name)
+    attrs.DisplayName = ua.LocalizedText(spec.display_name)
+    attrs.WriteMask = 0
+    attrs.UserWriteMask = 0
+    item.NodeAttributes = attrs
+    return item
+
+
+def add_nodes_bulk(server, specs, idx):
+    """Add specs (parents first) to the address space in one pass.
+
+    The first node of each kind (folder, or variable of a given type) goes
+    through the server's regular AddNodes service; the rest share its static
+    attribute DataValues and type reference, so a register costs two new
+    DataValues and two references instead of ~25 DataValues and several
+    reference lookups. Call it before server.start().
+    """
+    aspace = server.iserver.aspace
+    service = server.iserver.node_mgt_service
+    templates = {}  # vtype -> (attribute DataValues, reference to parent, type definition reference)
+    names = {}      # browse name -> shared BrowseName/Description DataValues (never mutated in place)
+    nodes = aspace._nodes
+    with aspace._lock:
+        for spec in specs:
+            template = templates.get(spec.vtype)
+            if template is None:
+                result = service.add_nodes([_add_nodes_item(spec, idx)], UserManager.User.Admin)[0]
+                result.StatusCode.check()
+                first = nodes[spec.nodeid]
+                templates[spec.vtype] = ({attr: value.value for attr, value in first.attributes.items()},
+                                         *first.references)
+                continue
+            attributes, up, type_definition = template
+            if spec.browse_name not in names:
+                names[spec.browse_name] = (
+                    ua.DataValue(ua.Variant(ua.QualifiedName(spec.browse_name, idx), ua.VariantType.QualifiedName)),
+                    ua.DataValue(ua.Variant(ua.LocalizedText(spec.browse_name), ua.VariantType.LocalizedText)))
+            browse_name, description = names[spec.browse_name]
+            display_name = ua.LocalizedText(spec.display_name)
+            parent = nodes[spec.parent]
+
+            node = NodeData(spec.nodeid)
+            node.attributes = {attr: AttributeValue(dv) for attr, dv in attributes.items()}
+            node.attributes[ua.AttributeIds.NodeId] = AttributeValue(
+                ua.DataValue(ua.Variant(spec.nodeid, ua.VariantType.NodeId)))
+            node.attributes[ua.AttributeIds.BrowseName] = AttributeValue(browse_name)
+            node.attributes[ua.AttributeIds.DisplayName] = AttributeValue(
+                ua.DataValue(ua.Variant(display_name, ua.VariantType.LocalizedText)))
+            node.attributes[ua.AttributeIds.Description] = AttributeValue(description)
+
+            # parent -> node, node -> parent, and the (shared) type definition reference
+            forward = ua.ReferenceDescription()
+            forward.ReferenceTypeId = up.ReferenceTypeId
+            forward.NodeId = spec.nodeid
+            forward.NodeClass = attributes[ua.AttributeIds.NodeClass].Value.Value
+            forward.BrowseName = browse_name.Value.Value
+            forward.DisplayName = display_name
+            forward.TypeDefinition = type_definition.NodeId
+            forward.IsForward = True
+            parent.references.append(forward)
+            inverse = ua.ReferenceDescription()
+            inverse.ReferenceTypeId = up.ReferenceTypeId
+            inverse.NodeId = spec.parent
+            inverse.NodeClass = parent.attributes[ua.AttributeIds.NodeClass].value.Value.Value
+            inverse.BrowseName = parent.attributes[ua.AttributeIds.BrowseName].value.Value.Value
+            inverse.DisplayName = parent.attributes[ua.AttributeIds.DisplayName].value.Value.Value
+            inverse.IsForward = False
+            node.references = [inverse, type_definition]
+            nodes[spec.nodeid] = node
+
+
+# === UA Nodeset Cache ===
+def _tag(name, ns=NODESET_NS):
+    return f"{{{ns}}}{name}"
+
+
+def write_nodeset(path, specs, uri, idx, version):
+    """Save specs as a UA nodeset (UANodeSet.xsd) that other OPC UA tools can import.
+
+    version (topology_version) goes into the Model element so read_nodeset
+    can tell whether the file still matches the config.
+    """
+    def nodeid_str(nodeid):
+        # namespace index 1 in the file is the first (only) NamespaceUris entry
+        return nodeid.to_string().replace(f"ns={idx};", "ns=1;")
+
+    root = etree.Element(_tag("UANodeSet"), nsmap={None: NODESET_NS, "uax": TYPES_NS})
+    etree.SubElement(etree.SubElement(root, _tag("NamespaceUris")), _tag("Uri")).text = uri
+    etree.SubElement(etree.SubElement(root, _tag("Models")), _tag("Model"), ModelUri=uri, Version=version)
+    for spec in specs:
+        attrs = {"NodeId": nodeid_str(spec.nodeid), "BrowseName": f"1:{spec.browse_name}",
+                 "ParentNodeId": nodeid_str(spec.parent)}
+        if spec.vtype is None:
+            el = etree.SubElement(root, _tag("UAObject"), attrs)
+            ref_type, type_definition = "Organizes", f"i={ua.ObjectIds.FolderType}"
+        else:
+            attrs.update(DataType=f"i={getattr(ua.VariantType, spec.vtype).value}",
+                         AccessLevel="3", UserAccessLevel="3")
+            el = etree.SubElement(root, _tag("UAVariable"), attrs)
+            ref_type, type_definition = "HasComponent", f"i={ua.ObjectIds.BaseDataVariableType}"
+        etree.SubElement(el, _tag("DisplayName")).text = spec.display_name
+        etree.SubElement(el, _tag("Description")).text = spec.browse_name
+        refs = etree.SubElement(el, _tag("References"))
+        etree.SubElement(refs, _tag("Reference"), ReferenceType="HasTypeDefinition").text = type_definition
+        etree.SubElement(refs, _tag("Reference"), ReferenceType=ref_type, IsForward="false").text = \
+            nodeid_str(spec.parent)
+        if spec.vtype is not None:
+            etree.SubElement(etree.SubElement(el, _tag("Value")), _tag(spec.vtype, TYPES_NS)).text = "0"
+    etree.ElementTree(root).write(path, xml_declaration=True, encoding="utf-8", pretty_print=True)
+
+
+def nodeset_version(path):
+    """topology_version a write_nodeset file was made for, or None; stops reading at the Model element."""
+    try:
+        for _, el in etree.iterparse(path, events=("end",), tag=_tag("Model")):
+            return el.get("Version")
+    except (OSError, etree.XMLSyntaxError):
+        pass
+    return None
+
+
+def read_nodeset(path, idx, version):
+    """NodeSpecs saved by write_nodeset, or None if the file is missing or made for another topology.
+
+    Reads only what write_nodeset puts on each node and parses each NodeId
+    string once (a folder's registers share their parent), so loading costs
+    about as much as line_node_specs; add_nodes_bulk still does the rest.
+    """
+    if nodeset_version(path) != version:
+        return None
+    local = "ns=1;s="
+    nodeids = {}
+    vtypes = {}
+
+    def nodeid(text):
+        node = nodeids.get(text)
+        if node is None:
+            # ns=1 in the file is the simulator namespace, idx on this server
+            node = nodeids[text] = (ua.NodeId(text[len(local):], idx) if text.startswith(local)
+                                    else ua.NodeId.from_string(text))
+        return node
+
+    variable, display_name = _tag("UAVariable"), _tag("DisplayName")
+    specs = []
+    for el in etree.parse(path).getroot().iterchildren(_tag("UAObject"), variable):
+        vtype = None
+        if el.tag == variable:
+            data_type = el.get("DataType")
+            vtype = vtypes.get(data_type)
+            if vtype is None:
+                vtype = vtypes[data_type] = ua.VariantType(int(data_type[2:])).name
+        specs.append(NodeSpec(nodeid(el.get("NodeId")), nodeid(el.get("ParentNodeId")),
+                              el.get("BrowseName").split(":", 1)[1], el.findtext(display_name), vtype))
+    return specs
@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import dataclasses
+import logging
+
+from asyncua import Server, ua
+from asyncua.common.callback import CallbackType
+
+from LineConfig import load_config
+from SimEngine import LineSimulation, RegisterCache, SimClock
+from SimLog import setup_logging
+
+# Disable debug logs
+logging.getLogger("asyncua").setLevel(logging.ERROR)
+log = logging.getLogger("sim")
+
+# === GLOBAL Server Setup ===
+OPC_HOST = "0.0.0.0"
+OPC_PORT = 4840
+ENDPOINT = f"opc.tcp://{OPC_HOST}:{OPC_PORT}"
+
+
+# === Buffered Register Access ===
+async def write_values_bulk(server, values):
+    # Like write_values_bulk in NewOPCserver.py for asyncua: every (nodeid, DataValue)
+    # is set without an await in between, so no other coroutine (client reads,
+    # subscriptions) sees half a batch; datachange callbacks run afterwards.
+    # The simulator writes its own types, so the per-write type check is skipped.
+    nodes = server.iserver.aspace._nodes
+    fired = []
+    for nodeid, dv in values:
+        attval = nodes[nodeid].attributes[ua.AttributeIds.Value]
+        attval.value = dv
+        attval.value_callback = None
+        fired.extend((handle, callback, dv) for handle, callback in attval.datachange_callbacks.items())
+    for handle, callback, dv in fired:
+        try:
+            await callback(handle, dv)
+        except Exception as e:
+            log.error("❌ Error in datachange callback: %s", e)
+
+
+class AsyncLineNodes(RegisterCache):
+    """One line's register cache; a step's writes are flushed together after it."""
+
+    def __init__(self, server, nodes, vtypes, clock):
+        self.server = server
+        self.clock = clock
+        self.nodeids = {name: node.nodeid for name, node in nodes.items()}
+        self.vtypes = vtypes
+        super().__init__({name: server.read_attribute_value(nodeid).Value.Value
+                          for name, nodeid in self.nodeids.items()})
+
+    async def flush(self):
+        pending = self.take_pending()
+        if not pending:
+            return
+        # one source timestamp for everything written in this step
+        now = self.clock.utcnow()
+        await write_values_bulk(self.server, [
+            (self.nodeids[name], ua.DataValue(ua.Variant(value, self.vtypes[name]),
+                                              SourceTimestamp=now, ServerTimestamp=now))
+            for name, value in pending.items()])
+
+
+def hook_client_writes(server, hooks):
+    # hooks: NodeId -> callback(value); PostWrite fires only for client Write requests
+    def on_write(event, dispatcher):
+        for write_value, status in zip(event.request_params.NodesToWrite, event.response_params):
+            hook = hooks.get(write_value.NodeId)
+            if hook and status.is_good() and write_value.AttributeId == ua.AttributeIds.Value:
+                hook(write_value.Value.Value.Value)
+
+    server.subscribe_server_callback(CallbackType.PostWrite, on_write)
+
+
+def coerce_register_types(server, vtypes_by_nodeid):
+    # Clients such as Control.py write plain ints (Int64). Like KEPServerEX, convert
+    # them to the tag's type instead of refusing the write with BadTypeMismatch.
+    aspace = server.iserver.aspace
+    write = aspace.write_attribute_value
+
+    async def write_attribute_value(nodeid, attr, value):
+        vtype = vtypes_by_nodeid.get(nodeid)
+        if (vtype is not None and attr == ua.AttributeIds.Value and value.Value is not None
+                and value.Value.VariantType != vtype):
+            value = dataclasses.replace(value, Value=ua.Variant(value.Value.Value, vtype))
+        return await write(nodeid, attr, value)
+
+    aspace.write_attribute_value = write_attribute_value
+
+
+# === Address Space for One Line ===
+async def create_line_nodes(server, idx, config, line_no: int):
+    # --- Create Folder for This Line ---
+    folder_name = config.folder_name(line_no)
+    line_folder = await server.nodes.objects.add_folder(idx, folder_name)
+
+    # --- Create 'ASRS' Subfolder ---
+    asrs_folder = await line_folder.add_folder(idx, config.data["folder"])
+
+    # --- Create Variables inside 'ASRS' ---
+    nodes = {}
+    for name, vtype in config.registers(line_no).items():
+        node_id_str = config.node_id(line_no, name)
+        node = await asrs_folder.add_variable(ua.NodeId(node_id_str, idx), name,
+                                              ua.Variant(0, getattr(ua.VariantType, vtype)))
+        await node.set_writable()
+        await node.write_attribute(ua.AttributeIds.DisplayName,
+                                   ua.DataValue(ua.Variant(ua.LocalizedText(f"NS2|String|{node_id_str}"))))
+        nodes[name] = node
+    return nodes
+
+
+# === One Coroutine per Line ===
+async def run_line(server, line_no: int, regs, settings, wake_on_write=False):
+    clock = regs.clock
+    wake = asyncio.Event()
+    if wake_on_write:
+        regs.wake = wake.set  # client write hooks run on this loop
+    try:
+        sim = LineSimulation(line_no, regs, settings)
+        while True:
+            delay = sim.step()
+            await regs.flush()
+            wait = clock.wall(delay)
+            if not (wake_on_write and sim.interruptible):
+                await asyncio.sleep(wait)
+                continue
+            try:
+                await asyncio.wait_for(wake.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        log.error("❌ Error on Line %s: %s", line_no, e)
+
+
+async def main(config, wake_on_write=False):
+    server = Server()
+    await server.init()
+    server.set_endpoint(ENDPOINT)
+    server.set_server_name("KEPServerEX Mock")
+    idx = await server.register_namespace(config.namespace_uri)
+
+    line_nodes = {line_no: await create_line_nodes(server, idx, config, line_no) for line_no in config.line_numbers}
+    vtypes_by_nodeid = {}
+    line_regs = {}
+    clock = SimClock(config.time_scale)
+    for line_no, nodes in line_nodes.items():
+        vtypes = {name: getattr(ua.VariantType, vtype) for name, vtype in config.registers(line_no).items()}
+        vtypes_by_nodeid.update((node.nodeid, vtypes[name]) for name, node in nodes.items())
+        line_regs[line_no] = AsyncLineNodes(server, nodes, vtypes, clock)
+    coerce_register_types(server, vtypes_by_nodeid)
+    hook_client_writes(server, {
+        nodeid: (lambda value, regs=regs, name=name: regs.update(name, value))
+        for regs in line_regs.values() for name, nodeid in regs.nodeids.items()
+    })
+
+    async with server:
+        print(f"✅ OPC UA Server (asyncua) started at {ENDPOINT} with {len(line_regs)} lines")
+        tasks = [asyncio.create_task(run_line(server, line_no, regs, config.settings(line_no), wake_on_write))
+                 for line_no, regs in line_regs.items()]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+    print("✅ OPC UA Server stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="KEPServerEX mock for SRM lines (asyncua)")
+    parser.add_argument("--config", help="plant topology file (.json, .yaml or .toml)")
+    parser.add_argument("--lines", type=int, help="number of simulated lines (overrides the config)")
+    parser.add_argument("--wake-on-write", action="store_true",
+                        help="react to client writes of D0148/ResetFlag at once instead of at the next step")
+    parser.add_argument("--time-scale", type=float,
+                        help="simulation speed relative to real time, e.g. 10 or 100")
+    parser.add_argument("--deadband-abs", type=int,
+                        help="publish Distance_X/Distance_Y only when they moved more than this (final values always)")
+    parser.add_argument("--deadband-pct", type=float,
+                        help="the same as a percentage of the axis range")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="line event log level; DEBUG shows every motion step")
+    parser.add_argument("--log-rate", type=float, default=5.0,
+                        help="max line log messages per second per line (0 = no limit)")
+    args = parser.parse_args()
+    try:
+        config = load_config(args.config)
+        cli = {key: value for key, value in (("lines", args.lines), ("time_scale", args.time_scale),
+                                             ("deadband_abs", args.deadband_abs),
+                                             ("deadband_pct", args.deadband_pct))
+               if value is not None}
+        if cli:
+            config = config.replace(**cli)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    log_listener = setup_logging(args.log_level, args.log_rate)
+    try:
+        asyncio.run(main(config, args.wake_on_write))
+    except KeyboardInterrupt:
+        print("🛑 Server Interrupted by Keyboard")
+    finally:
+        log_listener.stop()
@@ -0,0 +1,331 @@
+from opcua import ua
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from Commands import record_writes
+from Security import CERT_DIR, SECURITY_MODES, secure_client
+from SimEngine import D_REGISTERS
+
+# Disable debug logs
+logging.getLogger("opcua").setLevel(logging.ERROR)
+
+ENDPOINT = "opc.tcp://127.0.0.1:4840"
+NAMESPACE = 2
+REGISTERS = tuple(D_REGISTERS)
+# Bay 1800..6000, levels 2..3 for the 10/35/38 commands
+COMMAND_PARAMS = {"D0131": 1800, "D0133": 2, "D0135": 6000, "D0137": 3}
+
+# (label, registers to write in one request, condition on the line's values that marks the reaction)
+COMMAND_SEQUENCE = [
+    ("reset", {"ResetFlag": 1}, lambda v: v["ResetFlag"] == 0 and v["D0148"] == 0),
+    ("10", dict(COMMAND_PARAMS, D0148=10), lambda v: v["D0328"] == 2 or v["D0148"] == 0),
+    ("37", {"D0148": 37}, lambda v: v["D0148"] == 0),
+    ("35", dict(COMMAND_PARAMS, D0148=35), lambda v: v["D0328"] == 2 or v["D0148"] == 0),
+    ("37", {"D0148": 37}, lambda v: v["D0148"] == 0),
+    # 78 can be followed by PREP's 2 within one publishing interval
+    ("38", dict(COMMAND_PARAMS, D0148=38), lambda v: v["D0328"] in (78, 2)),
+    ("36", {"D0148": 36}, lambda v: v["D0328"] == 76),
+    ("37", {"D0148": 37}, lambda v: v["D0148"] == 0),
+]
+
+
+def node_id(line_no, name):
+    return ua.NodeId(f"LINE{line_no:02d}-MP.ASRS.{name}", NAMESPACE)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+# === Server Process ===
+class ServerProcess:
+    """NewOPCserver.py in a child process, sampled for CPU and memory."""
+
+    def __init__(self, lines, server_args, security="None", cert_dir=CERT_DIR):
+        self.cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "NewOPCserver.py"),
+                    "--lines", str(lines), "--security", security, "--cert-dir", cert_dir] + server_args
+        self.security = security
+        self.cert_dir = cert_dir
+        self.proc = None
+        self.samples = []  # (cpu %, rss MB)
+        self.stop_event = threading.Event()
+
+    def start(self, timeout=120):
+        started = time.perf_counter()
+        self.proc = subprocess.Popen(self.cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        while time.perf_counter() - started < timeout:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {self.proc.returncode}")
+            try:
+                client = secure_client(ENDPOINT, self.security, self.cert_dir, self.certificate(), timeout=2)
+                client.connect()
+                client.disconnect()
+                return time.perf_counter() - started
+            except Exception:
+                time.sleep(0.2)
+        raise RuntimeError("server did not come up")
+
+    def certificate(self):
+        # what the server loaded; clients that know it skip the endpoint discovery round trip
+        return None if self.security == "None" else os.path.join(self.cert_dir, "server_cert.der")
+
+    def sample(self, interval=1.0):
+        # cpu % of one core since the last sample
+        try:
+            import psutil  # optional; /proc is used on Linux without it
+            proc = psutil.Process(self.proc.pid)
+            proc.cpu_percent()
+            while not self.stop_event.wait(interval):
+                self.samples.append((proc.cpu_percent(), proc.memory_info().rss / 2**20))
+            return
+        except ImportError:
+            pass
+        if not os.path.exists(f"/proc/{self.proc.pid}/stat"):
+            return  # no psutil and no /proc: CPU and memory are not reported
+        ticks = os.sysconf("SC_CLK_TCK")
+        last_cpu, last_time = self._proc_cpu() / ticks, time.perf_counter()
+        while not self.stop_event.wait(interval):
+            cpu, now = self._proc_cpu() / ticks, time.perf_counter()
+            self.samples.append((100 * (cpu - last_cpu) / (now - last_time), self._proc_rss()))
+            last_cpu, last_time = cpu, now
+
+    def _proc_cpu(self):
+        with open(f"/proc/{self.proc.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return int(fields[11]) + int(fields[12])  # utime + stime
+
+    def _proc_rss(self):
+        with open(f"/proc/{self.proc.pid}/status") as f:
+            for row in f:
+                if row.startswith("VmRSS:"):
+                    return int(row.split()[1]) / 1024
+        return 0.0
+
+    def stop(self):
+        self.stop_event.set()
+        if self.proc and self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGINT if os.name == "posix" else signal.SIGTERM)
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+
+
+# === Load Client ===
+class LoadClient:
+    """One OPC UA session: subscribes to every ASRS register, commands one line.
+
+    The session (and its secure channel) is opened once and reused for every
+    command, so connect_sec is the only place the handshake shows up.
+    """
+
+    def __init__(self, lines, command_line, publish_ms, step_timeout, client):
+        self.lines = lines
+        self.command_line = command_line
+        self.publish_ms = publish_ms
+        self.step_timeout = step_timeout
+        self.client = client
+        self.connect_sec = None
+        self.cond = threading.Condition()
+        self.values = {}  # NodeId -> value
+        self.changed_at = 0.0
+        self.counting = False
+        self.notifications = 0
+        self.latencies = {}  # command label -> [seconds]
+        self.timeouts = 0
+        self.errors = 0
+
+    def datachange_notification(self, node, val, data):
+        with self.cond:
+            self.values[node.nodeid] = val
+            self.changed_at = time.perf_counter()
+            if self.counting:
+                self.notifications += 1
+            self.cond.notify_all()
+
+    def connect(self):
+        started = time.perf_counter()
+        self.client.connect()
+        self.connect_sec = time.perf_counter() - started
+        nodes = [self.client.get_node(node_id(line_no, name))
+                 for line_no in range(1, self.lines + 1) for name in REGISTERS]
+        self.subscription = self.client.create_subscription(self.publish_ms, self)
+        self.subscription.subscribe_data_change(nodes)
+
+    def line_values(self):
+        return {name: self.values.get(node_id(self.command_line, name)) for name in REGISTERS}
+
+    def run_commands(self, stop_event):
+        nodes = {name: self.client.get_node(node_id(self.command_line, name)) for name in REGISTERS}
+        while not stop_event.is_set():
+            for label, writes, reacted in COMMAND_SEQUENCE:
+                if stop_event.is_set():
+                    return
+                sent = time.perf_counter()
+                try:
+                    # command last, so its parameters are already there when the line reacts
+                    self.client.set_values([nodes[name] for name in writes],
+                                           [ua.Variant(value, getattr(ua.VariantType, D_REGISTERS[name]))
+                                            for name, value in writes.items()])
+                except Exception:
+                    self.errors += 1
+                    stop_event.wait(1)
+                    continue
+                with self.cond:
+                    record_writes(writes.items(), self._wrote)
+                    done = self.cond.wait_for(lambda: self._reacted(reacted), self.step_timeout)
+                    changed_at = self.changed_at
+                if done:
+                    self.latencies.setdefault(label, []).append(max(0.0, changed_at - sent))
+                else:
+                    self.timeouts += 1
+                    print(f"⚠️ Line {self.command_line}: no reaction to {label} within {self.step_timeout}s")
+
+    def _wrote(self, name, value):
+        # not a notification: changed_at stays at the line's last real change
+        self.values[node_id(self.command_line, name)] = value
+
+    def _reacted(self, reacted):
+        values = self.line_values()
+        return None not in values.values() and reacted(values)
+
+    def close(self):
+        try:
+            self.subscription.delete()
+        except Exception:
+            pass
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+
+# === One Benchmark Run ===
+def run_case(lines, clients, duration, warmup, publish_ms, step_timeout, server_args,
+             security="None", cert_dir=CERT_DIR):
+    print(f"▶️ {lines} lines, {clients} client(s), {duration}s, security {security}")
+    server = ServerProcess(lines, server_args, security, cert_dir)
+    startup = server.start()
+    sampler = threading.Thread(target=server.sample, daemon=True)
+    sampler.start()
+    load = []
+    stop_event = threading.Event()
+    try:
+        for i in range(clients):
+            client = LoadClient(lines, i % lines + 1, publish_ms, step_timeout,
+                                secure_client(ENDPOINT, security, cert_dir, server.certificate()))
+            client.connect()
+            load.append(client)
+        time.sleep(warmup)  # initial notifications of every monitored item
+        for client in load:
+            with client.cond:
+                client.counting = True
+        drivers = [threading.Thread(target=client.run_commands, args=(stop_event,), daemon=True)
+                   for client in load]
+        started = time.perf_counter()
+        for t in drivers:
+            t.start()
+        time.sleep(duration)
+        for client in load:
+            with client.cond:
+                client.counting = False
+        elapsed = time.perf_counter() - started
+        stop_event.set()
+        for t in drivers:
+            t.join(step_timeout + 1)
+    finally:
+        for client in load:
+            client.close()
+        server.stop()
+
+    latencies = {}
+    for client in load:
+        for label, values in client.latencies.items():
+            latencies.setdefault(label, []).extend(values)
+    every = [value for values in latencies.values() for value in values]
+    cpu = [c for c, _ in server.samples]
+    rss = [m for _, m in server.samples]
+    connects = [c.connect_sec for c in load if c.connect_sec is not None]
+    result = {
+        "lines": lines,
+        "clients": clients,
+        "security": security,
+        "startup_s": round(startup, 2),
+        "connect_ms": round(1000 * percentile(connects, 50), 1) if connects else None,
+        "notifications_per_s": round(sum(c.notifications for c in load) / elapsed, 1),
+        "commands": len(every),
+        "timeouts": sum(c.timeouts for c in load),
+        "errors": sum(c.errors for c in load),
+        "latency_ms": {
+            label: {q: round(1000 * percentile(values, q), 1) for q in (50, 90, 99)}
+            for label, values in sorted(latencies.items())
+        },
+        "latency_all_ms": {q: round(1000 * percentile(every, q), 1) for q in (50, 90, 99)} if every else None,
+        "cpu_percent_avg": round(sum(cpu) / len(cpu), 1) if cpu else None,
+        "cpu_percent_max": round(max(cpu), 1) if cpu else None,
+        "rss_mb_max": round(max(rss), 1) if rss else None,
+    }
+    return result
+
+
+def print_summary(results):
+    print()
+    print(f"{'lines':>6} {'clients':>7} {'security':>14} {'start s':>7} {'conn ms':>7} {'notif/s':>9} "
+          f"{'cmds':>5} {'t/o':>4} {'p50 ms':>7} {'p90 ms':>7} {'p99 ms':>7} {'cpu %':>6} {'rss MB':>7}")
+    for r in results:
+        lat = r["latency_all_ms"] or {}
+        print(f"{r['lines']:>6} {r['clients']:>7} {r['security']:>14} {r['startup_s']:>7} "
+              f"{r['connect_ms'] or '-':>7} {r['notifications_per_s']:>9} "
+              f"{r['commands']:>5} {r['timeouts']:>4} {lat.get(50, '-'):>7} {lat.get(90, '-'):>7} "
+              f"{lat.get(99, '-'):>7} {r['cpu_percent_avg'] or '-':>6} {r['rss_mb_max'] or '-':>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load benchmark for NewOPCserver.py: starts it on loopback and drives N clients",
+        epilog="Arguments after -- go to NewOPCserver.py, e.g. -- --mode thread --wake-on-write")
+    parser.add_argument("--lines", default="8,50,200", help="comma-separated line counts to run")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent client sessions")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds per line count")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds after subscribing before measuring")
+    parser.add_argument("--publish-ms", type=int, default=100, help="client subscription publishing interval")
+    parser.add_argument("--step-timeout", type=float, default=15,
+                        help="seconds to wait for a line to react to a command")
+    parser.add_argument("--security", default="None",
+                        help="comma-separated security modes to compare: None, Sign, SignAndEncrypt")
+    parser.add_argument("--cert-dir", default=CERT_DIR, help="certificates of the server and the load clients")
+    parser.add_argument("--json", help="also write the results to this file")
+    args, server_args = parser.parse_known_args()
+    security_modes = args.security.split(",")
+    if any(mode not in SECURITY_MODES for mode in security_modes):
+        parser.error(f"--security takes a comma separated list of {', '.join(SECURITY_MODES)}")
+    if server_args and server_args[0] == "--":
+        server_args = server_args[1:]
+    if "--mode" not in server_args:
+        server_args = ["--mode", "scheduler"] + server_args
+
+    results = []
+    try:
+        for lines in [int(n) for n in args.lines.split(",")]:
+            for security in security_modes:
+                result = run_case(lines, args.clients, args.duration, args.warmup, args.publish_ms,
+                                  args.step_timeout, server_args, security, os.path.abspath(args.cert_dir))
+                print(json.dumps(result))
+                results.append(result)
+    except KeyboardInterrupt:
+        print("🛑 Benchmark interrupted")
+    print_summary(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"server_args": server_args, "results": results}, f, indent=2)
@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger("sim")
+
+
+# === Periodic Line Snapshots ===
+class Checkpointer:
+    """Snapshots of every line's state machine and registers in a SQLite file.
+
+    The drivers hand over states between steps: once per interval, due(key)
+    is True for each key (a line number, or one key for a whole engine), and
+    the driver put()s a fresh snapshot. A background thread writes the newest
+    snapshots every interval, so the hot loop only pays for building the
+    state dicts. One row per line, written in one transaction, so a crash
+    leaves the previous checkpoint whole. Several processes may share a file
+    as long as each writes its own lines.
+    """
+
+    def __init__(self, path, interval=5.0):
+        self.path = path
+        self.interval = interval
+        self.generation = 0
+        self.taken = {}   # key -> generation it last put() for
+        self.latest = {}  # line number -> state
+        self.stop_event = threading.Event()
+        with sqlite3.connect(path, timeout=10) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS lines (line INTEGER PRIMARY KEY, saved REAL, state TEXT)")
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def due(self, key):
+        if self.taken.get(key) == self.generation:
+            return False
+        self.taken[key] = self.generation
+        return True
+
+    def put(self, states):
+        # states: line number -> state dict
+        self.latest.update(states)
+
+    def offer(self, sims):
+        """Snapshot the LineSimulation objects that are due; call after their writes are committed."""
+        for sim in sims:
+            if self.due(sim.line_no):
+                self.latest[sim.line_no] = sim.snapshot()
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        written = {}  # line number -> JSON last written
+        while True:
+            stopping = self.stop_event.wait(self.interval)
+            states = dict(self.latest)
+            self.generation += 1
+            saved = time.time()
+            rows = []
+            for line_no, state in states.items():
+                data = json.dumps(state, separators=(",", ":"))
+                if written.get(line_no) != data:
+                    written[line_no] = data
+                    rows.append((line_no, saved, data))
+            if rows:
+                try:
+                    with conn:
+                        conn.executemany("INSERT OR REPLACE INTO lines VALUES (?, ?, ?)", rows)
+                except sqlite3.Error as e:
+                    log.error("❌ Error writing checkpoint %s: %s", self.path, e)
+            if stopping:
+                break
+        conn.close()
+
+    def stop(self):
+        # writes what was captured last, then returns
+        self.stop_event.set()
+        self.thread.join(10)
+
+
+def load_checkpoint(path):
+    """{line number: state} from a checkpoint file; empty if there is none."""
+    if not os.path.exists(path):
+        return {}
+    with sqlite3.connect(path, timeout=10) as conn:
+        rows = conn.execute("SELECT line, saved, state FROM lines").fetchall()
+    if rows:
+        age = time.time() - max(row[1] for row in rows)
+        log.info("♻️ Checkpoint %s: %s lines, saved %.0fs ago", path, len(rows), age)
+    return {line_no: json.loads(state) for line_no, _, state in rows}
@@ -0,0 +1,147 @@
+import logging
+
+from opcua import ua
+
+log = logging.getLogger("sim")
+
+UINT32_MAX = 2 ** 32 - 1
+
+
+# === Commands: validated register writes, D0148 / ResetFlag last ===
+# Each returns the (register, value) writes of the command, or raises
+# ValueError. The line only acts on D0148 and ResetFlag, so writing them last
+# means it never sees a command with half of its bounds.
+def _check_bay(name, bay):
+    if not 0 <= bay <= UINT32_MAX:
+        raise ValueError(f"{name} must be 0..{UINT32_MAX}")
+
+
+def _check_level(name, level, highest):
+    if not 1 <= level <= highest:
+        raise ValueError(f"{name} must be 1..{highest}")
+
+
+def start_audit(settings, level_start, level_end, bay_start, bay_end):
+    _check_level("levelStart", level_start, settings["max_level"])
+    _check_level("levelEnd", level_end, settings["max_level"])
+    if level_start > level_end:
+        raise ValueError("levelStart must not be above levelEnd")
+    _check_bay("bayStart", bay_start)
+    _check_bay("bayEnd", bay_end)
+    if bay_start > bay_end:
+        raise ValueError("bayStart must not be above bayEnd")
+    return [("D0131", bay_start), ("D0135", bay_end), ("D0133", level_start), ("D0137", level_end), ("D0148", 38)]
+
+
+def tour(settings, bay, level):
+    _check_bay("bay", bay)
+    _check_level("level", level, settings["max_present_level"])
+    return [("D0131", bay), ("D0133", level), ("D0148", 10)]
+
+
+def free_move(settings, bay, level):
+    _check_bay("bay", bay)
+    _check_level("level", level, settings["max_present_level"])
+    return [("D0135", bay), ("D0137", level), ("D0148", 35)]
+
+
+def hold(settings):
+    return [("D0148", 36)]
+
+
+def stop(settings):
+    return [("D0148", 37)]
+
+
+def reset(settings):
+    return [("ResetFlag", 1)]
+
+
+# method name -> (command, input arguments as (name, variant type, description))
+COMMANDS = {
+    "StartAudit": (start_audit, (("levelStart", ua.VariantType.Int16, "first level of the sweep (D0133)"),
+                                 ("levelEnd", ua.VariantType.Int16, "last level of the sweep (D0137)"),
+                                 ("bayStart", ua.VariantType.UInt32, "Distance_X of the first bay (D0131)"),
+                                 ("bayEnd", ua.VariantType.UInt32, "Distance_X of the last bay (D0135)"))),
+    "Tour": (tour, (("bay", ua.VariantType.UInt32, "Distance_X to go to (D0131)"),
+                    ("level", ua.VariantType.Int16, "level to go to (D0133)"))),
+    "FreeMove": (free_move, (("bay", ua.VariantType.UInt32, "Distance_X to go to (D0135)"),
+                             ("level", ua.VariantType.Int16, "level to go to (D0137)"))),
+    "Hold": (hold, ()),
+    "Stop": (stop, ()),
+    "Reset": (reset, ()),
+}
+
+
+def record_writes(writes, record):
+    """Pass a command's (register, value) writes to record(name, value) once they are sent.
+
+    For a client that tracks the line through a subscription: what it just
+    wrote is the line's state until the server reports otherwise, so a wait
+    that starts right after the write does not act on the values from before.
+    """
+    for name, value in writes:
+        record(name, value)
+
+
+# === Method Nodes ===
+def _argument(name, vtype, description):
+    arg = ua.Argument()
+    arg.Name = name
+    arg.DataType = ua.NodeId(vtype.value)
+    arg.ValueRank = ua.ValueRank.Scalar
+    arg.Description = ua.LocalizedText(description)
+    return arg
+
+
+def add_command_methods(server, idx, config, submit):
+    """Add the COMMANDS as methods of every LINEnn-MP folder.
+
+    Each method exists once (ns=idx;s=Commands.<name>) and every line folder
+    references it, so 500 lines cost 6 method nodes; the folder a client calls
+    it on (the ObjectId) picks the line. submit(line_no, writes) applies the
+    validated writes in one go. Bad arguments get BadInvalidArgument and
+    nothing is written.
+    """
+    folders = {ua.NodeId(config.folder_name(line_no), idx): line_no for line_no in config.line_numbers}
+
+    def method(name, command, arguments):
+        def call(parent, *args):
+            line_no = folders.get(parent)
+            values = [arg.Value for arg in args]
+            try:
+                if line_no is None:
+                    raise ValueError(f"{parent.to_string()} is not a line")
+                if len(values) != len(arguments) or not all(
+                        isinstance(value, int) and not isinstance(value, bool) for value in values):
+                    raise ValueError(f"takes {len(arguments)} integer argument(s)")
+                writes = command(config.settings(line_no), *values)
+            except ValueError as e:
+                log.warning("⚠️ %s%s rejected: %s", name, tuple(values), e)
+                return ua.StatusCode(ua.StatusCodes.BadInvalidArgument)
+            submit(line_no, writes)
+            log.info("[Line%02d] 📨 %s%s", line_no, name, tuple(values))
+            return []
+        return call
+
+    first, *rest = folders
+    parent = server.get_node(first)
+    method_ids = []
+    for name, (command, arguments) in COMMANDS.items():
+        node = parent.add_method(ua.NodeId(f"Commands.{name}", idx), ua.QualifiedName(name, idx),
+                                 method(name, command, arguments),
+                                 [_argument(*arg) for arg in arguments], [])
+        method_ids.append(node.nodeid)
+
+    refs = []
+    for folder in rest:
+        for method_id in method_ids:
+            ref = ua.AddReferencesItem()
+            ref.SourceNodeId = folder
+            ref.TargetNodeId = method_id
+            ref.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HasComponent)
+            ref.IsForward = True
+            ref.TargetNodeClass = ua.NodeClass.Method
+            refs.append(ref)
+    for result in server.iserver.node_mgt_service.add_references(refs):
+        result.check()
@@ -1,67 +1,320 @@
 import flet as ft
-from opcua import Client
-import asyncio
+from opcua import ua
 import signal
 import sys
 import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from Security import secure_client
 
 OPC_URL = "opc.tcp://191.20.110.47:4840"
+OPC_SECURITY = "None"      # or "Sign" / "SignAndEncrypt" (Basic256Sha256); trust certs/client_cert.der on the server
+OPC_SERVER_CERT = None     # server certificate file; without it each connect asks the server for its endpoints first
 NAMESPACE = 2
+CONTROL_LINE = "LINE04-MP"  # line driven by the control tab
+FLEET_REGISTERS = ("D0148", "D0328", "Distance_X", "Distance_Y", "PresentLevel")
+PUBLISH_INTERVAL_MS = 100  # server sends changed values at most this often
+UI_REFRESH_SEC = 0.2       # pages redraw at most this often
+OPC_TIMEOUT_SEC = 4        # per request; a slow gateway fails the request instead of hanging the panel
+KEEPALIVE_SEC = 5          # how often the connection is checked
+RECONNECT_MIN_SEC = 1      # reconnect backoff: 1 s, 2 s, 4 s ... up to RECONNECT_MAX_SEC
+RECONNECT_MAX_SEC = 30
+
+class SharedConnection:
+    """One OPC UA session and subscription shared by every open page (browser tab).
+
+    Pages acquire() when they open and release() when they close. A supervisor
+    thread connects while at least one page is open, checks the session every
+    KEEPALIVE_SEC and reconnects with exponential backoff, re-creating the
+    monitored items. Each node is monitored once and its changes are fanned
+    out to every page watching it, so server load does not grow with the
+    number of tabs. All client calls run on the supervisor or the I/O thread,
+    never in a Flet handler.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.lock = threading.RLock()       # client / subscription / handles
+        self.watch_lock = threading.Lock()  # watchers, values and listeners only, never held during I/O
+        self.io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="opcua-io")
+        self.client = None
+        self.subscription = None
+        self.refs = 0
+        self.stop_event = None
+        self.state = ("🔄 Connecting to OPC UA...", ft.Colors.ORANGE)
+        self.watchers = {}   # NodeId -> {token: callback(nodeid, value)}
+        self.listeners = {}  # token -> callback(text, color) on connection state changes
+        self.handles = {}    # NodeId -> monitored item handle
+        self.values = {}     # NodeId -> last value, replayed to new watchers
+        self.lines = None    # line folder names, browsed once per connection
+        self.next_token = 0
+
+    # --- Page lifetime ---
+    def acquire(self):
+        with self.lock:
+            self.refs += 1
+            if self.stop_event is None:
+                self.stop_event = threading.Event()
+                threading.Thread(target=self.supervise, args=(self.stop_event,), daemon=True).start()
+
+    def release(self):
+        with self.lock:
+            self.refs -= 1
+            if self.refs <= 0:
+                self.close()
+
+    def close(self):
+        with self.lock:
+            if self.stop_event:
+                self.stop_event.set()
+            self.stop_event = None
+            self.refs = 0
+            # the supervisor wakes up on stop_event and disconnects its client
+            self.unshare(self.client)
+            with self.watch_lock:
+                self.watchers.clear()
+                self.listeners.clear()
+                self.values.clear()
+
+    # --- Connection supervisor ---
+    def supervise(self, stop_event):
+        # client is this supervisor's own: after a close() and a new acquire(),
+        # a supervisor that is still winding down only disconnects what it connected
+        delay = RECONNECT_MIN_SEC
+        client = None
+        while not stop_event.is_set():
+            if client is None:
+                self.set_state("🔄 Connecting to OPC UA...", ft.Colors.ORANGE)
+                try:
+                    client = self.connect(stop_event)
+                except Exception as err:
+                    self.set_state(f"❌ OPC UA unavailable ({err or type(err).__name__}), "
+                                   f"retry in {delay:.0f}s", ft.Colors.RED)
+                    stop_event.wait(delay)
+                    delay = min(delay * 2, RECONNECT_MAX_SEC)
+                    continue
+                if client is None:
+                    break  # closed while connecting
+                delay = RECONNECT_MIN_SEC
+                self.set_state("✅ Connected to OPC UA", ft.Colors.GREEN)
+            if stop_event.wait(KEEPALIVE_SEC):
+                break
+            try:
+                client.get_node(ua.NodeId(ua.ObjectIds.Server_ServerStatus_State)).get_value()
+            except Exception as err:
+                print(f"⚠️ OPC UA connection lost: {err or type(err).__name__}")
+                self.disconnect(client)
+                client = None
+                self.set_state("🔄 Connection lost, reconnecting...", ft.Colors.ORANGE)
+        if client:
+            self.disconnect(client)
+
+    def connect(self, stop_event):
+        """Connect a new client and make it the shared one; None if stop_event's supervisor was closed meanwhile."""
+        client = secure_client(self.url, OPC_SECURITY, server_certificate=OPC_SERVER_CERT, timeout=OPC_TIMEOUT_SEC)
+        client.connect()
+        try:
+            with self.lock:
+                if self.stop_event is not stop_event:
+                    self.disconnect(client)
+                    return None
+                self.client = client
+                self.subscription = client.create_subscription(PUBLISH_INTERVAL_MS, self)
+                self.lines = self.browse_lines(client)
+                with self.watch_lock:
+                    watched = list(self.watchers)
+                self.subscribe(watched)
+        except Exception:
+            self.disconnect(client)
+            raise
+        return client
+
+    def unshare(self, client):
+        # Pages stop using client; a no-op if another client is shared by now
+        with self.lock:
+            if client is not None and self.client is client:
+                self.client = None
+                self.subscription = self.lines = None
+                self.handles.clear()
+
+    def disconnect(self, client):
+        self.unshare(client)
+        try:
+            client.disconnect()
+        except Exception:
+            pass  # already gone; disconnect() still closes the socket
+
+    def set_state(self, text, color):
+        with self.watch_lock:
+            self.state = (text, color)
+            listeners = list(self.listeners.values())
+        for listener in listeners:
+            listener(text, color)
 
-# ✅ ตัวแปรควบคุม Task และ Client
-should_run = True
-client = None
-status_task = None
+    def on_state(self, callback):
+        """Call callback(text, color) now and on every connection state change; returns a token."""
+        with self.watch_lock:
+            token = self.next_token
+            self.next_token += 1
+            self.listeners[token] = callback
+            state = self.state
+        callback(*state)
+        return token
+
+    def browse_lines(self, client):
+        # Line folders under Objects: every folder with an ASRS subfolder.
+        # One Browse plus one TranslateBrowsePaths request, however many lines.
+        folders = [ref for ref in client.get_objects_node().get_children_descriptions()
+                   if ref.BrowseName.NamespaceIndex == NAMESPACE]
+        paths = []
+        for ref in folders:
+            path = ua.BrowsePath()
+            path.StartingNode = ref.NodeId
+            element = ua.RelativePathElement()
+            element.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HierarchicalReferences)
+            element.IsInverse = False
+            element.IncludeSubtypes = True
+            element.TargetName = ua.QualifiedName("ASRS", NAMESPACE)
+            path.RelativePath.Elements.append(element)
+            paths.append(path)
+        results = client.uaclient.translate_browsepaths_to_nodeids(paths) if paths else []
+        return sorted(ref.BrowseName.Name for ref, result in zip(folders, results)
+                      if result.StatusCode.is_good())
+
+    # --- Client calls from pages ---
+    def run(self, func, done):
+        """Run func(client) on the I/O thread, then done(result, error) there as well."""
+        def call():
+            try:
+                with self.lock:
+                    client = self.client
+                if client is None:
+                    raise ConnectionError("not connected to OPC UA")
+                result, error = func(client), None
+            except Exception as err:
+                result, error = None, err
+            done(result, error)
+        self.io.submit(call)
+
+    # --- Monitored items ---
+    def watch(self, nodeids, callback):
+        """Call callback(nodeid, value) on every change of nodeids; returns a token for unwatch()."""
+        with self.watch_lock:
+            token = self.next_token
+            self.next_token += 1
+            for nodeid in nodeids:
+                self.watchers.setdefault(nodeid, {})[token] = callback
+            cached = [(nodeid, self.values[nodeid]) for nodeid in nodeids if nodeid in self.values]
+        for nodeid, value in cached:
+            callback(nodeid, value)
+        self.io.submit(self.subscribe, nodeids)
+        return token
+
+    def subscribe(self, nodeids):
+        with self.lock:
+            new = [nodeid for nodeid in nodeids if nodeid not in self.handles]
+            if not new or self.subscription is None:
+                return  # subscribed on (re)connect
+            try:
+                handles = self.subscription.subscribe_data_change([self.client.get_node(n) for n in new])
+                self.handles.update(zip(new, handles))
+            except Exception as err:
+                print(f"❌ Error subscribing: {err}")
+
+    def unwatch(self, token):
+        with self.watch_lock:
+            self.listeners.pop(token, None)
+            unused = []
+            for nodeid, callbacks in self.watchers.items():
+                callbacks.pop(token, None)
+                if not callbacks:
+                    unused.append(nodeid)
+            for nodeid in unused:
+                del self.watchers[nodeid]
+                self.values.pop(nodeid, None)
+        if unused:
+            self.io.submit(self.unsubscribe, unused)
+
+    def unsubscribe(self, nodeids):
+        with self.lock:
+            for nodeid in nodeids:
+                handle = self.handles.pop(nodeid, None)
+                try:
+                    if self.subscription and isinstance(handle, int):
+                        self.subscription.unsubscribe(handle)
+                except Exception:
+                    pass
+
+    def datachange_notification(self, node, val, data):
+        # Runs on the client's receive thread: only copy the callbacks under the lock
+        with self.watch_lock:
+            self.values[node.nodeid] = val
+            callbacks = list(self.watchers.get(node.nodeid, {}).values())
+        for callback in callbacks:
+            try:
+                callback(node.nodeid, val)
+            except Exception as err:
+                print(f"❌ Error in status callback: {err}")
+
+    def status_change_notification(self, status):
+        print(f"⚠️ Subscription status: {status}")
+
+class PageRefresher:
+    """Coalesces page.update() calls from datachange callbacks into one per UI_REFRESH_SEC."""
+
+    def __init__(self, page):
+        self.page = page
+        self.lock = threading.Lock()
+        self.pending = False
+
+    def request(self):
+        with self.lock:
+            if self.pending:
+                return
+            self.pending = True
+        timer = threading.Timer(UI_REFRESH_SEC, self.refresh)
+        timer.daemon = True
+        timer.start()
+
+    def refresh(self):
+        with self.lock:
+            self.pending = False
+        try:
+            self.page.update()
+        except Exception:
+            pass  # page already closed
+
+# ✅ Client เดียวใช้ร่วมกันทุกหน้า (ทุกแท็บ)
+connection = SharedConnection(OPC_URL)
 
 def graceful_exit():
-    global should_run, client, status_task
     print("🛑 Graceful shutdown...")
-    should_run = False
-    try:
-        if status_task:
-            status_task.cancel()
-    except:
-        pass
-    try:
-        if client and client.uaclient.session:
-            client.disconnect()
-    except:
-        pass
+    connection.close()
 
-def main(page: ft.Page):
-    global client, status_task, should_run
+atexit.register(graceful_exit)  # เมื่อกด X
 
+def main(page: ft.Page):
     page.title = "🔧 SRM Control Panel"
     page.vertical_alignment = ft.MainAxisAlignment.CENTER
 
-    # ✅ สถานะเชื่อมต่อ
+    # ✅ สถานะเชื่อมต่อ (อัปเดตจาก SharedConnection)
     status_text = ft.Text("🔄 Connecting to OPC UA...", color=ft.Colors.ORANGE)
-    page.update()
-
-    try:
-        client = Client(OPC_URL)
-        client.connect()
-        status_text.value = "✅ Connected to OPC UA"
-        status_text.color = ft.Colors.GREEN
-        page.update()
-    except Exception as e:
-        status_text.value = f"❌ Failed to connect: {e}"
-        status_text.color = ft.Colors.RED
-        page.update()
-        return
+    refresher = PageRefresher(page)
+    connection.acquire()
 
-    # ✅ Node Access
-    def get_node(name):
-        return client.get_node(f"ns={NAMESPACE};s=LINE04-MP.ASRS.{name}")
+    # ✅ Node Access: NodeIds only, the client lives in the shared connection
+    def node_id(name, line=CONTROL_LINE):
+        return ua.NodeId.from_string(f"ns={NAMESPACE};s={line}.ASRS.{name}")
 
-    d148_node = get_node("D0148")
-    reset_flag_node = get_node("ResetFlag")
-    level_start_node = get_node("LevelStart")
-    level_end_node = get_node("LevelEnd")
-    d328_node = get_node("D0328")
-    Disx_node = get_node("Distance_X")
-    Disy_node = get_node("Distance_Y")
-    present_level_node = get_node("PresentLevel")
+    d148_node = node_id("D0148")
+    reset_flag_node = node_id("ResetFlag")
+    level_start_node = node_id("D0133")  # Level Start
+    level_end_node = node_id("D0137")    # Level End
+    d328_node = node_id("D0328")
+    Disx_node = node_id("Distance_X")
+    Disy_node = node_id("Distance_Y")
+    present_level_node = node_id("PresentLevel")
 
     title_text = ft.Text("🔧 SRM CONTROL PANEL", size=28, weight="bold", color=ft.Colors.BLUE_800)
     dropdown_start = ft.Dropdown(label="Level Start", width=200, dense=True)
@@ -109,115 +362,145 @@ def main(page: ft.Page):
     dropdown_start.on_change = update_end
     dropdown_end.on_change = update_start
 
+    def show_result(text, color):
+        status_text.value = text
+        status_text.color = color
+        refresher.request()
+
     def send_command(e):
-        try:
-            if not dropdown_start.value or not dropdown_end.value or not cmd_dropdown.value:
-                status_text.value = "⚠️ กรุณาเลือกค่าทั้งหมด"
-                return
+        if not dropdown_start.value or not dropdown_end.value or not cmd_dropdown.value:
+            status_text.value = "⚠️ กรุณาเลือกค่าทั้งหมด"
+            page.update()
+            return
 
-            start = int(dropdown_start.value)
-            end = int(dropdown_end.value)
+        start = int(dropdown_start.value)
+        end = int(dropdown_end.value)
+        cmd = int(cmd_dropdown.value)
 
-            if start > end:
-                status_text.value = f"❌ Start ({start}) ต้องไม่มากกว่า End ({end})"
-                return
+        if start > end:
+            status_text.value = f"❌ Start ({start}) ต้องไม่มากกว่า End ({end})"
+            page.update()
+            return
 
-            d148_node.set_value(int(cmd_dropdown.value))
-            level_start_node.set_value(start)
-            level_end_node.set_value(end)
-            status_text.value = f"✅ CMD={cmd_dropdown.value}, Start={start}, End={end} ส่งแล้ว"
-            update_status_desc()
-        except Exception as err:
-            status_text.value = f"❌ Error: {err}"
-        page.update()
+        def write(client):
+            # D0133, D0137 and D0148 in one Write request, D0148 last: the server
+            # applies them in order, so the line never sees the command without
+            # its range, and a dropped connection cannot leave only the bounds
+            # written. set_values raises on any bad status code.
+            client.set_values([client.get_node(n) for n in (level_start_node, level_end_node, d148_node)],
+                              [ua.Variant(v, ua.VariantType.Int16) for v in (start, end, cmd)])
+
+        def done(result, err):
+            if err:
+                show_result(f"❌ Error: {err or type(err).__name__}", ft.Colors.RED)
+            else:
+                show_result(f"✅ CMD={cmd}, Start={start}, End={end} ส่งแล้ว", ft.Colors.GREEN)
+
+        show_result(f"⏳ Sending CMD={cmd}...", ft.Colors.ORANGE)
+        connection.run(write, done)
 
     def trigger_reset(e):
-        try:
-            reset_flag_node.set_value(1)
-            dropdown_start.value = None
-            dropdown_end.value = None
-            cmd_dropdown.value = None
-            status_text.value = "🔁 Reset flag triggered"
-            status_text.color = ft.Colors.GREEN
-            update_status_desc()
-        except Exception as err:
-            status_text.value = f"❌ Error: {err}"
-            status_text.color = ft.Colors.RED
-        page.update()
+        def done(result, err):
+            if err:
+                show_result(f"❌ Error: {err or type(err).__name__}", ft.Colors.RED)
+            else:
+                show_result("🔁 Reset flag triggered", ft.Colors.GREEN)
 
-    def update_status_desc():
-        try:
-            d328_value = d328_node.get_value()
-            disx_value = Disx_node.get_value()
-            disy_value = Disy_node.get_value()
-            present_level_value = present_level_node.get_value()
-            status_d328_text.value = f"D0328 Status: {d328_value}"
-            status_x_text.value = f"Distance X: {disx_value}"
-            status_y_text.value = f"Distance Y: {disy_value}"
-            present_level_text.value = f"Present Level: {present_level_value}"
-        except Exception as err:
-            status_d328_text.value = f"❌ Error reading D0328: {err}"
-            status_x_text.value = f"❌ Error reading Distance X: {err}"
-            status_y_text.value = f"❌ Error reading Distance Y: {err}"
-            present_level_text.value = f"❌ Error reading Present Level: {err}"
-
-    async def auto_update_status():
-        global should_run
-        try:
-            while should_run:
-                update_status_desc()
-                page.update()
-                await asyncio.sleep(0.5 if should_run else 0.1)
-        except asyncio.CancelledError:
-            print("🛑 auto_update_status cancelled.")
+        dropdown_start.value = None
+        dropdown_end.value = None
+        cmd_dropdown.value = None
+        show_result("⏳ Sending reset...", ft.Colors.ORANGE)
+        connection.run(lambda client: client.get_node(reset_flag_node).set_value(1), done)
+
+    # ✅ Fleet: ทุก Line บน Server (สร้างเมื่อเชื่อมต่อครั้งแรก)
+    fleet_cells = {}  # NodeId -> ft.Text in the fleet table
+    fleet_table = ft.DataTable(
+        columns=[ft.DataColumn(ft.Text("Line"))] + [ft.DataColumn(ft.Text(name)) for name in FLEET_REGISTERS],
+        rows=[],
+    )
+
+    # Monitored items instead of polling: the server pushes only values that changed
+    labels = {
+        d328_node: (status_d328_text, "D0328 Status"),
+        Disx_node: (status_x_text, "Distance X"),
+        Disy_node: (status_y_text, "Distance Y"),
+        present_level_node: (present_level_text, "Present Level"),
+    }
+
+    def on_status(nodeid, value):
+        label, caption = labels[nodeid]
+        label.value = f"{caption}: {value}"
+        refresher.request()
+
+    def on_fleet(nodeid, value):
+        fleet_cells[nodeid].value = str(value)
+        refresher.request()
+
+    watch_tokens = []
+    fleet_lock = threading.Lock()
+
+    def build_fleet(lines):
+        with fleet_lock:
+            if fleet_cells:
+                return
+            for line in lines:
+                cells = [ft.DataCell(ft.Text(line, weight="bold"))]
+                for name in FLEET_REGISTERS:
+                    cell_text = ft.Text("-")
+                    fleet_cells[node_id(name, line)] = cell_text
+                    cells.append(ft.DataCell(cell_text))
+                fleet_table.rows.append(ft.DataRow(cells=cells))
+        watch_tokens.append(connection.watch(list(fleet_cells), on_fleet))
+
+    def on_connection_state(text, color):
+        show_result(text, color)
+        lines = connection.lines
+        if lines:
+            build_fleet(lines)
 
     def on_disconnect(e):
-        global should_run, status_task
-        print("🛑 Disconnecting cleanly...")
-        should_run = False
-        try:
-            if status_task:
-                status_task.cancel()
-        except:
-            pass
-        try:
-            client.disconnect()
-        except:
-            pass
+        print("🛑 Page closed, releasing OPC UA connection...")
+        for token in watch_tokens:
+            connection.unwatch(token)
+        connection.release()
 
     update_start()
     update_end()
-    update_status_desc()
-    atexit.register(graceful_exit)  # เมื่อกด X
     page.on_disconnect = on_disconnect
-    global status_task
-    status_task = page.run_task(auto_update_status)
+
+    control_view = ft.Row([
+        ft.Column([
+            title_text,
+            dropdown_start,
+            dropdown_end,
+            cmd_dropdown,
+            ft.Row([
+                ft.ElevatedButton("Send CMD", on_click=send_command, width=100),
+                ft.ElevatedButton("Reset", on_click=trigger_reset, bgcolor="red", width=100)
+            ], alignment=ft.MainAxisAlignment.CENTER),
+            status_text
+        ], alignment=ft.MainAxisAlignment.CENTER, horizontal_alignment=ft.CrossAxisAlignment.CENTER),
+        ft.VerticalDivider(width=40),
+        ft.Column([
+            ft.Text("📘 คำอธิบายคำสั่ง:", weight="bold"),
+            explanation_text,
+            ft.Text("📊 สถานะปัจจุบันของเครน:", weight="bold"),
+            status_d328_text,
+            status_x_text,
+            status_y_text,
+            present_level_text
+        ], alignment=ft.MainAxisAlignment.START)
+    ], alignment=ft.MainAxisAlignment.CENTER)
+    fleet_view = ft.Column([fleet_table], scroll=ft.ScrollMode.AUTO, expand=True)
 
     page.add(
-        ft.Row([
-            ft.Column([
-                title_text,
-                dropdown_start,
-                dropdown_end,
-                cmd_dropdown,
-                ft.Row([
-                    ft.ElevatedButton("Send CMD", on_click=send_command, width=100),
-                    ft.ElevatedButton("Reset", on_click=trigger_reset, bgcolor="red", width=100)
-                ], alignment=ft.MainAxisAlignment.CENTER),
-                status_text
-            ], alignment=ft.MainAxisAlignment.CENTER, horizontal_alignment=ft.CrossAxisAlignment.CENTER),
-            ft.VerticalDivider(width=40),
-            ft.Column([
-                ft.Text("📘 คำอธิบายคำสั่ง:", weight="bold"),
-                explanation_text,
-                ft.Text("📊 สถานะปัจจุบันของเครน:", weight="bold"),
-                status_d328_text,
-                status_x_text,
-                status_y_text,
-                present_level_text
-            ], alignment=ft.MainAxisAlignment.START)
-        ], alignment=ft.MainAxisAlignment.CENTER)
+        ft.Tabs(tabs=[
+            ft.Tab(text=f"🔧 Control ({CONTROL_LINE})", content=control_view),
+            ft.Tab(text="📊 Fleet", content=fleet_view),
+        ], expand=True)
     )
+    watch_tokens.append(connection.watch(list(labels), on_status))
+    watch_tokens.append(connection.on_state(on_connection_state))
 
 ft.app(
     target=main,
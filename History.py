@@ -0,0 +1,282 @@
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from opcua import ua
+from opcua.server.history import HistoryStorageInterface
+
+# Registers historized when --history is not given
+HISTORY_REGISTERS = ("Distance_X", "Distance_Y", "PresentLevel", "D0328", "D0147")
+
+WIN_EPOCH = datetime(1601, 1, 1)  # "no time given" in a HistoryRead request
+
+
+def to_seconds(dt):
+    # datetime (naive = UTC, as opcua decodes them) -> POSIX seconds
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+# === Ring Buffer of One Node ===
+class NodeRing:
+    """Bounded history of one node as two NumPy arrays (times, values).
+
+    Starts small and doubles up to capacity, so idle lines cost a few hundred
+    bytes. When full, append() overwrites the oldest entry and returns it so
+    it can be spilled. Entries are kept in time order, oldest at start.
+    """
+
+    __slots__ = ("times", "values", "start", "size", "capacity")
+
+    def __init__(self, capacity, initial=64):
+        self.capacity = capacity
+        self.times = np.empty(min(initial, capacity), dtype=np.float64)
+        self.values = np.empty(min(initial, capacity), dtype=np.int64)
+        self.start = 0
+        self.size = 0
+
+    def append(self, t, value):
+        n = len(self.times)
+        if self.size == n and n < self.capacity:
+            self._grow(min(2 * n, self.capacity))
+            n = len(self.times)
+        if self.size < n:
+            i = (self.start + self.size) % n
+            self.times[i] = t
+            self.values[i] = value
+            self.size += 1
+            return None
+        i = self.start
+        evicted = (float(self.times[i]), int(self.values[i]))
+        self.times[i] = t
+        self.values[i] = value
+        self.start = (i + 1) % n
+        return evicted
+
+    def _grow(self, n):
+        times, values = self.ordered()
+        self.times = np.empty(n, dtype=np.float64)
+        self.values = np.empty(n, dtype=np.int64)
+        self.times[:self.size] = times
+        self.values[:self.size] = values
+        self.start = 0
+
+    def ordered(self):
+        # (times, values) oldest first; a copy only if the ring has wrapped
+        end = self.start + self.size
+        if end <= len(self.times):
+            return self.times[self.start:end], self.values[self.start:end]
+        end -= len(self.times)
+        return (np.concatenate((self.times[self.start:], self.times[:end])),
+                np.concatenate((self.values[self.start:], self.values[:end])))
+
+    def oldest(self):
+        return float(self.times[self.start]) if self.size else None
+
+    def between(self, low, high):
+        """(times, values) with low <= time <= high, oldest first."""
+        segments = []
+        end = self.start + self.size
+        n = len(self.times)
+        if end <= n:
+            segments.append((self.start, end))
+        else:
+            segments.extend(((self.start, n), (0, end - n)))
+        times, values = [], []
+        for a, b in segments:
+            seg = self.times[a:b]
+            lo = np.searchsorted(seg, low, side="left")
+            hi = np.searchsorted(seg, high, side="right")
+            times.append(seg[lo:hi])
+            values.append(self.values[a:b][lo:hi])
+        return np.concatenate(times), np.concatenate(values)
+
+
+# === Optional SQLite Spill ===
+class SqliteSpill:
+    """Entries evicted from the rings, kept in SQLite for retention seconds
+    (of simulation time, counted back from the newest entry).
+
+    Writes are batched (one batch per simulator write) and done by a
+    background thread with its own connection; reads use a second one.
+    """
+
+    def __init__(self, path, retention):
+        self.path = path
+        self.retention = retention
+        self.batches = queue.SimpleQueue()
+        self.read_lock = threading.Lock()
+        with sqlite3.connect(path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS history (node TEXT, ts REAL, value INTEGER)")
+            conn.execute("CREATE INDEX IF NOT EXISTS history_node_ts ON history (node, ts)")
+        self.reader = sqlite3.connect(path, check_same_thread=False)
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def put(self, rows):
+        self.batches.put(rows)
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.path)
+        pruned = 0.0
+        newest = 0.0
+        while True:
+            rows = self.batches.get()
+            if rows is None:
+                break
+            # take everything queued so far in one transaction
+            while True:
+                try:
+                    more = self.batches.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    self.batches.put(None)
+                    break
+                rows.extend(more)
+            newest = max(newest, max(row[1] for row in rows))
+            with conn:
+                conn.executemany("INSERT INTO history VALUES (?, ?, ?)", rows)
+                if self.retention and time.monotonic() - pruned > 60:
+                    conn.execute("DELETE FROM history WHERE ts < ?", (newest - self.retention,))
+                    pruned = time.monotonic()
+        conn.close()
+
+    def between(self, node, low, high):
+        with self.read_lock:
+            rows = self.reader.execute(
+                "SELECT ts, value FROM history WHERE node = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+                (node, low, high)).fetchall()
+        return rows
+
+    def stop(self):
+        self.batches.put(None)
+        self.thread.join(5)
+        self.reader.close()
+
+
+# === History Storage for the opcua Server ===
+class RingHistory(HistoryStorageInterface):
+    """opcua history backend: one NodeRing per historized node, optional SQLite spill.
+
+    The simulator calls record() with the values it has just written, instead
+    of the server's internal subscription, so historizing costs one ring
+    append per changed value. HistoryRead (raw) is served with binary searches
+    over the ring, plus SQLite for the part older than the ring.
+    """
+
+    def __init__(self, capacity=2000, spill=None):
+        self.capacity = capacity
+        self.spill = spill
+        self.rings = {}   # NodeId -> NodeRing
+        self.vtypes = {}  # NodeId -> VariantType
+        self.lock = threading.Lock()
+
+    def add_node(self, node_id, vtype, capacity=None):
+        self.rings[node_id] = NodeRing(capacity or self.capacity)
+        self.vtypes[node_id] = vtype
+
+    def record(self, when, values):
+        # values: (NodeId, value) pairs written at datetime when
+        t = to_seconds(when)
+        evicted = []
+        rings = self.rings
+        with self.lock:
+            for node_id, value in values:
+                ring = rings.get(node_id)
+                if ring is None:
+                    continue
+                old = ring.append(t, value)
+                if old is not None and self.spill:
+                    evicted.append((node_id.to_string(), old[0], old[1]))
+        if evicted:
+            self.spill.put(evicted)
+
+    # --- HistoryStorageInterface ---
+    def new_historized_node(self, node_id, period, count=0):
+        # server.historize_node_data_change(); the server's subscription then
+        # calls save_node_value. period is not enforced, count caps the ring.
+        # The variant type is taken from the first value saved.
+        with self.lock:
+            if node_id not in self.rings:
+                self.add_node(node_id, None, count)
+
+    def save_node_value(self, node_id, datavalue):
+        if self.vtypes.get(node_id, True) is None:
+            self.vtypes[node_id] = datavalue.Value.VariantType
+        self.record(datavalue.SourceTimestamp or datetime.now(timezone.utc), [(node_id, datavalue.Value.Value)])
+
+    def read_node_history(self, node_id, start, end, nb_values):
+        ring = self.rings.get(node_id)
+        if ring is None:
+            return [], None
+        start = None if start is None or start <= WIN_EPOCH else to_seconds(start)
+        end = None if end is None or end <= WIN_EPOCH else to_seconds(end)
+        # no start: newest first back from end; start after end: newest first between them
+        descending = start is None or (end is not None and start > end)
+        if start is not None and end is not None and start > end:
+            start, end = end, start
+        low = -np.inf if start is None else start
+        high = np.inf if end is None else end
+
+        with self.lock:
+            times, values = ring.between(low, high)
+            oldest = ring.oldest()
+        if self.spill and (oldest is None or low < oldest):
+            rows = self.spill.between(node_id.to_string(), low, min(high, oldest if oldest is not None else high))
+            rows = [row for row in rows if oldest is None or row[0] < oldest]
+            if rows:
+                times = np.concatenate((np.array([r[0] for r in rows]), times))
+                values = np.concatenate((np.array([r[1] for r in rows], dtype=np.int64), values))
+
+        if descending:
+            times, values = times[::-1], values[::-1]
+        cont = None
+        if nb_values and len(times) > nb_values:
+            # opcua sends cont back as the next page's StartTime, with the same
+            # EndTime. With no start that page would read forward from cont, so
+            # such a read ends here; to page newest first, pass start > end.
+            if start is not None or not descending:
+                cont = datetime.fromtimestamp(float(times[nb_values]), timezone.utc)
+            times, values = times[:nb_values], values[:nb_values]
+        vtype = self.vtypes[node_id]
+        results = []
+        for t, value in zip(times.tolist(), values.tolist()):
+            stamp = datetime.fromtimestamp(t, timezone.utc)
+            dv = ua.DataValue(ua.Variant(value, vtype))
+            dv.SourceTimestamp = stamp
+            dv.ServerTimestamp = stamp
+            results.append(dv)
+        return results, cont
+
+    # Events are not historized: the simulator emits none, so these accept
+    # and drop them and event history reads are empty
+    def new_historized_event(self, source_id, evtypes, period, count=0):
+        pass
+
+    def save_event(self, event):
+        pass
+
+    def read_event_history(self, source_id, start, end, nb_values, evfilter):
+        return [], None
+
+    def stop(self):
+        if self.spill:
+            self.spill.stop()
+
+
+def enable_history(server, storage, nodes):
+    """Mark nodes (NodeId -> VariantType) historizing and readable with HistoryRead."""
+    aspace = server.iserver.aspace
+    access = ua.AccessLevel.CurrentRead.mask | ua.AccessLevel.CurrentWrite.mask | ua.AccessLevel.HistoryRead.mask
+    for node_id, vtype in nodes.items():
+        storage.add_node(node_id, vtype)
+        aspace.set_attribute_value(node_id, ua.AttributeIds.Historizing, ua.DataValue(ua.Variant(True)))
+        for attr in (ua.AttributeIds.AccessLevel, ua.AttributeIds.UserAccessLevel):
+            aspace.set_attribute_value(node_id, attr, ua.DataValue(ua.Variant(access, ua.VariantType.Byte)))
+    server.iserver.history_manager.set_storage(storage)
@@ -0,0 +1,151 @@
+import json
+import os
+
+from SimEngine import D_REGISTERS, LINE_SETTINGS
+
+# Registers LineSimulation reads or writes; every register map must have them
+REQUIRED_REGISTERS = (
+    "D0147", "D0148", "D0328", "Distance_X", "Distance_Y", "PresentLevel", "ResetFlag",
+    "D0130", "D0131", "D0133", "D0134", "D0135", "D0137",
+)
+
+VARIANT_TYPES = (
+    "Boolean", "SByte", "Byte", "Int16", "UInt16", "Int32", "UInt32",
+    "Int64", "UInt64", "Float", "Double",
+)
+
+# Topology used when no --config is given: the original 8 lines
+DEFAULT_CONFIG = {
+    "lines": 8,                       # count, or an explicit list of line numbers
+    "line_name": "LINE{line:02d}-MP",
+    "folder": "ASRS",
+    "namespace_uri": "http://example.com/opcua",
+    "registers": D_REGISTERS,
+    "tick": 0.1,
+    "time_scale": 1.0,
+    "overrides": {},                  # line number -> registers / settings for that line
+}
+DEFAULT_CONFIG.update(LINE_SETTINGS)
+
+
+class PlantConfig:
+    """Line topology of one simulated plant.
+
+    Built from DEFAULT_CONFIG updated with a JSON, YAML or TOML file. Settings
+    (step ranges, level limits, timing) and extra registers can be overridden
+    per line under "overrides".
+    """
+
+    def __init__(self, data=None):
+        self.data = dict(DEFAULT_CONFIG, **(data or {}))
+        lines = self.data["lines"]
+        if isinstance(lines, int):
+            self.line_numbers = list(range(1, lines + 1))
+        else:
+            self.line_numbers = [int(line_no) for line_no in lines]
+        self.overrides = {int(line_no): line for line_no, line in self.data["overrides"].items()}
+        self.validate()
+
+    def validate(self):
+        if not self.line_numbers:
+            raise ValueError("config: no lines")
+        if len(set(self.line_numbers)) != len(self.line_numbers):
+            raise ValueError("config: duplicate line numbers")
+        for line_no, override in self.overrides.items():
+            if line_no not in self.line_numbers:
+                raise ValueError(f"config: override for unknown line {line_no}")
+            unknown = set(override) - set(LINE_SETTINGS) - {"registers"}
+            if unknown:
+                raise ValueError(f"config: line {line_no} override has unknown keys {', '.join(sorted(unknown))}")
+        for line_no in self.line_numbers:
+            registers = self.registers(line_no)
+            missing = [name for name in REQUIRED_REGISTERS if name not in registers]
+            if missing:
+                raise ValueError(f"config: line {line_no} is missing registers {', '.join(missing)}")
+            for name, vtype in registers.items():
+                if vtype not in VARIANT_TYPES:
+                    raise ValueError(f"config: register {name} has unknown type {vtype!r}")
+            settings = self.settings(line_no)
+            for key in ("x_step", "y_step"):
+                low, high = settings[key]
+                if not 0 < low <= high:
+                    raise ValueError(f"config: line {line_no} {key} must be [low, high] with 0 < low <= high")
+            if not 1 <= settings["max_level"] <= settings["max_present_level"]:
+                raise ValueError(f"config: line {line_no} needs 1 <= max_level <= max_present_level")
+            if settings["step_time"] <= 0 or settings["prep_hold_time"] < 0:
+                raise ValueError(f"config: line {line_no} step_time must be positive, prep_hold_time not negative")
+            if settings["deadband_abs"] < 0 or not 0 <= settings["deadband_pct"] <= 100:
+                raise ValueError(f"config: line {line_no} needs deadband_abs >= 0 and 0 <= deadband_pct <= 100")
+        if self.tick <= 0 or self.time_scale <= 0:
+            raise ValueError("config: tick and time_scale must be positive")
+
+    def replace(self, **changes):
+        """Copy with top-level keys changed, e.g. from command-line flags.
+
+        Overrides for lines that are no longer simulated are dropped, so
+        --lines can shrink a plant whose file tunes its last lines.
+        """
+        config = PlantConfig(dict(self.data, **changes, overrides={}))
+        config.data["overrides"] = {line_no: line for line_no, line in self.overrides.items()
+                                    if line_no in config.line_numbers}
+        config.overrides = dict(config.data["overrides"])
+        config.validate()
+        return config
+
+    @property
+    def tick(self):
+        return self.data["tick"]
+
+    @property
+    def time_scale(self):
+        return self.data["time_scale"]
+
+    @property
+    def namespace_uri(self):
+        return self.data["namespace_uri"]
+
+    def folder_name(self, line_no: int):
+        return self.data["line_name"].format(line=line_no)
+
+    def node_id(self, line_no: int, name: str):
+        return f"{self.folder_name(line_no)}.{self.data['folder']}.{name}"
+
+    def registers(self, line_no: int):
+        registers = dict(self.data["registers"])
+        registers.update(self.overrides.get(line_no, {}).get("registers", {}))
+        return registers
+
+    def settings(self, line_no: int):
+        override = self.overrides.get(line_no, {})
+        return {key: override.get(key, self.data[key]) for key in LINE_SETTINGS}
+
+
+def read_data_file(path, kind="config"):
+    """Contents of a .json, .yaml/.yml or .toml file; kind prefixes the error message."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".json":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    elif ext in (".yaml", ".yml"):
+        import yaml
+        with open(path, encoding="utf-8") as f:
+            data = yaml.safe_load(f)
+    elif ext == ".toml":
+        import tomllib
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    else:
+        raise ValueError(f"{kind}: unsupported file type {ext!r} (use .json, .yaml or .toml)")
+    return data
+
+
+def load_config(path=None):
+    """PlantConfig from a .json, .yaml/.yml or .toml file, or the defaults."""
+    if path is None:
+        return PlantConfig()
+
+    data = read_data_file(path)
+    unknown = set(data or {}) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError(f"config: unknown keys {', '.join(sorted(unknown))}")
+    return PlantConfig(data)
@@ -0,0 +1,190 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Wall-clock seconds, from well under a 0.1 s tick to several ticks
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+# === Metric Types (Prometheus text format) ===
+class Metric:
+    """Values by label tuple; collect, if given, supplies them at scrape time instead."""
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _label_str(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+    def samples(self):
+        if self.collect:
+            values = self.collect()
+        else:
+            with self.lock:
+                values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{self._label_str(key)} {value}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DURATION_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot: above every bucket
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bound}"}} {cumulative}'
+        yield f"{self.name}_sum {total}"
+        yield f"{self.name}_count {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+# === Simulator Metrics ===
+class SimMetrics:
+    """Counters and histograms around the tick loop and the register write path.
+
+    Drivers call observe_* from the hot loop; each call is a perf_counter
+    difference, a bisect and a lock-protected add. Per-line modes and the
+    server's subscription counts are read only when /metrics is scraped.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.registry = Registry()
+        add = self.registry.add
+        self.tick_seconds = add(Histogram(
+            "sim_tick_duration_seconds", "Wall seconds spent stepping and committing one tick"))
+        self.lateness_seconds = add(Histogram(
+            "sim_tick_lateness_seconds", "Wall seconds a tick (or a thread-mode step) started after it was due"))
+        self.lag = add(Gauge("sim_lag_seconds", "Lateness of the latest tick, wall seconds"))
+        self.overruns = add(Counter(
+            "sim_tick_overruns_total", "Ticks that started a whole tick late, i.e. the simulator fell behind"))
+        self.step_seconds = add(Histogram("sim_line_step_duration_seconds", "Wall seconds of one line step"))
+        self.transitions = add(Counter(
+            "sim_line_transitions_total", "Mode changes of a line, by the mode it entered", ("line", "mode")))
+        self.register_writes = add(Counter(
+            "sim_register_writes_total", "Register values written to the address space by the simulator"))
+        self.write_seconds = add(Histogram(
+            "sim_write_batch_duration_seconds", "Wall seconds of one bulk address-space write"))
+        self.datachanges = add(Counter(
+            "sim_datachange_callbacks_total", "Subscription datachange callbacks fired by simulator writes"))
+        self.client_writes = add(Counter(
+            "sim_client_writes_total", "Register values written by OPC UA clients"))
+        add(Gauge("sim_clock_seconds", "Simulation seconds since start; rate() is the achieved time scale",
+                  collect=lambda: {(): round(self.clock.now(), 3)}))
+
+    def observe_tick(self, seconds, lateness, tick):
+        # lateness and tick in wall seconds
+        self.tick_seconds.observe(seconds)
+        self.lateness_seconds.observe(lateness)
+        self.lag.set(lateness)
+        if tick and lateness >= tick:
+            self.overruns.inc()
+
+    def observe_step(self, line_no, seconds, mode_before, mode):
+        self.step_seconds.observe(seconds)
+        if mode != mode_before:
+            self.transitions.inc(1, line_no, mode)
+
+    def observe_write(self, seconds, values, fired):
+        self.write_seconds.observe(seconds)
+        self.register_writes.inc(values)
+        if fired:
+            self.datachanges.inc(fired)
+
+    def add_line_modes(self, modes):
+        # modes(): {line number: mode name}, called at scrape time
+        self.registry.add(Gauge("sim_line_mode", "1 for the mode each line is in", ("line", "mode"),
+                                collect=lambda: {(line_no, mode): 1 for line_no, mode in modes().items()}))
+
+    def add_server(self, server):
+        # Subscriptions and monitored items on the python-opcua server
+        subscriptions = server.iserver.subscription_service.subscriptions
+
+        def monitored_items():
+            return {(): sum(len(sub.monitored_item_srv._monitored_items) for sub in list(subscriptions.values()))}
+
+        self.registry.add(Gauge("opcua_subscriptions", "Active client subscriptions",
+                                collect=lambda: {(): len(subscriptions)}))
+        self.registry.add(Gauge("opcua_monitored_items", "Monitored items over all subscriptions",
+                                collect=monitored_items))
+
+    def serve(self, port, host="0.0.0.0"):
+        """Serve GET /metrics on a daemon thread; returns the HTTP server."""
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # no line per scrape
+
+        httpd = ThreadingHTTPServer((host, port), Handler)
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd
+
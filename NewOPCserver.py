@@ -1,12 +1,114 @@
 from opcua import Server, ua
+import argparse
+import atexit
+import os
 import threading
 import time
-import random
 import logging
 
+from AddressSpace import add_nodes_bulk, line_node_specs, read_nodeset, topology_version, write_nodeset
+from Checkpoint import Checkpointer, load_checkpoint
+from Commands import add_command_methods
+from LineConfig import load_config
+from History import HISTORY_REGISTERS, RingHistory, SqliteSpill, enable_history
+from Metrics import SimMetrics
+from SimLog import setup_logging
+from Security import CERT_DIR, SECURITY_MODES, setup_server_security
+from SimEngine import LineSimulation, RegisterCache, SimClock, TickScheduler
+
 # Disable debug logs
 logging.getLogger("opcua").setLevel(logging.ERROR)
+log = logging.getLogger("sim")
 stop_event = threading.Event()
+
+parser = argparse.ArgumentParser(description="KEPServerEX mock for SRM lines")
+parser.add_argument("--config", help="plant topology file (.json, .yaml or .toml)")
+parser.add_argument("--lines", type=int, help="number of simulated lines (overrides the config)")
+parser.add_argument("--mode", choices=["thread", "scheduler", "vector", "replay", "process"], default="thread",
+                    help="thread: one thread per line, scheduler: all lines on one tick loop, "
+                         "vector: all lines as NumPy arrays, replay: play back a recorded --trace, "
+                         "process: lines split over --processes worker processes")
+parser.add_argument("--tick", type=float,
+                    help="tick period in simulation seconds (scheduler tick, sleep slice in thread mode)")
+parser.add_argument("--time-scale", type=float,
+                    help="simulation speed relative to real time, e.g. 10 or 100")
+parser.add_argument("--free-run", action="store_true",
+                    help="run simulation time as fast as possible (scheduler, vector and replay modes)")
+parser.add_argument("--workers", type=int, default=1, help="scheduler worker threads per tick")
+parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                    help="worker processes for --mode process (default: one per CPU core)")
+parser.add_argument("--wake-on-write", action="store_true",
+                    help="react to client writes of D0148/ResetFlag at once instead of at the next step "
+                         "(thread, scheduler and process modes)")
+parser.add_argument("--deadband-abs", type=int,
+                    help="publish Distance_X/Distance_Y only when they moved more than this (final values always)")
+parser.add_argument("--deadband-pct", type=float,
+                    help="the same as a percentage of the axis range")
+parser.add_argument("--nodeset", help="UA nodeset XML file to load the address space from; "
+                                      "written from the config when missing or out of date")
+parser.add_argument("--metrics-port", type=int,
+                    help="serve Prometheus metrics (tick timing, lag, writes, line modes) on this port at /metrics")
+parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                    help="line event log level; DEBUG shows every motion step")
+parser.add_argument("--log-rate", type=float, default=5.0,
+                    help="max line log messages per second per line (0 = no limit)")
+parser.add_argument("--history", default=",".join(HISTORY_REGISTERS),
+                    help="comma-separated registers to historize for HistoryRead (empty = none)")
+parser.add_argument("--history-size", type=int, default=2000, help="history values kept in memory per node")
+parser.add_argument("--history-db", help="SQLite file for history values that no longer fit in memory")
+parser.add_argument("--history-days", type=float, default=7, help="days of history kept in --history-db")
+parser.add_argument("--trace", help="trace file (.csv, .csv.gz or .parquet) for --mode replay, see Trace.py")
+parser.add_argument("--trace-loop", action="store_true", help="start the trace again when it ends")
+parser.add_argument("--checkpoint", help="SQLite file to snapshot every line's state and registers to")
+parser.add_argument("--checkpoint-interval", type=float, default=5.0, help="seconds between snapshots")
+parser.add_argument("--resume", action="store_true",
+                    help="start the lines from --checkpoint (where they were, mid-sweep) instead of at random")
+parser.add_argument("--security", default="None",
+                    help="comma separated endpoint security modes to offer: None, Sign, SignAndEncrypt "
+                         "(Basic256Sha256)")
+parser.add_argument("--cert-dir", default=CERT_DIR,
+                    help="directory of the server certificate and key; self-signed ones are made if missing")
+args = parser.parse_args()
+security_modes = [mode for mode in args.security.split(",") if mode]
+if not security_modes or any(mode not in SECURITY_MODES for mode in security_modes):
+    parser.error(f"--security takes a comma separated list of {', '.join(SECURITY_MODES)}")
+if args.free_run and args.mode in ("thread", "process"):
+    parser.error("--free-run needs --mode scheduler, vector or replay")
+if args.wake_on_write and args.mode in ("vector", "replay"):
+    # the vector engine steps every line together on its 0.5 s grid, replay follows the trace
+    parser.error("--wake-on-write needs --mode thread, scheduler or process")
+if (args.mode == "replay") != bool(args.trace):
+    parser.error("--mode replay and --trace go together")
+if args.checkpoint and args.mode == "replay":
+    parser.error("--checkpoint does not apply to --mode replay")
+if args.resume and not args.checkpoint:
+    parser.error("--resume needs --checkpoint")
+try:
+    config = load_config(args.config)
+    cli = {key: value for key, value in
+           (("lines", args.lines), ("tick", args.tick), ("time_scale", args.time_scale),
+            ("deadband_abs", args.deadband_abs), ("deadband_pct", args.deadband_pct)) if value is not None}
+    if cli:
+        config = config.replace(**cli)
+    if args.mode == "vector":
+        # the vector engine does not plan sweeps: no SweepETA rather than one that stays 0
+        config = config.replace(registers={name: vtype for name, vtype in config.data["registers"].items()
+                                           if name != "SweepETA"})
+except (OSError, ValueError) as e:
+    parser.error(str(e))
+clock = SimClock(config.time_scale, args.free_run)
+log_listener = setup_logging(args.log_level, args.log_rate)
+metrics = SimMetrics(clock) if args.metrics_port else None
+history_registers = [name for name in args.history.split(",") if name]
+history = None
+if history_registers:
+    spill = SqliteSpill(args.history_db, args.history_days * 86400) if args.history_db else None
+    history = RingHistory(args.history_size, spill)
+resume = load_checkpoint(args.checkpoint) if args.resume else {}  # line number -> state
+# in process mode the workers checkpoint their own lines
+checkpoint = Checkpointer(args.checkpoint, args.checkpoint_interval) \
+    if args.checkpoint and args.mode != "process" else None
+
 # === GLOBAL Server Setup ===
 OPC_HOST = "0.0.0.0"
 OPC_PORT = 4840
@@ -15,386 +117,339 @@ ENDPOINT = f"opc.tcp://{OPC_HOST}:{OPC_PORT}"
 server = Server()
 server.set_endpoint(ENDPOINT)
 server.set_server_name("KEPServerEX Mock")
-uri = "http://example.com/opcua"
+server_cert = setup_server_security(server, security_modes, args.cert_dir)
+uri = config.namespace_uri
 idx = server.register_namespace(uri)
 
-# === GLOBAL start server ===
-server.start()
-print(f"✅ OPC UA Server started at {ENDPOINT}")
-
-def smart_sleep(duration_sec):
-    steps = int(duration_sec / 0.1)
-    for _ in range(steps):
-        if stop_event.is_set():
+def smart_sleep(duration_sec, wake=None):
+    # duration_sec is simulation time; sleep it in tick-sized slices so a stop is
+    # noticed quickly. wake: optional threading.Event that ends the sleep early.
+    remaining = clock.wall(duration_sec)
+    tick = clock.wall(config.tick)
+    while remaining > 1e-9 and not stop_event.is_set():
+        slice_sec = min(tick, remaining)
+        if wake is None:
+            time.sleep(slice_sec)
+        elif wake.wait(slice_sec):
+            wake.clear()
             break
-        time.sleep(0.1)
-
-# === MAIN Simulation Function ===
-def start_line_simulation(line_no: int):
+        remaining -= slice_sec
+
+# === Batched Register Writes ===
+node_vtypes = {}  # NodeId -> VariantType of every register, filled by build_address_space
+
+def write_values_bulk(values):
+    # Same as server.set_attribute_value for each (nodeid, DataValue), but under one
+    # address-space lock, so readers see the whole batch or none of it. Datachange
+    # callbacks (subscriptions) run after the lock is released, like the original.
+    aspace = server.iserver.aspace
+    started = time.perf_counter()
+    fired = []
+    changed = []
+    with aspace._lock:
+        for nodeid, dv in values:
+            attval = aspace._nodes[nodeid].attributes[ua.AttributeIds.Value]
+            old = attval.value
+            attval.value = dv
+            if old.Value != dv.Value:
+                fired.extend((handle, callback, dv) for handle, callback in attval.datachange_callbacks.items())
+                changed.append((nodeid, dv.Value.Value))
+    if history and changed:
+        history.record(values[0][1].SourceTimestamp, changed)
+    if metrics:
+        metrics.observe_write(time.perf_counter() - started, len(values), len(fired))
+    for handle, callback, dv in fired:
+        try:
+            callback(handle, dv)
+        except Exception as e:
+            log.error("❌ Error in datachange callback: %s", e)
+
+def commit_changes(changes):
+    # (node, value) pairs from the vector engine or a trace, one timestamp for all
+    now = clock.utcnow()
+    values = []
+    for node, value in changes:
+        dv = ua.DataValue(ua.Variant(value, node_vtypes[node.nodeid]))
+        dv.SourceTimestamp = now
+        dv.ServerTimestamp = now
+        values.append((node.nodeid, dv))
+    write_values_bulk(values)
+
+def commit_lines(lines):
+    # One bulk write and one source timestamp for everything the lines wrote
+    now = clock.utcnow()
+    values = []
+    for regs in lines:
+        regs.collect(now, values)
+    if values:
+        write_values_bulk(values)
+
+class LineRegisters(RegisterCache):
+    """One line's register cache on the opcua server; writes go out in commit()."""
+
+    def __init__(self, nodes):
+        self.nodeids = {name: node.nodeid for name, node in nodes.items()}
+        super().__init__({name: read_register(nodeid) for name, nodeid in self.nodeids.items()})
+        for name, nodeid in self.nodeids.items():
+            client_write_hooks[nodeid] = lambda value, name=name: self.update(name, value)
+
+    def collect(self, now, values):
+        for name, value in self.take_pending().items():
+            nodeid = self.nodeids[name]
+            dv = ua.DataValue(ua.Variant(value, node_vtypes[nodeid]))
+            dv.SourceTimestamp = now
+            dv.ServerTimestamp = now
+            values.append((nodeid, dv))
+
+    def commit(self):
+        commit_lines([self])
+
+# === Client Write Hook ===
+client_write_hooks = {}  # NodeId -> callback(value), called after a client writes the node
+
+def read_register(nodeid):
+    return server.iserver.aspace.get_attribute_value(nodeid, ua.AttributeIds.Value).Value.Value
+
+def install_client_write_hook():
+    # Every client Write request goes through the attribute service; the
+    # simulator's own writes use write_values_bulk and never pass here.
+    service = server.iserver.attribute_service
+    write = service.write
+
+    def hooked_write(params, *args, **kwargs):
+        results = write(params, *args, **kwargs)
+        if metrics:
+            metrics.client_writes.inc(len(params.NodesToWrite))
+        written = []
+        for write_value, status in zip(params.NodesToWrite, results):
+            if not status.is_good() or write_value.AttributeId != ua.AttributeIds.Value:
+                continue
+            value = write_value.Value.Value.Value
+            written.append((write_value.NodeId, value))
+            hook = client_write_hooks.get(write_value.NodeId)
+            if hook:
+                hook(value)
+        if history and written:
+            # client writes are history too; the simulator's own go through write_values_bulk
+            history.record(clock.utcnow(), written)
+        return results
+
+    service.write = hooked_write
+
+install_client_write_hook()
+
+def submit_command(line_no, writes):
+    # A command method: one bulk write of (register, value) pairs, then the same
+    # hooks a client Write triggers, in order (D0148 / ResetFlag come last)
+    nodes = line_nodes[line_no]
+    commit_changes([(nodes[name], value) for name, value in writes])
+    if metrics:
+        metrics.client_writes.inc(len(writes))
+    for name, value in writes:
+        hook = client_write_hooks.get(nodes[name].nodeid)
+        if hook:
+            hook(value)
+
+# === Address Space (built in bulk before the server starts) ===
+def build_address_space():
+    specs = None
+    if args.nodeset:
+        # the saved nodeset is used only while it matches the config's topology
+        version = topology_version(config)
+        specs = read_nodeset(args.nodeset, idx, version)
+        if specs is not None:
+            print(f"📂 Address space loaded from {args.nodeset}")
+    if specs is None:
+        specs = line_node_specs(config, idx)
+        if args.nodeset:
+            write_nodeset(args.nodeset, specs, uri, idx, version)
+            print(f"💾 Address space saved to {args.nodeset}")
+    add_nodes_bulk(server, specs, idx)
+
+    # line number -> {register name: Node}
+    line_nodes = {}
+    for line_no in config.line_numbers:
+        nodes = {}
+        for name, vtype in config.registers(line_no).items():
+            node = server.get_node(ua.NodeId(config.node_id(line_no, name), idx))
+            node_vtypes[node.nodeid] = getattr(ua.VariantType, vtype)
+            nodes[name] = node
+        line_nodes[line_no] = nodes
+    if history:
+        enable_history(server, history, {nodes[name].nodeid: node_vtypes[nodes[name].nodeid]
+                                         for nodes in line_nodes.values()
+                                         for name in history_registers if name in nodes})
+    return line_nodes
+
+# === MAIN Simulation Function (one thread per line) ===
+line_sims = {}  # line number -> LineSimulation, for the line mode metric
+
+def line_modes():
+    return {line_no: sim.mode for line_no, sim in list(line_sims.items())}
+
+def start_line_simulation(line_no: int, nodes, wake_on_write=False):
     try:
-        # --- Create Folder for This Line ---
-        folder_name = f"LINE{line_no:02d}-MP"
-        line_folder = server.nodes.objects.add_folder(idx, folder_name)
-
-        # --- Create 'ASRS' Subfolder ---
-        asrs_folder = line_folder.add_folder(idx, "ASRS")
-
-        # --- Create Variables inside 'ASRS' ---
-        def add_custom_variable(name: str, datatype):
-            node_id_str = f"{folder_name}.ASRS.{name}"
-            node = asrs_folder.add_variable(ua.NodeId(node_id_str, idx), name, 0, datatype)
-            node.set_writable()
-            node.set_attribute(ua.AttributeIds.DisplayName, ua.DataValue(ua.LocalizedText(f"NS2|String|{node_id_str}")))
-            return node
-
-        # Variables
-        d_registers = {
-            "D0147": ua.VariantType.Int16,
-            "D0148": ua.VariantType.Int16,
-            "D0328": ua.VariantType.UInt16,
-            "Distance_X": ua.VariantType.UInt32,
-            "Distance_Y": ua.VariantType.UInt16,
-            "PresentLevel": ua.VariantType.Int16,
-            "ResetFlag": ua.VariantType.Int16,
-            "D0130": ua.VariantType.Int16,
-            "D0131": ua.VariantType.UInt32,
-            "D0133": ua.VariantType.Int16,
-            "D0134": ua.VariantType.Int16,
-            "D0135": ua.VariantType.UInt32,
-            "D0137": ua.VariantType.Int16,
-            "D0149": ua.VariantType.Int16,
-        }
-        d_nodes = {name: add_custom_variable(name, vtype) for name, vtype in d_registers.items()}
-
-        # X_MIN, X_MAX = 1800, 30000
-        def get_x_min_max():
-            x_min = d_nodes["D0131"].get_value()  # Bay Start
-            x_max = d_nodes["D0135"].get_value()  # Bay End
-            return x_min, x_max
-
-        def get_level_start_end():
-            level_start = d_nodes["D0133"].get_value()  # Level Start
-            level_end = d_nodes["D0137"].get_value()    # Level End
-            return level_start, level_end
-
-        mode = "WAIT"
-        current_level = None
-        phase = None
-
-        randomized_disx = random.randint(5000, 28000)
-        randomized_disy = random.randint(3000, 6000)
-        d_nodes["Distance_X"].set_value(randomized_disx)
-        d_nodes["Distance_Y"].set_value(randomized_disy)
-        calculated_level = ((randomized_disy - 500) // 1000) + 1
-        calculated_level = max(1, min(20, calculated_level))
-        d_nodes["PresentLevel"].set_value(calculated_level)
-
-        print(f"[Line{line_no:02d}] 🎲 Random Start Distance_X: {randomized_disx}, Distance_Y: {randomized_disy}, Level: {calculated_level}")
-
+        regs = LineRegisters(nodes)
+        sim = LineSimulation(line_no, regs, config.settings(line_no), resume.get(line_no))
+        line_sims[line_no] = sim
+        regs.commit()
+        wake = None
+        if wake_on_write:
+            wake = threading.Event()
+            regs.wake = wake.set
         try:
+            due = clock.now()
             while not stop_event.is_set():
-                X_STEP = random.randint(900, 1100)
-                Y_STEP = random.randint(230, 270)
-                X_MIN, X_MAX = get_x_min_max()
-                level_start, level_end = get_level_start_end()
-                d148 = d_nodes["D0148"].get_value()
-                reset_flag = d_nodes["ResetFlag"].get_value()
-                x = d_nodes["Distance_X"].get_value()
-
-                if reset_flag == 1:
-                    print(f"[Line{line_no:02d}] 🔄 RESET FLAG TRIGGERED!")
-                    randomized_disx = random.randint(5000, 28000)
-                    randomized_disy = random.randint(3000, 6000)
-                    d_nodes["Distance_X"].set_value(randomized_disx)
-                    d_nodes["Distance_Y"].set_value(randomized_disy)
-                    calculated_level = ((randomized_disy - 500) // 1000) + 1
-                    calculated_level = max(1, min(20, calculated_level))
-                    d_nodes["PresentLevel"].set_value(calculated_level)
-                    print(f"[Line{line_no:02d}] 🎲 Reset_flag Random Start Distance_X: {randomized_disx}, Distance_Y: {randomized_disy}, Level: {calculated_level}")
-                    d_nodes["D0148"].set_value(0)
-                    d_nodes["D0328"].set_value(0)
-                    d_nodes["D0147"].set_value(0)
-                    d_nodes["ResetFlag"].set_value(0)
-                    d_nodes["D0130"].set_value(0)
-                    d_nodes["D0131"].set_value(0)
-                    d_nodes["D0133"].set_value(0)
-                    d_nodes["D0134"].set_value(0)
-                    d_nodes["D0135"].set_value(0)
-                    d_nodes["D0137"].set_value(0)
-                    current_level = None
-                    mode = "WAIT"
-                    continue
-
-                if d148 == 36:
-                    d_nodes["D0328"].set_value(76)
-                    d_nodes["D0147"].set_value(76)
-                    print(f"[Line{line_no:02d}] 🔄 Waiting mode triggered by D148 = 36 → Hold status 76")
-                    smart_sleep(0.5)
-                    continue
-
-                if d148 == 37:
-                    d_nodes["D0328"].set_value(0)
-                    d_nodes["D0147"].set_value(0)
-                    current_level = None
-                    print(f"[Line{line_no:02d}] ⛔ Emergency STOP (D0148 = 37)")
-                    smart_sleep(0.5)
-                    d_nodes["D0148"].set_value(0)
-                    mode = "WAIT"
-                    continue
-
-                if d148 == 10 and mode == "WAIT":
-                    print(f"[Line{line_no:02d}] 🚀 Start moving to Start Bay/Level (D0148 = 10)")
-                    mode = "Touring"
-                    continue        
-
-                if d148 == 35 and mode == "WAIT":
-                    print(f"[Line{line_no:02d}] 🚀 Start Free Move (D0148 = 35)")
-                    # อ่านจุดเป้าหมายปลายทางอย่างเดียว
-                    free_move_end_x = d_nodes["D0135"].get_value()
-                    free_move_end_level = d_nodes["D0137"].get_value()
-                    free_move_end_y = 500 + (free_move_end_level - 1) * 1000
-
-                    mode = "FREE_MOVING"
-                    continue
-
-                if d148 == 38 and mode == "READY_TO_MOVE":
-                    print(f"[Line{line_no:02d}] 🚀 Starting MOVING phase after PREP")
-                    d_nodes["D0328"].set_value(7)
-                    d_nodes["D0147"].set_value(7)
-                    mode = "MOVING"
-                    continue
-
-                if d148 == 38 and mode == "WAIT":
-                    d_nodes["D0328"].set_value(78)
-                    d_nodes["D0147"].set_value(78)
-                    time.sleep(1)
-
-                    start_level = level_start
-                    target_level = level_end
-
-                    if (
-                        start_level <= 0 or target_level <= 0 or
-                        start_level > 19 or target_level > 19 or
-                        start_level > target_level
-                    ):
-                        print(f"[Line{line_no:02d}] ❌ Invalid level range")
-                        d_nodes["D0133"].set_value(0)
-                        d_nodes["D0137"].set_value(0)
-                        d_nodes["D0148"].set_value(0)
-                        continue
-
-                    current_level = start_level
-                    start_y_position = 500 + (start_level - 1) * 1000
-                    d_nodes["PresentLevel"].set_value(current_level)
-                    d_nodes["Distance_Y"].set_value(start_y_position)
-                    d_nodes["D0328"].set_value(2)
-                    d_nodes["D0147"].set_value(2)
-                    print(f"[Line{line_no:02d}] 🎲 PREP START: Distance_X = {randomized_disx} → Decrease to 1800")
-                    mode = "PREP"
-                    continue
-
-                if mode == "PREP":
-                    if x > X_MIN:
-                        new_x = max(X_MIN, x - X_STEP)
-                        d_nodes["Distance_X"].set_value(new_x)
-                        print(f"[Line{line_no:02d}] ⬅️ PREP: Distance_X → {new_x}")
-                    else:
-                        print(f"[Line{line_no:02d}] ✅ Ready to start MOVING")
-                        d_nodes["D0328"].set_value(7)
-                        d_nodes["D0147"].set_value(7)
-                        phase = "MOVE_X"
-                        mode = "MOVING"
-                    smart_sleep(0.5)
-                    continue
-
-                if mode == "MOVING":
-                    if phase == "MOVE_X":
-                        relative_index = current_level - level_start
-                        direction = "RIGHT" if relative_index % 2 == 0 else "LEFT"
-                        x_target = X_MAX if direction == "RIGHT" else X_MIN
-                        print(f"[Line{line_no:02d}] MOVE_X → level: {current_level}, x: {x}, direction: {direction}, x_target: {x_target}, phase: {phase}, mode: {mode}")
-
-                        if (direction == "RIGHT" and x < x_target) or (direction == "LEFT" and x > x_target):
-                            step = X_STEP if direction == "RIGHT" else -X_STEP
-                            new_x = min(X_MAX, x + step) if step > 0 else max(X_MIN, x + step)
-                            d_nodes["Distance_X"].set_value(new_x)
-                            d_nodes["D0147"].set_value(7)
-                            d_nodes["D0328"].set_value(7)
-                            #print(f"{'➡️' if direction == 'RIGHT' else '⬅️'} MOVE_X → {new_x}")
-                        else:
-                            if current_level >= level_end:
-                                print(f"[Line{line_no:02d}] 🏁 Reached final level → STOPPED")
-                                d_nodes["D0328"].set_value(0)
-                                d_nodes["D0147"].set_value(0)
-                                mode = "STOPPED"
-                            else:
-                                phase = "MOVE_Y"
-                                print(f"[Line{line_no:02d}] ↕️ Start MOVE_Y (ขึ้นชั้น)")
-                        smart_sleep(0.5)
-                        continue
-
-                    if phase == "MOVE_Y":
-                        y_current = d_nodes["Distance_Y"].get_value()
-                        next_level = current_level + 1
-                        y_target = start_y_position + (next_level - level_start) * 1000
-                        print(f"[Line{line_no:02d}] MOVE_Y → level: {current_level}, Target level: {next_level}, y: {y_current}, y_target: {y_target}, phase: {phase}, mode: {mode}")
-                        if y_current < y_target:
-                            new_y = min(y_target, y_current + Y_STEP)
-                            d_nodes["Distance_Y"].set_value(new_y)
-                            calculated_level = int((new_y - 500) / 1000) + 1
-                            calculated_level = max(1, min(20, calculated_level))
-                            d_nodes["PresentLevel"].set_value(calculated_level)
-                            d_nodes["D0147"].set_value(2)
-                            d_nodes["D0328"].set_value(2)
-                            #print(f"⬆️ MOVE_Y → {new_y}")
-                        else:
-                            current_level = next_level
-                            d_nodes["PresentLevel"].set_value(current_level)
-                            d_nodes["D0147"].set_value(7)
-                            d_nodes["D0328"].set_value(7)
-                            print(f"[Line{line_no:02d}] ✅ Reached Level {current_level} → Back to MOVE_X")
-                            phase = "MOVE_X"
-                        smart_sleep(0.5)
-                        continue
-
-                if mode == "Touring":
-                    x_target = d_nodes["D0131"].get_value()
-                    level_target = d_nodes["D0133"].get_value()
-                    expected_y = 500 + (level_target - 1) * 1000
-
-                    x_current = d_nodes["Distance_X"].get_value()
-                    y_current = d_nodes["Distance_Y"].get_value()
-
-                    # --- Step 1: ขยับ X ให้ตรงเป้า ---
-                    if x_current != x_target:
-                        step = X_STEP if x_current < x_target else -X_STEP
-                        next_x = x_current + step
-
-                        # ✅ ถ้าขยับแล้วเกินเป้า ให้ตั้งตรงเป้าเลย
-                        if (step > 0 and next_x > x_target) or (step < 0 and next_x < x_target):
-                            next_x = x_target
-
-                        d_nodes["Distance_X"].set_value(next_x)
-                        d_nodes["D0147"].set_value(2)
-                        d_nodes["D0328"].set_value(2)
-                        print(f"[Line{line_no:02d}] ➡️ Touring Moving X: {next_x}")
-
-                    # --- Step 2: พอ X ถึงแล้ว ขยับ Y ---
-                    elif y_current != expected_y:
-                        step = Y_STEP if y_current < expected_y else -Y_STEP
-                        next_y = y_current + step
-
-                        # ✅ ถ้าขยับแล้วเกินเป้า ให้ตั้งตรงเป้าเลย
-                        if (step > 0 and next_y > expected_y) or (step < 0 and next_y < expected_y):
-                            next_y = expected_y
-
-                        d_nodes["Distance_Y"].set_value(next_y)
-
-                        # อัปเดต PresentLevel ด้วย (เพื่อความแม่น)
-                        calculated_level = int((next_y - 500) / 1000) + 1
-                        calculated_level = max(1, min(20, calculated_level))
-                        d_nodes["PresentLevel"].set_value(calculated_level)
-
-                        d_nodes["D0147"].set_value(2)
-                        d_nodes["D0328"].set_value(2)
-                        print(f"[Line{line_no:02d}] ⬆️ Touring Moving Y: {next_y}")
-
-                    # --- Step 3: X,Y ถึงเป้าแล้ว ---
-                    else:
-                        print(f"[Line{line_no:02d}] 🎯 Touring Completed. Reset D0148, D0147, D0328")
-                        d_nodes["D0148"].set_value(0)
-                        d_nodes["D0147"].set_value(0)
-                        d_nodes["D0328"].set_value(0)
-                        mode = "WAIT"
-                        phase = None
-
-                    smart_sleep(0.5)
-                    continue
-
-                if mode == "FREE_MOVING":
-                    moved = False
-
-                    x_current = d_nodes["Distance_X"].get_value()
-                    y_current = d_nodes["Distance_Y"].get_value()
-
-                    if x_current != free_move_end_x:
-                        X_STEP = random.randint(900, 1100)
-                        step = X_STEP if x_current < free_move_end_x else -X_STEP
-                        next_x = x_current + step
-
-                        if (step > 0 and next_x > free_move_end_x) or (step < 0 and next_x < free_move_end_x):
-                            next_x = free_move_end_x
-
-                        d_nodes["Distance_X"].set_value(next_x)
-                        d_nodes["D0147"].set_value(2)
-                        d_nodes["D0328"].set_value(2)
-                        print(f"[Line{line_no:02d}] ➡️ Free Moving X: {next_x}")
-                        moved = True
-
-                    if y_current != free_move_end_y:
-                        Y_STEP = random.randint(230, 270)
-                        step = Y_STEP if y_current < free_move_end_y else -Y_STEP
-                        next_y = y_current + step
-
-                        if (step > 0 and next_y > free_move_end_y) or (step < 0 and next_y < free_move_end_y):
-                            next_y = free_move_end_y
-
-                        d_nodes["Distance_Y"].set_value(next_y)
-                        calculated_level = int((next_y - 500) / 1000) + 1
-                        calculated_level = max(1, min(20, calculated_level))
-                        d_nodes["PresentLevel"].set_value(calculated_level)
-                        d_nodes["D0147"].set_value(2)
-                        d_nodes["D0328"].set_value(2)
-                        print(f"[Line{line_no:02d}] ⬆️ Free Moving Y: {next_y}")
-                        moved = True
-
-                    if moved:
-                        smart_sleep(0.5)
-                    else:
-                        print(f"[Line{line_no:02d}] 🎯 Free Move Completed. Reset only status")
-                        d_nodes["D0147"].set_value(0)
-                        d_nodes["D0328"].set_value(0)
-                        d_nodes["D0148"].set_value(0)
-                        mode = "WAIT"
-                        phase = None
-                    continue
-
-                if current_level is not None and current_level > level_end:
-                    # ✅ ดักทิศของชั้นสุดท้าย
-                    final_level = level_end
-                    final_direction = "RIGHT" if final_level % 2 == 1 else "LEFT"
-                    stop_at_x = X_MAX if final_direction == "RIGHT" else X_MIN
-
-                    if (final_direction == "RIGHT" and x < stop_at_x) or (final_direction == "LEFT" and x > stop_at_x):
-                        # ยังเดินไปไม่สุด → ดำเนินต่อ
-                        step = X_STEP if final_direction == "RIGHT" else -X_STEP
-                        new_x = x + step
-                        d_nodes["Distance_X"].set_value(new_x)
-                        print(f"[Line{line_no:02d}] ⏩ Final Step → Distance_X = {new_x}")
-                    else:
-                        # ✅ หยุดทันทีเมื่อถึงปลายทางที่ถูกต้อง
-                        d_nodes["D0328"].set_value(0)
-                        d_nodes["D0147"].set_value(0)
-                        print(f"[Line{line_no:02d}] 🏁 Reached final X at final Level → STOPPED")
-                        mode = "STOPPED"
-
-                smart_sleep(0.5)
-                continue
-
+                lateness = max(0.0, clock.now() - due)
+                mode, started = sim.mode, time.perf_counter()
+                delay = sim.step()
+                regs.commit()
+                if checkpoint:
+                    checkpoint.offer([sim])
+                if metrics:
+                    seconds = time.perf_counter() - started
+                    metrics.observe_step(line_no, seconds, mode, sim.mode)
+                    metrics.observe_tick(seconds, clock.wall(lateness), clock.wall(config.tick))
+                due = clock.now() + delay
+                smart_sleep(delay, wake if sim.interruptible else None)
         except KeyboardInterrupt:
             print("🛑 Server Interrupted by Keyboard")
-            return 
+            return
     except Exception as e:
-        print(f"❌ Error on Line {line_no}: {e}")
+        log.error("❌ Error on Line %s: %s", line_no, e)
         return
 
-# === Start 8 Threads ===
-threads = []
-for line_no in range(1, 9):
-    t = threading.Thread(target=start_line_simulation, args=(line_no,))
+# === Scheduler Mode (all lines on one tick loop) ===
+def start_scheduler(line_nodes, tick, workers, wake_on_write=False):
+    lines = []
+    for line_no, nodes in line_nodes.items():
+        try:
+            regs = LineRegisters(nodes)
+            lines.append(LineSimulation(line_no, regs, config.settings(line_no), resume.get(line_no)))
+            line_sims[line_no] = lines[-1]
+        except Exception as e:
+            log.error("❌ Error on Line %s: %s", line_no, e)
+    commit_lines([sim.regs for sim in lines])
+    print(f"⏱️ Scheduler: {len(lines)} lines, tick {tick}s, {workers} worker(s), "
+          f"{'free-run' if clock.free_run else f'{clock.scale}x'}")
+    def commit(sims):
+        commit_lines([sim.regs for sim in sims])
+        if checkpoint:
+            checkpoint.offer(sims)
+
+    scheduler = TickScheduler(lines, tick=tick, workers=workers, stop_event=stop_event,
+                              commit=commit, clock=clock, metrics=metrics)
+    if wake_on_write:
+        for sim in lines:
+            sim.regs.wake = lambda sim=sim: scheduler.wake(sim)
+    t = threading.Thread(target=scheduler.run)
+    t.daemon = True
+    t.start()
+    return t
+
+# === Vector Mode (all lines as NumPy arrays) ===
+def start_vector_engine(line_nodes):
+    from VectorSim import INPUT_REGISTERS, VectorEngine
+
+    line_numbers = list(line_nodes)
+    node_maps = list(line_nodes.values())
+    engine = VectorEngine(line_numbers, node_maps, commit=commit_changes,
+                          settings=[config.settings(line_no) for line_no in line_numbers], states=resume)
+    for i, d_nodes in enumerate(node_maps):
+        for name in INPUT_REGISTERS:
+            nodeid = d_nodes[name].nodeid
+            engine.set_input(i, name, read_register(nodeid))
+            client_write_hooks[nodeid] = lambda value, i=i, name=name: engine.set_input(i, name, value)
+    if metrics:
+        metrics.add_line_modes(engine.line_modes)
+    t = threading.Thread(target=engine.run, args=(stop_event, clock, metrics, checkpoint))
+    t.daemon = True
+    t.start()
+    return t
+
+# === Replay Mode (a recorded trace drives the nodes) ===
+def start_replay(line_nodes):
+    from Trace import TraceReplayer
+
+    replayer = TraceReplayer(args.trace, line_nodes, commit=commit_changes, loop=args.trace_loop)
+    print(f"🎞️ Replaying {args.trace} at {'free-run' if clock.free_run else f'{clock.scale}x'}")
+    t = threading.Thread(target=replayer.run, args=(stop_event, clock))
+    t.daemon = True
+    t.start()
+    return t
+
+# === Process Mode (lines on worker processes, registers in shared memory) ===
+def start_process_pool(line_nodes):
+    from Shard import ShardPool
+
+    pool = ShardPool(config, args.processes, args.wake_on_write, args.log_level, args.log_rate,
+                     checkpoint=args.checkpoint, checkpoint_interval=args.checkpoint_interval, states=resume)
+    atexit.register(pool.stop)
+    nodeids = [{name: node.nodeid for name, node in nodes.items()} for nodes in line_nodes.values()]
+    for row, nodes in enumerate(nodeids):
+        for name, nodeid in nodes.items():
+            client_write_hooks[nodeid] = lambda value, row=row, name=name: pool.client_write(row, name, value)
+    print(f"🧩 {len(line_nodes)} lines on {len(pool.procs)} worker process(es), {clock.scale}x")
+
+    def publish():
+        # Copy what the workers wrote into the address space once per tick
+        interval = clock.wall(config.tick)
+        while not stop_event.wait(interval):
+            changes = pool.poll()
+            if not changes:
+                continue
+            now = clock.utcnow()
+            values = []
+            for row, name, value in changes:
+                nodeid = nodeids[row][name]
+                dv = ua.DataValue(ua.Variant(value, node_vtypes[nodeid]))
+                dv.SourceTimestamp = now
+                dv.ServerTimestamp = now
+                values.append((nodeid, dv))
+            write_values_bulk(values)
+
+    t = threading.Thread(target=publish)
     t.daemon = True
     t.start()
-    threads.append(t)
+    return t
+
+# === Build Address Space, then start server ===
+build_start = time.perf_counter()
+line_nodes = build_address_space()
+if resume:
+    # registers first, so clients never see the lines at zero; the lines then read them back
+    commit_changes([(nodes[name], value) for line_no, nodes in line_nodes.items() if line_no in resume
+                    for name, value in resume[line_no].get("registers", {}).items() if name in nodes])
+if args.mode != "replay":
+    add_command_methods(server, idx, config, submit_command)
+build_sec = time.perf_counter() - build_start
+server.start()
+print(f"✅ OPC UA Server started at {ENDPOINT} with {len(line_nodes)} lines "
+      f"(address space built in {build_sec:.2f}s)")
+print(f"🔒 Security: {', '.join(security_modes)}" + (f" (certificate {server_cert})" if server_cert else ""))
+if metrics:
+    metrics.add_server(server)
+    if args.mode in ("thread", "scheduler"):
+        metrics.add_line_modes(line_modes)
+    metrics.serve(args.metrics_port)
+    print(f"📈 Metrics at http://{OPC_HOST}:{args.metrics_port}/metrics")
+
+# === Start Lines ===
+threads = []
+if args.mode == "scheduler":
+    threads.append(start_scheduler(line_nodes, config.tick, args.workers, args.wake_on_write))
+elif args.mode == "vector":
+    threads.append(start_vector_engine(line_nodes))
+elif args.mode == "replay":
+    threads.append(start_replay(line_nodes))
+elif args.mode == "process":
+    threads.append(start_process_pool(line_nodes))
+else:
+    for line_no, nodes in line_nodes.items():
+        t = threading.Thread(target=start_line_simulation, args=(line_no, nodes, args.wake_on_write))
+        t.daemon = True
+        t.start()
+        threads.append(t)
 
 # === Keep Running ===
 try:
@@ -404,5 +459,8 @@ except KeyboardInterrupt:
     print("🛑 Main Thread: KeyboardInterrupt detected → Sending stop event...")
     stop_event.set()
 finally:
+    if checkpoint:
+        checkpoint.stop()
     server.stop()
+    log_listener.stop()
     print("✅ OPC UA Server stopped")
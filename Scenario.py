@@ -0,0 +1,376 @@
+from asyncua import Client, ua
+from asyncua.crypto.security_policies import SecurityPolicyBasic256Sha256
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+from Commands import COMMANDS, record_writes
+from LineConfig import load_config, read_data_file
+from Security import CERT_DIR, CLIENT_URI, SECURITY_MODES, ensure_certificate
+
+# Disable debug logs
+logging.getLogger("asyncua").setLevel(logging.ERROR)
+
+STEP_ACTIONS = ("command", "wait", "assert", "sleep")
+STEP_OPTIONS = ("label", "timeout")
+# D0148 codes a scenario may use instead of the command names
+D0148_COMMANDS = {10: "Tour", 35: "FreeMove", 36: "Hold", 37: "Stop", 38: "StartAudit"}
+DEFAULT_TIMEOUT = 30.0
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def parse_lines(text):
+    """Line numbers from "1-200,250"."""
+    lines = []
+    for part in text.split(","):
+        first, _, last = part.strip().partition("-")
+        lines.extend(range(int(first), int(last or first) + 1))
+    return lines
+
+
+# === Scenario Files ===
+def matches(expected, value):
+    # 5: equal; [78, 2]: any of them; {min: 2, max: 4}: in the range (either end may be left out)
+    if value is None:
+        return False
+    if isinstance(expected, list):
+        return value in expected
+    if isinstance(expected, dict):
+        return expected.get("min", value) <= value <= expected.get("max", value)
+    return value == expected
+
+
+def describe(expected):
+    if isinstance(expected, list):
+        return "|".join(map(str, expected))
+    if isinstance(expected, dict):
+        return f"{expected.get('min', '')}..{expected.get('max', '')}"
+    return str(expected)
+
+
+class Step:
+    """One scenario step: a command, a wait or assert on registers, or a sleep."""
+
+    def __init__(self, index, data, default_timeout):
+        actions = [key for key in STEP_ACTIONS if key in data]
+        if len(actions) != 1:
+            raise ValueError(f"scenario step {index}: needs exactly one of {', '.join(STEP_ACTIONS)}")
+        self.index = index
+        self.action = actions[0]
+        self.timeout = float(data.get("timeout", default_timeout))
+        self.command = self.args = self.condition = self.seconds = None
+        options = {self.action, *STEP_OPTIONS}
+
+        if self.action == "command":
+            name = D0148_COMMANDS.get(data["command"], data["command"])
+            if name not in COMMANDS:
+                raise ValueError(f"scenario step {index}: unknown command {data['command']!r} "
+                                 f"(use {', '.join(COMMANDS)} or D0148 {', '.join(map(str, D0148_COMMANDS))})")
+            self.command, arguments = COMMANDS[name]
+            names = [arg[0] for arg in arguments]
+            missing = [arg for arg in names if arg not in data]
+            if missing:
+                raise ValueError(f"scenario step {index}: {name} needs {', '.join(missing)}")
+            self.args = [int(data[arg]) for arg in names]
+            options.update(names)
+            label = f"{name}({', '.join(map(str, self.args))})"
+        elif self.action in ("wait", "assert"):
+            self.condition = data[self.action]
+            if not isinstance(self.condition, dict) or not self.condition:
+                raise ValueError(f"scenario step {index}: {self.action} takes register: expected value pairs")
+            label = f"{self.action} " + ", ".join(f"{name}={describe(expected)}"
+                                                  for name, expected in self.condition.items())
+        else:
+            self.seconds = float(data["sleep"])
+            label = f"sleep {self.seconds:g}s"
+
+        unknown = set(data) - options
+        if unknown:
+            raise ValueError(f"scenario step {index}: unknown keys {', '.join(sorted(unknown))}")
+        self.label = data.get("label", label)
+
+    @property
+    def registers(self):
+        return list(self.condition or ())
+
+
+class Scenario:
+    """Steps every line runs on its own, from a .json, .yaml or .toml file.
+
+    Top level keys: name, repeat (rounds per line, default 1), timeout
+    (seconds a wait may take, default 30) and steps, each with one of:
+
+      command: StartAudit, Tour, FreeMove, Stop, Reset, or the D0148 code,
+               with the arguments of the command method (levelStart, ...)
+      wait:    {register: expected, ...} until all hold, or timeout
+      assert:  {register: expected, ...} must hold now
+      sleep:   seconds
+
+    Expected values are a number, a list of allowed numbers, or
+    {min: ..., max: ...}. Any step may set its own label and timeout.
+    """
+
+    KEYS = ("name", "repeat", "timeout", "steps")
+
+    def __init__(self, data, name="scenario"):
+        unknown = set(data) - set(self.KEYS)
+        if unknown:
+            raise ValueError(f"scenario: unknown keys {', '.join(sorted(unknown))}")
+        self.name = data.get("name", name)
+        self.repeat = int(data.get("repeat", 1))
+        timeout = float(data.get("timeout", DEFAULT_TIMEOUT))
+        self.steps = [Step(index, step, timeout) for index, step in enumerate(data.get("steps") or [], 1)]
+        if not self.steps:
+            raise ValueError("scenario: no steps")
+        self.registers = sorted({name for step in self.steps for name in step.registers})
+
+
+def load_scenario(path):
+    data = read_data_file(path, "scenario")
+    return Scenario(data or {}, os.path.splitext(os.path.basename(path))[0])
+
+
+# === Running a Line ===
+class LineRun:
+    """One line working through the scenario; values come from its session's subscription."""
+
+    def __init__(self, line_no, settings, vtypes):
+        self.line_no = line_no
+        self.tag = f"[Line{line_no:02d}]"
+        self.settings = settings
+        self.vtypes = vtypes  # register name -> variant type name
+        self.nodes = {}       # register name -> Node, filled in by the session
+        self.values = {}
+        self.waiting = None   # (condition, future) of the wait in progress
+        self.timings = {}     # step index -> [seconds]
+        self.failures = {}    # step index -> count
+        self.rounds = 0
+        self.failed = False
+
+    def notify(self, name, value):
+        self.values[name] = value
+        if self.waiting and not self.waiting[1].done() and self.holds(self.waiting[0]):
+            self.waiting[1].set_result(True)
+
+    def holds(self, condition):
+        return all(matches(expected, self.values.get(name)) for name, expected in condition.items())
+
+    def show(self, condition):
+        return ", ".join(f"{name}={self.values.get(name)}" for name in condition)
+
+    async def wait_for(self, condition, timeout):
+        # checked on every notification: one publish can carry 78, 2 and 7 for
+        # D0328, and a wait for 78 must still see it
+        if self.holds(condition):
+            return True
+        future = asyncio.get_running_loop().create_future()
+        self.waiting = (condition, future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting = None
+
+    async def step(self, client, step):
+        """Run one step; returns an error message, or None when it passed."""
+        if step.action == "command":
+            try:
+                writes = step.command(self.settings, *step.args)
+            except ValueError as e:
+                return str(e)
+            await client.write_values(
+                [self.nodes[name] for name, _ in writes],
+                [ua.Variant(value, getattr(ua.VariantType, self.vtypes[name])) for name, value in writes])
+            record_writes(writes, self.notify)
+        elif step.action == "wait":
+            if not await self.wait_for(step.condition, step.timeout):
+                return f"timed out after {step.timeout:g}s ({self.show(step.condition)})"
+        elif step.action == "assert":
+            if not self.holds(step.condition):
+                return f"failed ({self.show(step.condition)})"
+        else:
+            await asyncio.sleep(step.seconds)
+        return None
+
+    async def run(self, client, scenario, rounds, until, keep_going):
+        # rounds: how many times; until: perf_counter time to keep repeating to instead (soak)
+        while (time.perf_counter() < until) if until else (self.rounds < rounds):
+            for step in scenario.steps:
+                started = time.perf_counter()
+                try:
+                    error = await self.step(client, step)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                if error is None:
+                    self.timings.setdefault(step.index, []).append(time.perf_counter() - started)
+                    continue
+                self.failures[step.index] = self.failures.get(step.index, 0) + 1
+                self.failed = True
+                print(f"❌ {self.tag} round {self.rounds + 1}, step {step.index} {step.label}: {error}")
+                if not keep_going:
+                    return
+                break
+            self.rounds += 1
+
+
+# === Sessions ===
+class ScenarioSession:
+    """One OPC UA session and subscription for a group of lines."""
+
+    def __init__(self, url, config, namespace, runs, registers, publish_ms, security="None", cert_dir=CERT_DIR,
+                 server_certificate=None):
+        self.client = Client(url, timeout=10)
+        self.config = config
+        self.namespace = namespace
+        self.runs = runs
+        self.registers = registers
+        self.publish_ms = publish_ms
+        self.security = security
+        self.cert_dir = cert_dir
+        self.server_certificate = server_certificate
+        self.watched = {}  # NodeId -> (LineRun, register)
+        self.subscription = None
+
+    def node(self, line_no, name):
+        return self.client.get_node(ua.NodeId(self.config.node_id(line_no, name), self.namespace))
+
+    def datachange_notification(self, node, val, data):
+        run, name = self.watched[node.nodeid]
+        run.notify(name, val)
+
+    async def connect(self):
+        if self.security != "None":
+            self.client.application_uri = CLIENT_URI
+            cert_path, key_path = ensure_certificate("client", CLIENT_URI, self.cert_dir)
+            await self.client.set_security(SecurityPolicyBasic256Sha256, cert_path, key_path,
+                                           server_certificate=self.server_certificate,
+                                           mode=getattr(ua.MessageSecurityMode, self.security))
+        await self.client.connect()
+        for run in self.runs:
+            run.nodes = {name: self.node(run.line_no, name) for name in run.vtypes}
+            for name in self.registers:
+                self.watched[run.nodes[name].nodeid] = (run, name)
+        self.subscription = await self.client.create_subscription(self.publish_ms, self)
+        nodes = [run.nodes[name] for run in self.runs for name in self.registers]
+        if nodes:
+            await self.subscription.subscribe_data_change(nodes)
+
+    async def close(self):
+        try:
+            if self.subscription:
+                await self.subscription.delete()
+        except Exception:
+            pass
+        try:
+            await self.client.disconnect()
+        except Exception:
+            pass
+
+
+# === Report ===
+def report(scenario, runs, elapsed):
+    print()
+    print(f"{'step':>4} {'label':<40} {'ok':>6} {'fail':>5} {'p50 ms':>8} {'p90 ms':>8} {'max ms':>8}")
+    steps = []
+    for step in scenario.steps:
+        seconds = [value for run in runs for value in run.timings.get(step.index, ())]
+        failures = sum(run.failures.get(step.index, 0) for run in runs)
+        ms = {q: round(1000 * percentile(seconds, q), 1) if seconds else None for q in (50, 90, 100)}
+        steps.append({"step": step.index, "label": step.label, "ok": len(seconds), "failed": failures,
+                      "p50_ms": ms[50], "p90_ms": ms[90], "max_ms": ms[100]})
+        print(f"{step.index:>4} {step.label[:40]:<40} {len(seconds):>6} {failures:>5} "
+              f"{ms[50] if seconds else '-':>8} {ms[90] if seconds else '-':>8} {ms[100] if seconds else '-':>8}")
+    failed = [run.line_no for run in runs if run.failed]
+    rounds = sum(run.rounds for run in runs)
+    print(f"{'✅' if not failed else '❌'} {scenario.name}: {len(runs) - len(failed)}/{len(runs)} lines passed, "
+          f"{rounds} rounds in {elapsed:.1f}s")
+    return {"scenario": scenario.name, "lines": len(runs), "failed_lines": failed, "rounds": rounds,
+            "elapsed_s": round(elapsed, 1), "steps": steps}
+
+
+async def run_scenario(args, config, scenario, lines):
+    runs = [LineRun(line_no, config.settings(line_no), config.registers(line_no)) for line_no in lines]
+    sessions = [ScenarioSession(args.url, config, args.namespace, runs[i::args.sessions], scenario.registers,
+                                args.publish_ms, args.security, args.cert_dir, args.server_cert)
+                for i in range(min(args.sessions, len(runs)))]
+    try:
+        await asyncio.gather(*(session.connect() for session in sessions))
+        print(f"🔌 {len(sessions)} session(s) to {args.url}, {len(runs)} lines, scenario {scenario.name}")
+        # first values of every watched register, so asserts at the start see the line
+        ready = {name: {"min": -2 ** 63} for name in scenario.registers}
+        waiting = await asyncio.gather(*(run.wait_for(ready, args.connect_timeout) for run in runs))
+        missing = [run.line_no for run, ok in zip(runs, waiting) if not ok]
+        if missing:
+            raise RuntimeError(f"no values for lines {', '.join(map(str, missing))}")
+
+        rounds = args.repeat if args.repeat is not None else scenario.repeat
+        started = time.perf_counter()
+        until = started + args.duration if args.duration else None
+        tasks = [run.run(session.client, scenario, rounds, until, args.keep_going)
+                 for session in sessions for run in session.runs]
+        await asyncio.gather(*tasks)
+        return report(scenario, runs, time.perf_counter() - started)
+    finally:
+        await asyncio.gather(*(session.close() for session in sessions))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a command scenario on many lines of an OPC UA server at once, "
+                                                 "without the Control.py web UI")
+    parser.add_argument("scenario", help="scenario file (.json, .yaml or .toml), see scenario.example.toml")
+    parser.add_argument("--url", default="opc.tcp://127.0.0.1:4840", help="server endpoint")
+    parser.add_argument("--config", help="plant topology file naming the lines and registers")
+    parser.add_argument("--lines", help="lines to run, e.g. 1-200,250 (overrides the config)")
+    parser.add_argument("--namespace", type=int, default=2, help="namespace index of the register NodeIds")
+    parser.add_argument("--sessions", type=int, default=1, help="client sessions to spread the lines over")
+    parser.add_argument("--publish-ms", type=int, default=100, help="subscription publishing interval")
+    parser.add_argument("--repeat", type=int, help="rounds per line (overrides the scenario)")
+    parser.add_argument("--duration", type=float, help="keep starting rounds for this many seconds (soak test)")
+    parser.add_argument("--keep-going", action="store_true",
+                        help="after a failed step, start the next round instead of stopping the line")
+    parser.add_argument("--connect-timeout", type=float, default=30,
+                        help="seconds to wait for the first values of every line")
+    parser.add_argument("--security", default="None", choices=list(SECURITY_MODES),
+                        help="endpoint security mode (Basic256Sha256)")
+    parser.add_argument("--cert-dir", default=CERT_DIR, help="directory of the client certificate and key")
+    parser.add_argument("--server-cert", help="server certificate file; saves the endpoint lookup")
+    parser.add_argument("--json", help="also write the step timings to this file")
+    args = parser.parse_args()
+    if args.sessions < 1:
+        parser.error("--sessions must be at least 1")
+    try:
+        config = load_config(args.config)
+        if args.lines:
+            config = config.replace(lines=sorted(set(parse_lines(args.lines))))
+        scenario = load_scenario(args.scenario)
+        lines = config.line_numbers
+        for line_no in lines:
+            missing = set(scenario.registers) - set(config.registers(line_no))
+            if missing:
+                raise ValueError(f"line {line_no} has no {', '.join(sorted(missing))}")
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    try:
+        result = asyncio.run(run_scenario(args, config, scenario, lines))
+    except KeyboardInterrupt:
+        print("🛑 Scenario interrupted")
+        sys.exit(130)
+    except (OSError, RuntimeError, asyncio.TimeoutError, ua.UaError) as e:
+        print(f"❌ {type(e).__name__}: {e}")
+        sys.exit(2)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    sys.exit(1 if result["failed_lines"] else 0)
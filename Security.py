@@ -0,0 +1,99 @@
+import ipaddress
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+from opcua import Client, ua
+from opcua.crypto import security_policies
+
+# --security names; the signed and encrypted ones are Basic256Sha256, as on our KEPServerEX
+SECURITY_MODES = {
+    "None": ua.SecurityPolicyType.NoSecurity,
+    "Sign": ua.SecurityPolicyType.Basic256Sha256_Sign,
+    "SignAndEncrypt": ua.SecurityPolicyType.Basic256Sha256_SignAndEncrypt,
+}
+CERT_DIR = "certs"
+CLIENT_URI = "urn:srm-mock:client"
+
+
+# === Self-Signed Certificates ===
+def ensure_certificate(name, application_uri, cert_dir=CERT_DIR, days=3650):
+    """(certificate .der, private key .pem) paths for name in cert_dir, made on first use.
+
+    RSA 2048 / SHA-256, self-signed, with the application URI, this host name,
+    localhost and 127.0.0.1 as subject alternative names, which is what
+    OPC UA stacks check. Trust the .der on the other side (e.g. KEPServerEX
+    OPC UA Configuration → Trusted Clients).
+    """
+    cert_path = os.path.join(cert_dir, f"{name}_cert.der")
+    key_path = os.path.join(cert_dir, f"{name}_key.pem")
+    if os.path.exists(cert_path) and os.path.exists(key_path):
+        return cert_path, key_path
+
+    os.makedirs(cert_dir, exist_ok=True)
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    hostname = socket.gethostname()
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, f"{name}@{hostname}")])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=days))
+        .add_extension(x509.SubjectAlternativeName([
+            x509.UniformResourceIdentifier(application_uri),
+            x509.DNSName(hostname),
+            x509.DNSName("localhost"),
+            x509.IPAddress(ipaddress.ip_address("127.0.0.1")),
+        ]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
+        .add_extension(x509.KeyUsage(digital_signature=True, content_commitment=True, key_encipherment=True,
+                                     data_encipherment=True, key_agreement=False, key_cert_sign=True,
+                                     crl_sign=False, encipher_only=False, decipher_only=False), critical=True)
+        .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.SERVER_AUTH, ExtendedKeyUsageOID.CLIENT_AUTH]),
+                       critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.DER))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    os.chmod(key_path, 0o600)
+    return cert_path, key_path
+
+
+# === Server and Client Setup ===
+def setup_server_security(server, modes, cert_dir=CERT_DIR):
+    """Offer endpoints for the given SECURITY_MODES names; returns the server certificate path or None."""
+    server.set_security_policy([SECURITY_MODES[mode] for mode in modes])
+    if all(mode == "None" for mode in modes):
+        return None
+    cert_path, key_path = ensure_certificate("server", server.get_application_uri(), cert_dir)
+    server.load_certificate(cert_path)
+    server.load_private_key(key_path)
+    return cert_path
+
+
+def secure_client(url, mode="None", cert_dir=CERT_DIR, server_certificate=None, timeout=10):
+    """opcua Client for url using one of the SECURITY_MODES.
+
+    server_certificate: path of the server's certificate. Without it the
+    client first asks the server for its endpoints, one extra connection.
+    Keep the returned client connected and reuse it: opening the secure
+    channel and session is where the security policy costs the most.
+    """
+    client = Client(url, timeout=timeout)
+    if mode != "None":
+        client.application_uri = CLIENT_URI
+        cert_path, key_path = ensure_certificate("client", CLIENT_URI, cert_dir)
+        client.set_security(security_policies.SecurityPolicyBasic256Sha256, cert_path, key_path,
+                            server_certificate, getattr(ua.MessageSecurityMode, mode))
+    return client
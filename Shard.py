@@ -0,0 +1,263 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from Checkpoint import Checkpointer
+from LineConfig import PlantConfig
+from SimEngine import LineSimulation, RegisterCache, SimClock, TickScheduler
+from SimLog import setup_logging
+
+log = logging.getLogger("sim")
+
+
+# === Shared Register Table ===
+class ShardTable:
+    """Register values of every line in one shared memory block, as int64 arrays.
+
+    values[line, col]     last value a worker wrote
+    written[line, col]    bumped by the worker on every write of that cell
+    line_seq[line]        odd while the worker is writing the line (seqlock)
+    inputs[line, col]     last value a client wrote
+    input_seq[line, col]  bumped by the server on every client write
+
+    Each array has a single writer (worker or server), so no locks are needed;
+    the server copies a line's cells only while its line_seq is even and
+    unchanged around the copy.
+    """
+
+    ARRAYS = ("values", "written", "inputs", "input_seq")
+
+    def __init__(self, shm, lines, columns):
+        self.shm = shm
+        self.lines = lines
+        self.columns = columns
+        offset = 0
+        for name in self.ARRAYS:
+            setattr(self, name, np.ndarray((lines, columns), dtype=np.int64, buffer=shm.buf, offset=offset))
+            offset += lines * columns * 8
+        self.line_seq = np.ndarray((lines,), dtype=np.int64, buffer=shm.buf, offset=offset)
+
+    @classmethod
+    def size(cls, lines, columns):
+        return (len(cls.ARRAYS) * lines * columns + lines) * 8
+
+    @classmethod
+    def create(cls, lines, columns):
+        shm = shared_memory.SharedMemory(create=True, size=cls.size(lines, columns))
+        table = cls(shm, lines, columns)
+        for name in cls.ARRAYS:
+            getattr(table, name)[:] = 0
+        table.line_seq[:] = 0
+        return table
+
+    @classmethod
+    def attach(cls, name, lines, columns):
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            # the server owns the block; without this the worker's resource
+            # tracker would unlink it when the worker exits
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return cls(shm, lines, columns)
+
+    def close(self, unlink=False):
+        for name in self.ARRAYS + ("line_seq",):
+            setattr(self, name, None)
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+# === Worker Process ===
+class ShardRegisters(RegisterCache):
+    """One line's register cache in a worker; commit() publishes to the shared table."""
+
+    def __init__(self, table, row, columns):
+        self.table = table
+        self.row = row
+        self.columns = columns  # register name -> column
+        super().__init__({name: int(table.values[row, col]) for name, col in columns.items()})
+
+    def commit(self):
+        pending = self.take_pending()
+        if not pending:
+            return
+        table, row = self.table, self.row
+        table.line_seq[row] += 1  # odd: writing
+        for name, value in pending.items():
+            col = self.columns[name]
+            table.values[row, col] = value
+            table.written[row, col] += 1
+        table.line_seq[row] += 1  # even: consistent again
+
+
+def poll_inputs(table, lines, seen, stop_event, interval):
+    # Client writes reach the worker's caches as update(), like the server's write hook
+    rows = [regs.row for regs in lines]
+    names = {regs.row: {col: name for name, col in regs.columns.items()} for regs in lines}
+    by_row = {regs.row: regs for regs in lines}
+    while not stop_event.wait(interval):
+        changed = np.nonzero(table.input_seq[rows] != seen)
+        for i, col in zip(*changed):
+            row = rows[i]
+            seen[i, col] = table.input_seq[row, col]
+            name = names[row].get(col)
+            if name is not None:
+                by_row[row].update(name, int(table.inputs[row, col]))
+
+
+def run_worker(spec):
+    """Entry point of one worker process; spec comes from ShardPool as JSON on stdin."""
+    setup_logging(spec["log_level"], spec["log_rate"])
+    config = PlantConfig(spec["config"])
+    columns = spec["columns"]
+    table = ShardTable.attach(spec["shm"], len(config.line_numbers), len(columns))
+    clock = SimClock(config.time_scale)
+    stop_event = threading.Event()
+
+    states = {int(line_no): state for line_no, state in spec["states"].items()}
+    checkpoint = Checkpointer(spec["checkpoint"], spec["checkpoint_interval"]) if spec["checkpoint"] else None
+
+    lines = []
+    sims = []
+    for row in spec["rows"]:
+        line_no = config.line_numbers[row]
+        regs = ShardRegisters(table, row, {name: columns.index(name) for name in config.registers(line_no)})
+        sims.append(LineSimulation(line_no, regs, config.settings(line_no), states.get(line_no)))
+        regs.commit()
+        lines.append(regs)
+
+    def commit(stepped):
+        for sim in stepped:
+            sim.regs.commit()
+        if checkpoint:
+            checkpoint.offer(stepped)
+
+    scheduler = TickScheduler(sims, tick=config.tick, stop_event=stop_event, clock=clock, commit=commit)
+    if spec["wake_on_write"]:
+        for sim in sims:
+            sim.regs.wake = lambda sim=sim: scheduler.wake(sim)
+    # zeros: client writes made while this worker was starting are applied too
+    seen = np.zeros((len(lines), len(columns)), dtype=np.int64)
+    threading.Thread(target=poll_inputs, daemon=True,
+                     args=(table, lines, seen, stop_event, max(0.001, clock.wall(config.tick)))).start()
+
+    # the server holds our stdin open; EOF means it has stopped (or died)
+    def watch_parent():
+        sys.stdin.read()
+        stop_event.set()
+
+    threading.Thread(target=watch_parent, daemon=True).start()
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        if checkpoint:
+            checkpoint.stop()
+        table.close()
+
+
+# === Server Side ===
+class ShardPool:
+    """Worker processes that each run a slice of the lines, sharing registers through a ShardTable.
+
+    Workers are started as `python Shard.py` rather than with multiprocessing,
+    so the server script is never re-imported in them (it has no __main__
+    guard). poll() returns the cells the workers wrote since the last call.
+    With checkpoint, each worker snapshots its own lines to that file; states
+    (line number -> state, from a checkpoint) resumes lines instead of
+    starting them at random.
+    """
+
+    def __init__(self, config, processes, wake_on_write=False, log_level="INFO", log_rate=5.0,
+                 checkpoint=None, checkpoint_interval=5.0, states=None):
+        self.config = config
+        self.columns = sorted({name for line_no in config.line_numbers for name in config.registers(line_no)})
+        self.column_of = {name: col for col, name in enumerate(self.columns)}
+        self.table = ShardTable.create(len(config.line_numbers), len(self.columns))
+        self.seen = np.zeros_like(self.table.written)
+        states = states or {}
+        for row, line_no in enumerate(config.line_numbers):
+            # the workers start from these values; the server has already published them
+            for name, value in states.get(line_no, {}).get("registers", {}).items():
+                if name in self.column_of:
+                    self.table.values[row, self.column_of[name]] = value
+        processes = max(1, min(processes, len(config.line_numbers)))
+        data = dict(config.data, lines=config.line_numbers,
+                    overrides={str(line_no): line for line_no, line in config.overrides.items()})
+        self.procs = []
+        for shard in range(processes):
+            spec = {
+                "shm": self.table.shm.name,
+                "config": data,
+                "columns": self.columns,
+                "rows": list(range(shard, len(config.line_numbers), processes)),
+                "states": {str(config.line_numbers[row]): states[config.line_numbers[row]]
+                           for row in range(shard, len(config.line_numbers), processes)
+                           if config.line_numbers[row] in states},
+                "checkpoint": checkpoint,
+                "checkpoint_interval": checkpoint_interval,
+                "wake_on_write": wake_on_write,
+                "log_level": log_level,
+                "log_rate": log_rate,
+            }
+            proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE, text=True)
+            proc.stdin.write(json.dumps(spec) + "\n")
+            proc.stdin.flush()
+            self.procs.append(proc)
+
+    def client_write(self, row, name, value):
+        col = self.column_of[name]
+        self.table.inputs[row, col] = value
+        self.table.input_seq[row, col] += 1
+
+    def poll(self):
+        """(row, register name, value) for every cell written since the last poll."""
+        table = self.table
+        dirty_rows = np.flatnonzero((table.written != self.seen).any(axis=1))
+        changes = []
+        for row in dirty_rows.tolist():
+            seq = table.line_seq[row]
+            if seq % 2:
+                continue  # being written; next poll
+            written = table.written[row].copy()
+            values = table.values[row].copy()
+            if table.line_seq[row] != seq:
+                continue
+            for col in np.flatnonzero(written != self.seen[row]).tolist():
+                changes.append((row, self.columns[col], int(values[col])))
+            self.seen[row] = written
+        return changes
+
+    def alive(self):
+        return sum(proc.poll() is None for proc in self.procs)
+
+    def stop(self):
+        if self.table is None:
+            return
+        for proc in self.procs:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+        for proc in self.procs:
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        self.table.close(unlink=True)
+        self.table = None
+
+
+if __name__ == "__main__":
+    run_worker(json.loads(sys.stdin.readline()))
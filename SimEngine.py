@@ -0,0 +1,747 @@
+import heapq
+import logging
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("sim")
+
+# Registers under LINEnn-MP.ASRS, by OPC UA variant type name
+D_REGISTERS = {
+    "D0147": "Int16",
+    "D0148": "Int16",
+    "D0328": "UInt16",
+    "Distance_X": "UInt32",
+    "Distance_Y": "UInt16",
+    "PresentLevel": "Int16",
+    "ResetFlag": "Int16",
+    "D0130": "Int16",
+    "D0131": "UInt32",
+    "D0133": "Int16",
+    "D0134": "Int16",
+    "D0135": "UInt32",
+    "D0137": "Int16",
+    "D0149": "Int16",
+    "SweepETA": "UInt32",   # planned seconds left of the running audit sweep (0 = none)
+}
+
+# Motion settings of one line; LineConfig can override them per plant or per line
+LINE_SETTINGS = {
+    "x_step": (900, 1100),      # Distance_X per step, random in this range
+    "y_step": (230, 270),       # Distance_Y per step, random in this range
+    "max_level": 19,            # highest level an audit sweep may use
+    "max_present_level": 20,    # PresentLevel is clamped to 1..this
+    "step_time": 0.5,           # one motion step, simulation seconds
+    "prep_hold_time": 1.0,      # status 78 shown before PREP starts
+    "deadband_abs": 0,          # Distance_X/Y moves up to this are not published (0 = every change)
+    "deadband_pct": 0.0,        # the same in % of the axis range (X 0..30000, Y up to the top level)
+}
+
+X_RANGE = 30000  # Distance_X span used by deadband_pct
+
+# LineSimulation attributes saved in a checkpoint, next to the register values
+STATE_FIELDS = ("mode", "phase", "current_level", "start_y_position", "free_move_end_x",
+                "free_move_end_y", "prep_levels", "randomized_disx")
+
+# === Simulation Clock ===
+class SimClock:
+    """Simulation time for the drivers.
+
+    scale > 1 runs simulation time faster than the wall clock (10 = 10x). With
+    free_run there is no waiting at all: a central loop advances the clock
+    straight to its next event, so a sweep runs as fast as the CPU allows.
+    """
+
+    def __init__(self, scale=1.0, free_run=False):
+        if scale <= 0:
+            raise ValueError("time scale must be positive")
+        self.scale = scale
+        self.free_run = free_run
+        self.started = time.monotonic()
+        self.started_utc = datetime.now(timezone.utc)
+        self.virtual = 0.0
+
+    def now(self):
+        """Simulation seconds since the clock started."""
+        if self.free_run:
+            return self.virtual
+        return (time.monotonic() - self.started) * self.scale
+
+    def wall(self, seconds):
+        """Wall-clock seconds to wait for the given simulation seconds."""
+        return 0.0 if self.free_run else seconds / self.scale
+
+    def advance(self, until):
+        # free_run only: jump simulation time forward
+        self.virtual = max(self.virtual, until)
+
+    def utcnow(self):
+        """Simulation time as a UTC timestamp, used as SourceTimestamp."""
+        return self.started_utc + timedelta(seconds=self.now())
+
+
+# Registers whose client writes are commands the line should react to at once
+COMMAND_REGISTERS = ("D0148", "ResetFlag")
+
+# === Register Cache ===
+class RegisterCache:
+    """One line's registers as plain attributes (regs.D0148) for LineSimulation.
+
+    Simulator writes go through set(): the attribute changes at once and the
+    value waits in pending until the driver commits it to the address space.
+    Client writes come in through update() from the server's write hook, so
+    the hot loop never reads back through the address space. If wake is set,
+    it is called after a client writes one of the COMMAND_REGISTERS.
+
+    Only changes are written: setting a register to the value it already has
+    is a no-op. Registers with a deadband (set_deadband) are published only
+    when they move more than the deadband from the last published value; a
+    held-back value is published once the register stops changing, so the
+    final position always arrives.
+
+    A client write drops any simulator write of the same register still in
+    pending, so a later commit cannot put the old value back over the
+    client's; lock makes that atomic with set() and take_pending(), which
+    run on the simulator thread.
+    """
+
+    def __init__(self, values):
+        self.names = tuple(values)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wake = None
+        self.deadbands = {}  # name -> threshold
+        self.published = {}  # name -> last value taken for the address space (deadbanded only)
+        self.held = {}       # name -> value held back by the deadband
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def set(self, name, value):
+        with self.lock:
+            if getattr(self, name) == value:
+                return
+            setattr(self, name, value)
+            self.pending[name] = value
+
+    def update(self, name, value):
+        with self.lock:
+            setattr(self, name, value)
+            self.pending.pop(name, None)
+            if name in self.deadbands:
+                self.published[name] = value
+                self.held.pop(name, None)
+        if self.wake and name in COMMAND_REGISTERS:
+            self.wake()
+
+    def set_deadband(self, name, threshold):
+        self.deadbands[name] = threshold
+        self.published[name] = getattr(self, name)
+
+    def take_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if self.deadbands:
+                self._apply_deadbands(pending)
+        return pending
+
+    def _apply_deadbands(self, pending):
+        for name, threshold in self.deadbands.items():
+            if name in pending:
+                value = pending[name]
+                if abs(value - self.published[name]) <= threshold:
+                    del pending[name]
+                    self.held[name] = value
+                    continue
+                self.held.pop(name, None)
+                self.published[name] = value
+            elif name in self.held:
+                # no new value this step: the axis stopped, publish where it stopped
+                pending[name] = self.published[name] = self.held.pop(name)
+
+
+# === Sweep Planner ===
+def level_at(y, max_present_level):
+    calculated_level = int((y - 500) / 1000) + 1
+    return max(1, min(max_present_level, calculated_level))
+
+
+class SweepPlan:
+    """A PREP + MOVING audit sweep compiled into one row per step.
+
+    The serpentine path depends only on the bays and levels (D0131/D0135,
+    D0133/D0137) and the random step sizes, so it is worked out once when the
+    sweep starts and each step just takes the next row. A row is (mode, phase,
+    current_level, Distance_X, Distance_Y, PresentLevel, status), with None
+    for registers that step does not write. level_eta: simulation seconds
+    from the start of the plan until each level's pass is done. A sweep
+    longer than LIMIT rows is cut short; unplanned then estimates the
+    seconds after the last row from the mean step sizes.
+    """
+
+    LIMIT = 100_000  # rows planned at once; a longer sweep is planned again when they run out
+
+    def __init__(self, sim, bounds):
+        regs = sim.regs
+        x_min, x_max, level_start, level_end = bounds
+        self.bounds = bounds
+        mode, phase, current_level = sim.mode, sim.phase, sim.current_level
+        x, y = regs.Distance_X, regs.Distance_Y
+        rows = []
+        level_steps = {}
+        while len(rows) < self.LIMIT and mode != "STOPPED":
+            new_x = new_y = level = status = None
+            if mode == "PREP":
+                if x > x_min:
+                    x = new_x = max(x_min, x - random.randint(*sim.x_step))
+                else:
+                    status, phase, mode = 7, "MOVE_X", "MOVING"
+            elif phase == "MOVE_X":
+                right = (current_level - level_start) % 2 == 0
+                if right and x < x_max:
+                    x = new_x = min(x_max, x + random.randint(*sim.x_step))
+                    status = 7
+                elif not right and x > x_min:
+                    x = new_x = max(x_min, x - random.randint(*sim.x_step))
+                    status = 7
+                else:
+                    level_steps[current_level] = len(rows) + 1
+                    if current_level >= level_end:
+                        status, mode = 0, "STOPPED"
+                    else:
+                        phase = "MOVE_Y"
+            else:
+                next_level = current_level + 1
+                y_target = sim.start_y_position + (next_level - level_start) * 1000
+                if y < y_target:
+                    y = new_y = min(y_target, y + random.randint(*sim.y_step))
+                    level = level_at(y, sim.max_present_level)
+                    status = 2
+                else:
+                    current_level = level = next_level
+                    status = 7
+                    phase = "MOVE_X"
+            rows.append((mode, phase, current_level, new_x, new_y, level, status))
+        self.rows = rows
+        self.index = 0
+        self.step_time = sim.step_time
+        self.level_eta = {level: steps * sim.step_time for level, steps in level_steps.items()}
+        self.unplanned = 0.0
+        if mode != "STOPPED":
+            self.unplanned = self._steps_after(sim, mode, phase, current_level, x, y) * sim.step_time
+
+    def _steps_after(self, sim, mode, phase, current_level, x, y):
+        # Rows the sweep still needs after a cut-short plan, at the mean step sizes
+        x_min, x_max, level_start, level_end = self.bounds
+        mean_x, mean_y = sum(sim.x_step) / 2, sum(sim.y_step) / 2
+        full_pass = math.ceil((x_max - x_min) / mean_x) + 1  # moves, then the row that ends the pass
+        steps = 0
+        if mode == "PREP":
+            steps += math.ceil(max(0, x - x_min) / mean_x) + 1
+            x, phase = x_min, "MOVE_X"
+        if phase == "MOVE_X":
+            right = (current_level - level_start) % 2 == 0
+            steps += math.ceil(max(0, x_max - x if right else x - x_min) / mean_x) + 1
+        else:
+            y_target = sim.start_y_position + (current_level + 1 - level_start) * 1000
+            steps += math.ceil(max(0, y_target - y) / mean_y) + 1 + full_pass
+            current_level += 1
+        return steps + (level_end - current_level) * (math.ceil(1000 / mean_y) + 1 + full_pass)
+
+    @property
+    def done(self):
+        return self.index >= len(self.rows)
+
+    def remaining(self):
+        """Simulation seconds left of the sweep, rounded up."""
+        return math.ceil((len(self.rows) - self.index) * self.step_time + self.unplanned)
+
+    def next(self):
+        row = self.rows[self.index]
+        self.index += 1
+        return row
+
+
+# === Line State Machine ===
+class LineSimulation:
+    """SRM line state machine that runs one step at a time.
+
+    step() runs the line until it has to wait and returns that wait in seconds,
+    so the same object works with its own thread or with a shared TickScheduler.
+    Waits are in simulation seconds; the driver's SimClock maps them to wall time.
+    settings overrides entries of LINE_SETTINGS. state, from snapshot(), resumes
+    a checkpointed line instead of starting at a random position.
+    """
+
+    def __init__(self, line_no: int, regs, settings=None, state=None):
+        self.line_no = line_no
+        self.regs = regs
+        self.tag = f"[Line{line_no:02d}]"
+        # one logger per line, so SimLog can rate-limit each line on its own
+        self.log = logging.getLogger(f"sim.line{line_no:02d}")
+
+        settings = dict(LINE_SETTINGS, **(settings or {}))
+        self.x_step = tuple(settings["x_step"])
+        self.y_step = tuple(settings["y_step"])
+        self.max_level = settings["max_level"]
+        self.max_present_level = settings["max_present_level"]
+        self.step_time = settings["step_time"]
+        self.prep_hold_time = settings["prep_hold_time"]
+        deadband_abs, deadband_pct = settings["deadband_abs"], settings["deadband_pct"]
+        if deadband_abs or deadband_pct:
+            y_range = 500 + (self.max_present_level - 1) * 1000
+            for name, span in (("Distance_X", X_RANGE), ("Distance_Y", y_range)):
+                regs.set_deadband(name, max(deadband_abs, deadband_pct / 100 * span))
+
+        self.mode = "WAIT"
+        self.phase = None
+        self.current_level = None
+        self.start_y_position = None
+        self.free_move_end_x = None
+        self.free_move_end_y = None
+        self.prep_levels = None
+        self.randomized_disx = None
+        self.plan = None  # SweepPlan while in PREP / MOVING; planned again after a resume
+
+        if state is None:
+            disx, disy, level = self.randomize_position()
+            self.log.info("%s 🎲 Random Start Distance_X: %s, Distance_Y: %s, Level: %s", self.tag, disx, disy, level)
+        else:
+            self.restore(state)
+            self.log.info("%s ♻️ Resumed %s at Distance_X: %s, Distance_Y: %s, Level: %s", self.tag, self.mode,
+                          regs.Distance_X, regs.Distance_Y, regs.PresentLevel)
+
+    def snapshot(self):
+        """State machine and register values as a JSON-friendly dict."""
+        state = {field: getattr(self, field) for field in STATE_FIELDS}
+        state["registers"] = {name: getattr(self.regs, name) for name in self.regs.names}
+        return state
+
+    def restore(self, state):
+        regs = self.regs
+        for name, value in state.get("registers", {}).items():
+            if name in regs.names:
+                regs.set(name, value)
+        for field in STATE_FIELDS:
+            if field in state:
+                setattr(self, field, state[field])
+        if self.prep_levels is not None:
+            self.prep_levels = tuple(self.prep_levels)
+        if self.randomized_disx is None:
+            self.randomized_disx = regs.Distance_X
+
+    def randomize_position(self):
+        regs = self.regs
+        self.randomized_disx = random.randint(5000, 28000)
+        randomized_disy = random.randint(3000, 6000)
+        regs.set("Distance_X", self.randomized_disx)
+        regs.set("Distance_Y", randomized_disy)
+        calculated_level = ((randomized_disy - 500) // 1000) + 1
+        calculated_level = max(1, min(self.max_present_level, calculated_level))
+        regs.set("PresentLevel", calculated_level)
+        return self.randomized_disx, randomized_disy, calculated_level
+
+    @property
+    def interruptible(self):
+        # The 1 s status-78 hold and the 37 stop hold always run their full time
+        return self.mode not in ("PREP_WAIT", "STOPPING")
+
+    def step(self):
+        """Run until the line has to wait; return the wait in seconds."""
+        delay = 0
+        while delay == 0:
+            delay = self._iterate()
+        return delay
+
+    def _drop_plan(self):
+        self.plan = None
+        if "SweepETA" in self.regs.names:
+            self.regs.set("SweepETA", 0)
+
+    def _follow(self, plan):
+        # One step of a planned sweep: write the next row
+        regs = self.regs
+        mode, phase, current_level, x, y, level, status = plan.next()
+        if x is not None:
+            regs.set("Distance_X", x)
+        if y is not None:
+            regs.set("Distance_Y", y)
+        if level is not None:
+            regs.set("PresentLevel", level)
+        if status is not None:
+            regs.set("D0328", status)
+            regs.set("D0147", status)
+        if "SweepETA" in regs.names:
+            regs.set("SweepETA", plan.remaining())
+
+        if mode != self.mode:
+            if mode == "MOVING":
+                self.log.info("%s ✅ Ready to start MOVING", self.tag)
+            else:
+                self.log.info("%s 🏁 Reached final level → STOPPED", self.tag)
+                self.plan = None
+        elif phase != self.phase:
+            self.log.debug("%s ↕️ %s at level %s", self.tag, phase, current_level)
+        else:
+            self.log.debug("%s %s %s → Distance_X: %s, Distance_Y: %s", self.tag, mode, phase or "",
+                           regs.Distance_X, regs.Distance_Y)
+        self.mode, self.phase, self.current_level = mode, phase, current_level
+        return self.step_time
+
+    def _iterate(self):
+        # One pass of the original per-line loop. "continue" returns 0 and
+        # smart_sleep(n) returns n, so the driver decides how to wait.
+        regs = self.regs
+        tag = self.tag
+        log = self.log
+
+        # --- Finish branches that slept half way through ---
+        if self.mode == "STOPPING":
+            regs.set("D0148", 0)
+            self.mode = "WAIT"
+            return 0
+
+        if self.mode == "PREP_WAIT":
+            start_level, target_level = self.prep_levels
+            self.mode = "WAIT"
+
+            if (
+                start_level <= 0 or target_level <= 0 or
+                start_level > self.max_level or target_level > self.max_level or
+                start_level > target_level
+            ):
+                log.warning("%s ❌ Invalid level range", tag)
+                regs.set("D0133", 0)
+                regs.set("D0137", 0)
+                regs.set("D0148", 0)
+                return 0
+
+            self.current_level = start_level
+            self.start_y_position = 500 + (start_level - 1) * 1000
+            regs.set("PresentLevel", self.current_level)
+            regs.set("Distance_Y", self.start_y_position)
+            regs.set("D0328", 2)
+            regs.set("D0147", 2)
+            log.info("%s 🎲 PREP START: Distance_X = %s → Decrease to 1800", tag, self.randomized_disx)
+            self.mode = "PREP"
+            return 0
+
+        X_STEP = random.randint(*self.x_step)
+        Y_STEP = random.randint(*self.y_step)
+        # commands before their bounds: a command method writes the bounds first,
+        # so a line that sees the new D0148 also sees the bounds that came with it
+        d148 = regs.D0148
+        reset_flag = regs.ResetFlag
+        X_MIN = regs.D0131  # Bay Start
+        X_MAX = regs.D0135  # Bay End
+        level_start = regs.D0133  # Level Start
+        level_end = regs.D0137    # Level End
+        x = regs.Distance_X
+        mode = self.mode
+
+        if reset_flag == 1:
+            log.info("%s 🔄 RESET FLAG TRIGGERED!", tag)
+            disx, disy, level = self.randomize_position()
+            log.info("%s 🎲 Reset_flag Random Start Distance_X: %s, Distance_Y: %s, Level: %s", tag, disx, disy, level)
+            for name in ("D0148", "D0328", "D0147", "ResetFlag", "D0130",
+                         "D0131", "D0133", "D0134", "D0135", "D0137"):
+                regs.set(name, 0)
+            self._drop_plan()
+            self.current_level = None
+            self.mode = "WAIT"
+            return 0
+
+        if d148 == 36:
+            regs.set("D0328", 76)
+            regs.set("D0147", 76)
+            log.debug("%s 🔄 Waiting mode triggered by D148 = 36 → Hold status 76", tag)
+            return self.step_time
+
+        if d148 == 37:
+            regs.set("D0328", 0)
+            regs.set("D0147", 0)
+            self.current_level = None
+            self._drop_plan()
+            log.info("%s ⛔ Emergency STOP (D0148 = 37)", tag)
+            # D0148 is cleared after the hold, see STOPPING above
+            self.mode = "STOPPING"
+            return self.step_time
+
+        if d148 == 10 and mode == "WAIT":
+            log.info("%s 🚀 Start moving to Start Bay/Level (D0148 = 10)", tag)
+            self.mode = "Touring"
+            return 0
+
+        if d148 == 35 and mode == "WAIT":
+            log.info("%s 🚀 Start Free Move (D0148 = 35)", tag)
+            # อ่านจุดเป้าหมายปลายทางอย่างเดียว
+            self.free_move_end_x = regs.D0135
+            free_move_end_level = regs.D0137
+            self.free_move_end_y = 500 + (free_move_end_level - 1) * 1000
+            self.mode = "FREE_MOVING"
+            return 0
+
+        if d148 == 38 and mode == "READY_TO_MOVE":
+            log.info("%s 🚀 Starting MOVING phase after PREP", tag)
+            regs.set("D0328", 7)
+            regs.set("D0147", 7)
+            self.mode = "MOVING"
+            return 0
+
+        if d148 == 38 and mode == "WAIT":
+            regs.set("D0328", 78)
+            regs.set("D0147", 78)
+            # Level range is checked after the 1 s hold, see PREP_WAIT above
+            self.prep_levels = (level_start, level_end)
+            self.mode = "PREP_WAIT"
+            return self.prep_hold_time
+
+        if mode == "PREP" or (mode == "MOVING" and self.phase in ("MOVE_X", "MOVE_Y")):
+            bounds = (X_MIN, X_MAX, level_start, level_end)
+            plan = self.plan
+            if plan is None or plan.done or plan.bounds != bounds:
+                # new sweep, resumed sweep, or a client moved the bounds: plan from here
+                plan = self.plan = SweepPlan(self, bounds)
+                log.info("%s 🗺️ Sweep planned: %s steps, ETA %ss, levels done at %s", tag, len(plan.rows),
+                         plan.remaining(), ", ".join(f"{level}:{eta:g}s" for level, eta in plan.level_eta.items()))
+            return self._follow(plan)
+
+        if mode == "Touring":
+            x_target = regs.D0131
+            level_target = regs.D0133
+            expected_y = 500 + (level_target - 1) * 1000
+
+            x_current = regs.Distance_X
+            y_current = regs.Distance_Y
+
+            # --- Step 1: ขยับ X ให้ตรงเป้า ---
+            if x_current != x_target:
+                step = X_STEP if x_current < x_target else -X_STEP
+                next_x = x_current + step
+
+                # ✅ ถ้าขยับแล้วเกินเป้า ให้ตั้งตรงเป้าเลย
+                if (step > 0 and next_x > x_target) or (step < 0 and next_x < x_target):
+                    next_x = x_target
+
+                regs.set("Distance_X", next_x)
+                regs.set("D0147", 2)
+                regs.set("D0328", 2)
+                log.debug("%s ➡️ Touring Moving X: %s", tag, next_x)
+
+            # --- Step 2: พอ X ถึงแล้ว ขยับ Y ---
+            elif y_current != expected_y:
+                step = Y_STEP if y_current < expected_y else -Y_STEP
+                next_y = y_current + step
+
+                # ✅ ถ้าขยับแล้วเกินเป้า ให้ตั้งตรงเป้าเลย
+                if (step > 0 and next_y > expected_y) or (step < 0 and next_y < expected_y):
+                    next_y = expected_y
+
+                regs.set("Distance_Y", next_y)
+
+                # อัปเดต PresentLevel ด้วย (เพื่อความแม่น)
+                calculated_level = int((next_y - 500) / 1000) + 1
+                calculated_level = max(1, min(self.max_present_level, calculated_level))
+                regs.set("PresentLevel", calculated_level)
+
+                regs.set("D0147", 2)
+                regs.set("D0328", 2)
+                log.debug("%s ⬆️ Touring Moving Y: %s", tag, next_y)
+
+            # --- Step 3: X,Y ถึงเป้าแล้ว ---
+            else:
+                log.info("%s 🎯 Touring Completed. Reset D0148, D0147, D0328", tag)
+                regs.set("D0148", 0)
+                regs.set("D0147", 0)
+                regs.set("D0328", 0)
+                self.mode = "WAIT"
+                self.phase = None
+
+            return self.step_time
+
+        if mode == "FREE_MOVING":
+            moved = False
+            free_move_end_x = self.free_move_end_x
+            free_move_end_y = self.free_move_end_y
+
+            x_current = regs.Distance_X
+            y_current = regs.Distance_Y
+
+            if x_current != free_move_end_x:
+                X_STEP = random.randint(*self.x_step)
+                step = X_STEP if x_current < free_move_end_x else -X_STEP
+                next_x = x_current + step
+
+                if (step > 0 and next_x > free_move_end_x) or (step < 0 and next_x < free_move_end_x):
+                    next_x = free_move_end_x
+
+                regs.set("Distance_X", next_x)
+                regs.set("D0147", 2)
+                regs.set("D0328", 2)
+                log.debug("%s ➡️ Free Moving X: %s", tag, next_x)
+                moved = True
+
+            if y_current != free_move_end_y:
+                Y_STEP = random.randint(*self.y_step)
+                step = Y_STEP if y_current < free_move_end_y else -Y_STEP
+                next_y = y_current + step
+
+                if (step > 0 and next_y > free_move_end_y) or (step < 0 and next_y < free_move_end_y):
+                    next_y = free_move_end_y
+
+                regs.set("Distance_Y", next_y)
+                calculated_level = int((next_y - 500) / 1000) + 1
+                calculated_level = max(1, min(self.max_present_level, calculated_level))
+                regs.set("PresentLevel", calculated_level)
+                regs.set("D0147", 2)
+                regs.set("D0328", 2)
+                log.debug("%s ⬆️ Free Moving Y: %s", tag, next_y)
+                moved = True
+
+            if moved:
+                return self.step_time
+
+            log.info("%s 🎯 Free Move Completed. Reset only status", tag)
+            regs.set("D0147", 0)
+            regs.set("D0328", 0)
+            regs.set("D0148", 0)
+            self.mode = "WAIT"
+            self.phase = None
+            return 0
+
+        if self.current_level is not None and self.current_level > level_end:
+            # ✅ ดักทิศของชั้นสุดท้าย
+            final_level = level_end
+            final_direction = "RIGHT" if final_level % 2 == 1 else "LEFT"
+            stop_at_x = X_MAX if final_direction == "RIGHT" else X_MIN
+
+            if (final_direction == "RIGHT" and x < stop_at_x) or (final_direction == "LEFT" and x > stop_at_x):
+                # ยังเดินไปไม่สุด → ดำเนินต่อ
+                step = X_STEP if final_direction == "RIGHT" else -X_STEP
+                new_x = x + step
+                regs.set("Distance_X", new_x)
+                log.debug("%s ⏩ Final Step → Distance_X = %s", tag, new_x)
+            else:
+                # ✅ หยุดทันทีเมื่อถึงปลายทางที่ถูกต้อง
+                regs.set("D0328", 0)
+                regs.set("D0147", 0)
+                log.info("%s 🏁 Reached final X at final Level → STOPPED", tag)
+                self.mode = "STOPPED"
+
+        return self.step_time
+
+
+# === Central Tick Scheduler ===
+class TickScheduler:
+    """Drives many LineSimulation objects from one loop on a fixed tick.
+
+    Lines sit in a heap keyed by the tick they next want to run, so each tick
+    only touches the lines that are due. With workers > 1 the due lines of a
+    tick are stepped on a small thread pool. commit, if given, is called once
+    per tick with the lines that were stepped, so their writes can be applied
+    together. wake() steps a line straight away instead of at its next tick.
+    tick and all due times are simulation seconds on clock; in free-run mode
+    ticks with nothing due are skipped. metrics (Metrics.SimMetrics) is
+    optional and gets tick and step timings.
+    """
+
+    def __init__(self, lines, tick=0.1, workers=1, stop_event=None, commit=None, clock=None, metrics=None):
+        self.lines = list(lines)
+        self.tick = tick
+        self.workers = workers
+        self.stop_event = stop_event or threading.Event()
+        self.commit = commit
+        self.clock = clock or SimClock()
+        self.metrics = metrics
+        self.order = {id(sim): order for order, sim in enumerate(self.lines)}
+        self.woken = deque()
+        self.wakeup = threading.Event()
+
+    def wake(self, sim):
+        # Safe to call from any thread, e.g. the server's client write hook
+        self.woken.append(sim)
+        self.wakeup.set()
+
+    def _step(self, sim):
+        try:
+            if self.metrics is None:
+                return sim.step()
+            mode, started = sim.mode, time.perf_counter()
+            delay = sim.step()
+            self.metrics.observe_step(sim.line_no, time.perf_counter() - started, mode, sim.mode)
+            return delay
+        except Exception as e:
+            log.error("❌ Error on Line %s: %s", sim.line_no, e)
+            return None
+
+    def run(self):
+        tick = self.tick
+        clock = self.clock
+        tick_at = clock.now()
+        # (due time, order, line) – order keeps the heap from comparing lines.
+        # due_at holds each line's current entry; older entries left behind by
+        # a wake() are skipped when popped.
+        heap = [(tick_at, order, sim) for order, sim in enumerate(self.lines)]
+        heapq.heapify(heap)
+        due_at = {order: tick_at for order in range(len(self.lines))}
+        pool = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+
+        try:
+            while not self.stop_event.is_set() and due_at:
+                now = clock.now()
+                started = time.perf_counter()
+                due = {}
+                lateness = None
+                if now >= tick_at:
+                    base = tick_at
+                    lateness = now - tick_at
+                    # half a tick of slack so a 0.5 s wait lands on the 5th tick, not the 6th
+                    horizon = tick_at + tick / 2
+                    while heap and heap[0][0] <= horizon:
+                        when, order, sim = heapq.heappop(heap)
+                        if due_at.get(order) == when:
+                            due[order] = sim
+                    tick_at += tick
+                    if tick_at <= now:
+                        # overran the tick: start the next one now rather than bursting to catch up
+                        tick_at = now + tick
+                else:
+                    base = now
+                while self.woken:
+                    sim = self.woken.popleft()
+                    order = self.order[id(sim)]
+                    if order in due_at and sim.interruptible:
+                        due[order] = sim
+
+                sims = list(due.values())
+                delays = pool.map(self._step, sims) if pool else map(self._step, sims)
+                for (order, sim), delay in zip(due.items(), delays):
+                    if delay is None:
+                        due_at.pop(order, None)
+                    else:
+                        due_at[order] = base + delay
+                        heapq.heappush(heap, (base + delay, order, sim))
+                if self.commit and sims:
+                    try:
+                        self.commit(sims)
+                    except Exception as e:
+                        log.error("❌ Error committing tick: %s", e)
+                if self.metrics and lateness is not None:
+                    self.metrics.observe_tick(time.perf_counter() - started, clock.wall(lateness), clock.wall(tick))
+
+                if clock.free_run:
+                    if heap and heap[0][0] > tick_at + tick / 2:
+                        # nothing due for a while: skip the empty ticks
+                        tick_at += math.ceil((heap[0][0] - tick_at - tick / 2) / tick) * tick
+                    clock.advance(tick_at)
+                    continue
+                wait = clock.wall(tick_at - clock.now())
+                if wait > 0:
+                    self.wakeup.wait(wait)
+                    self.wakeup.clear()
+        finally:
+            if pool:
+                pool.shutdown(wait=False)
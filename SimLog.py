@@ -0,0 +1,77 @@
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# LineSimulation logs to "sim.lineNN", the drivers to "sim"
+LOGGER = "sim"
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock QueueHandler formats each record in the caller's thread; here
+    the record goes on the queue as it is (its args are ints and strings), so a
+    line step only pays for creating the record.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class LineRateLimit(logging.Filter):
+    """At most rate records per second per logger (line), with bursts up to burst.
+
+    Warnings and errors always pass. The next record that passes after some
+    were dropped says how many.
+    """
+
+    def __init__(self, rate, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1.0, rate * 2)
+        self.buckets = {}  # logger name -> [tokens, last refill, dropped]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate <= 0 or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(record.name)
+            if bucket is None:
+                bucket = self.buckets[record.name] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            dropped, bucket[2] = bucket[2], 0
+        if dropped:
+            record.msg = f"{record.msg} (+{dropped} suppressed)"
+        return True
+
+
+def setup_logging(level="INFO", rate=5.0, stream=None):
+    """Send the "sim" loggers through a queue to a console writer thread.
+
+    level: DEBUG shows every motion step, INFO only state changes.
+    rate: records per second per line (0 = no limit).
+    Returns the QueueListener; stop() it at exit to flush what is queued.
+    """
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(LineRateLimit(rate))
+    logger = logging.getLogger(LOGGER)
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    console = logging.StreamHandler(stream or sys.stdout)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(records, console)
+    listener.start()
+    return listener
@@ -0,0 +1,188 @@
+from opcua import Client, ua
+import argparse
+import csv
+import gzip
+import logging
+import threading
+import time
+from datetime import timezone
+
+import numpy as np
+
+from LineConfig import load_config
+
+# Disable debug logs
+logging.getLogger("opcua").setLevel(logging.ERROR)
+log = logging.getLogger("sim")
+
+# One row per register change: seconds since the trace started, line number, register, value
+TRACE_COLUMNS = ("t", "line", "register", "value")
+CHUNK_ROWS = 100_000
+
+
+# === Reading Traces (chunked, never the whole file) ===
+def read_trace(path, chunksize=CHUNK_ROWS):
+    """Yield (t, line, register, value) NumPy arrays, chunksize rows at a time.
+
+    CSV (optionally .gz) is read with pandas, Parquet with pyarrow; both stream
+    the file, so memory does not depend on the trace length. Rows must be
+    sorted by t.
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq  # only needed for Parquet traces
+        frames = (batch.to_pandas() for batch in
+                  pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=list(TRACE_COLUMNS)))
+    else:
+        import pandas as pd
+        frames = pd.read_csv(path, chunksize=chunksize, usecols=list(TRACE_COLUMNS),
+                             dtype={"t": "float64", "line": "int64", "register": "str", "value": "int64"})
+    for frame in frames:
+        yield (frame["t"].to_numpy(np.float64), frame["line"].to_numpy(np.int64),
+               frame["register"].to_numpy(object), frame["value"].to_numpy(np.int64))
+
+
+# === Replay ===
+class TraceReplayer:
+    """Writes a recorded trace to the line nodes on the simulation clock.
+
+    Rows with the same t are handed to commit together as (node, value)
+    pairs, like VectorEngine does, at simulation time t after the replay
+    started, so --time-scale and --free-run apply. Rows for lines or
+    registers that are not in the plant are skipped.
+    """
+
+    def __init__(self, path, line_nodes, commit, loop=False, chunksize=CHUNK_ROWS):
+        self.path = path
+        self.commit = commit
+        self.loop = loop
+        self.chunksize = chunksize
+        self.nodes = {(line_no, name): node for line_no, nodes in line_nodes.items() for name, node in nodes.items()}
+
+    def run(self, stop_event, clock):
+        while not stop_event.is_set():
+            offset = clock.now()
+            rows = skipped = 0
+            for t, lines, registers, values in read_trace(self.path, self.chunksize):
+                # [start, end) of each run of rows with the same t
+                bounds = np.flatnonzero(np.diff(t)) + 1
+                starts = np.concatenate(([0], bounds)).tolist()
+                ends = np.concatenate((bounds, [len(t)])).tolist()
+                lines, registers, values = lines.tolist(), registers.tolist(), values.tolist()
+                for a, b in zip(starts, ends):
+                    due = offset + float(t[a])
+                    if clock.free_run:
+                        clock.advance(due)
+                    else:
+                        wait = clock.wall(due - clock.now())
+                        if wait > 0 and stop_event.wait(wait):
+                            return
+                    if stop_event.is_set():
+                        return
+                    changes = []
+                    for key, value in zip(zip(lines[a:b], registers[a:b]), values[a:b]):
+                        node = self.nodes.get(key)
+                        if node is None:
+                            skipped += 1
+                        else:
+                            changes.append((node, value))
+                    if changes:
+                        try:
+                            self.commit(changes)
+                        except Exception as e:
+                            log.error("❌ Error replaying trace: %s", e)
+                    rows += b - a
+            log.info("🎞️ Trace %s replayed: %s rows, %s skipped", self.path, rows, skipped)
+            if not self.loop:
+                return
+
+
+# === Recording ===
+class TraceRecorder:
+    """Subscribes to the LINEnn-MP.ASRS registers of a server and writes every change as a trace row.
+
+    The first value of each register (the state when recording starts) is
+    written at t = 0; later changes at their SourceTimestamp (the arrival time
+    if there is none) after the newest of those. t never goes backwards, so
+    the file is sorted for replay.
+    """
+
+    def __init__(self, url, config, path, namespace=2, publish_ms=100):
+        self.client = Client(url, timeout=10)
+        self.config = config
+        self.namespace = namespace
+        self.publish_ms = publish_ms
+        self.file = gzip.open(path, "wt", newline="") if path.endswith(".gz") else open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(TRACE_COLUMNS)
+        self.lock = threading.Lock()
+        self.keys = {}  # NodeId -> (line number, register)
+        self.t0 = None
+        self.seen = set()
+        self.last_t = 0.0
+        self.rows = 0
+
+    def start(self):
+        self.client.connect()
+        for line_no in self.config.line_numbers:
+            for name in self.config.registers(line_no):
+                self.keys[ua.NodeId(self.config.node_id(line_no, name), self.namespace)] = (line_no, name)
+        self.subscription = self.client.create_subscription(self.publish_ms, self)
+        self.subscription.subscribe_data_change([self.client.get_node(nodeid) for nodeid in self.keys])
+
+    def datachange_notification(self, node, val, data):
+        stamp = data.monitored_item.Value.SourceTimestamp
+        if stamp is None:
+            seconds = time.time()
+        else:
+            seconds = (stamp.replace(tzinfo=timezone.utc) if stamp.tzinfo is None else stamp).timestamp()
+        line_no, name = self.keys[node.nodeid]
+        with self.lock:
+            if node.nodeid not in self.seen:
+                self.seen.add(node.nodeid)
+                self.t0 = seconds if self.t0 is None else max(self.t0, seconds)
+            else:
+                self.last_t = max(self.last_t, seconds - self.t0)
+            self.writer.writerow((f"{self.last_t:.3f}", line_no, name, int(val)))
+            self.rows += 1
+
+    def stop(self):
+        try:
+            self.subscription.delete()
+            self.client.disconnect()
+        finally:
+            with self.lock:
+                self.file.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record a trace of the LINEnn-MP.ASRS registers of an OPC UA server "
+                                                 "(e.g. KEPServerEX) for NewOPCserver.py --mode replay")
+    parser.add_argument("--url", default="opc.tcp://127.0.0.1:4840", help="server endpoint")
+    parser.add_argument("--out", required=True, help="trace file to write (.csv or .csv.gz)")
+    parser.add_argument("--config", help="plant topology file naming the lines and registers to record")
+    parser.add_argument("--lines", type=int, help="number of lines (overrides the config)")
+    parser.add_argument("--namespace", type=int, default=2, help="namespace index of the register NodeIds")
+    parser.add_argument("--publish-ms", type=int, default=100, help="subscription publishing interval")
+    parser.add_argument("--duration", type=float, help="seconds to record (default: until Ctrl+C)")
+    args = parser.parse_args()
+    try:
+        config = load_config(args.config)
+        if args.lines is not None:
+            config = config.replace(lines=args.lines)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    recorder = TraceRecorder(args.url, config, args.out, args.namespace, args.publish_ms)
+    recorder.start()
+    print(f"⏺️ Recording {len(recorder.keys)} registers from {args.url} to {args.out}")
+    try:
+        if args.duration:
+            time.sleep(args.duration)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.stop()
+    print(f"✅ {recorder.rows} rows written to {args.out}")
@@ -0,0 +1,401 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from SimEngine import LINE_SETTINGS, X_RANGE, SimClock
+
+log = logging.getLogger("sim")
+
+# === Mode / Phase Codes (same states as SimEngine.LineSimulation) ===
+WAIT, PREP_WAIT, PREP, MOVING, TOURING, FREE_MOVING, STOPPING, STOPPED = range(8)
+MODE_NAMES = ["WAIT", "PREP_WAIT", "PREP", "MOVING", "Touring", "FREE_MOVING", "STOPPING", "STOPPED"]
+PHASE_NONE, MOVE_X, MOVE_Y = range(3)
+PHASE_NAMES = [None, "MOVE_X", "MOVE_Y"]  # LineSimulation.phase
+
+# Registers written by clients that the engine reacts to
+INPUT_REGISTERS = ("D0148", "ResetFlag", "D0131", "D0133", "D0135", "D0137")
+# Registers cleared by a ResetFlag besides D0148 / D0328 / D0147 / ResetFlag
+RESET_CLEARED = ("D0130", "D0131", "D0133", "D0134", "D0135", "D0137")
+
+
+def level_of(y, max_present_level):
+    # int((y - 500) / 1000) + 1, clamped to 1..max like the per-line code
+    return np.clip(np.trunc((y - 500) / 1000).astype(np.int64) + 1, 1, max_present_level)
+
+
+def step_towards(current, target, step):
+    # Move by step towards target without overshooting it
+    return np.where(current < target,
+                    np.minimum(current + step, target),
+                    np.maximum(current - step, target))
+
+
+class VectorEngine:
+    """All simulated cranes as NumPy arrays, advanced in one batched update per step.
+
+    Follows the LineSimulation rules (reset, 36/37 hold and stop, Touring,
+    FREE_MOVING, PREP and the MOVING serpentine) with every line stepping on
+    the same step_time period. Client writes reach the engine through set_input()
+    (the engine tracks its own clears of those registers itself),
+    and step() only writes back the registers that changed, as one list of
+    (node, value) pairs handed to commit.
+    """
+
+    STOP_HOLD = 1    # steps before D0148 is cleared after a 37 (one step)
+
+    def __init__(self, line_numbers, node_maps, seed=None, commit=None, settings=None, states=None):
+        self.line_numbers = list(line_numbers)
+        self.node_maps = list(node_maps)
+        self.commit = commit or self._set_values
+        n = len(self.line_numbers)
+        self.rng = np.random.default_rng(seed)
+
+        # --- Per-line settings (list of LINE_SETTINGS overrides, one per line) ---
+        settings = [dict(LINE_SETTINGS, **line) for line in (settings or [{}] * n)]
+        self.x_step_lo, self.x_step_hi = np.array([line["x_step"] for line in settings], dtype=np.int64).T
+        self.y_step_lo, self.y_step_hi = np.array([line["y_step"] for line in settings], dtype=np.int64).T
+        self.max_level = np.array([line["max_level"] for line in settings], dtype=np.int64)
+        self.max_present_level = np.array([line["max_present_level"] for line in settings], dtype=np.int64)
+        # the engine steps every line together, so step timing is plant-wide
+        timing = settings[0] if settings else LINE_SETTINGS
+        self.step_time = timing["step_time"]
+        self.prep_hold = max(1, round(timing["prep_hold_time"] / self.step_time))  # steps showing status 78
+
+        # --- Client inputs, one row per register ---
+        self.input_index = {name: row for row, name in enumerate(INPUT_REGISTERS)}
+        self.inputs = np.zeros((len(INPUT_REGISTERS), n), dtype=np.int64)
+
+        # --- Crane state ---
+        self.x = np.zeros(n, dtype=np.int64)
+        self.y = np.zeros(n, dtype=np.int64)
+        self.level = np.zeros(n, dtype=np.int64)
+        self.status = np.zeros(n, dtype=np.int64)       # D0328 / D0147
+        self.mode = np.full(n, WAIT, dtype=np.int8)
+        self.phase = np.full(n, PHASE_NONE, dtype=np.int8)
+        self.current_level = np.zeros(n, dtype=np.int64)  # 0 = no level yet
+        self.start_y = np.zeros(n, dtype=np.int64)
+        self.free_end_x = np.zeros(n, dtype=np.int64)
+        self.free_end_y = np.zeros(n, dtype=np.int64)
+        self.prep_start = np.zeros(n, dtype=np.int64)
+        self.prep_end = np.zeros(n, dtype=np.int64)
+        self.hold = np.zeros(n, dtype=np.int64)
+
+        # --- Last values written to the address space ---
+        self.published = {
+            "Distance_X": np.full(n, -1, dtype=np.int64),
+            "Distance_Y": np.full(n, -1, dtype=np.int64),
+            "PresentLevel": np.full(n, -1, dtype=np.int64),
+            "D0328": np.full(n, -1, dtype=np.int64),
+        }
+        # Distance_X/Y move less than this are held back (see RegisterCache)
+        deadband_abs = np.array([line["deadband_abs"] for line in settings], dtype=np.float64)
+        deadband_pct = np.array([line["deadband_pct"] for line in settings], dtype=np.float64) / 100
+        y_range = 500 + (self.max_present_level - 1) * 1000
+        self.deadband = {
+            "Distance_X": np.maximum(deadband_abs, deadband_pct * X_RANGE),
+            "Distance_Y": np.maximum(deadband_abs, deadband_pct * y_range),
+        }
+        self.previous = {name: np.full(n, -1, dtype=np.int64) for name in self.deadband}  # value one step ago
+
+        self._randomize(np.ones(n, dtype=bool))
+        resumed = self.restore(states) if states else 0
+        self._publish(np.zeros(n, dtype=bool), {})
+        log.info("🎲 Vector engine: %d lines, %d with random start positions, %d resumed", n, n - resumed, resumed)
+
+    def set_input(self, i, name, value):
+        self.inputs[self.input_index[name], i] = value
+
+    def _randomize(self, mask):
+        count = int(mask.sum())
+        if not count:
+            return
+        self.x[mask] = self.rng.integers(5000, 28001, count)
+        self.y[mask] = self.rng.integers(3000, 6001, count)
+        self.level[mask] = np.clip((self.y[mask] - 500) // 1000 + 1, 1, self.max_present_level[mask])
+
+    def step(self):
+        inputs = self.inputs.copy()
+        d148, reset_flag, x_min, level_start, x_max, level_end = inputs
+        n = len(self.line_numbers)
+        x, y, mode = self.x, self.y, self.mode
+        x_step = self.rng.integers(self.x_step_lo, self.x_step_hi + 1)
+        y_step = self.rng.integers(self.y_step_lo, self.y_step_hi + 1)
+        clear_d148 = np.zeros(n, dtype=bool)
+        clears = {}
+
+        # --- Holds (1 s before PREP, 0.5 s before D0148 is cleared on stop) ---
+        holding = self.hold > 0
+        self.hold[holding] -= 1
+        waiting = self.hold > 0
+        resumed = holding & ~waiting
+
+        stop_done = resumed & (mode == STOPPING)
+        clear_d148 |= stop_done
+        d148[stop_done] = 0
+        mode[stop_done] = WAIT
+
+        prep_done = resumed & (mode == PREP_WAIT)
+        ps, pe = self.prep_start, self.prep_end
+        invalid = prep_done & ((ps <= 0) | (pe <= 0) | (ps > self.max_level) | (pe > self.max_level) | (ps > pe))
+        clears["D0133"] = invalid.copy()
+        clears["D0137"] = invalid.copy()
+        clear_d148 |= invalid
+        level_start[invalid] = 0
+        level_end[invalid] = 0
+        d148[invalid] = 0
+        mode[invalid] = WAIT
+        valid = prep_done & ~invalid
+        self.current_level[valid] = ps[valid]
+        self.start_y[valid] = 500 + (ps[valid] - 1) * 1000
+        y[valid] = self.start_y[valid]
+        self.level[valid] = self.current_level[valid]
+        self.status[valid] = 2
+        mode[valid] = PREP
+
+        active = ~waiting
+
+        # --- ResetFlag ---
+        reset = active & (reset_flag == 1)
+        self._randomize(reset)
+        clear_d148 |= reset
+        clears["ResetFlag"] = reset
+        for name in RESET_CLEARED:
+            clears[name] = clears.get(name, np.zeros(n, dtype=bool)) | reset
+        self.status[reset] = 0
+        self.current_level[reset] = 0
+        mode[reset] = WAIT
+        active &= ~reset
+
+        # --- D0148 commands ---
+        hold36 = active & (d148 == 36)
+        self.status[hold36] = 76
+
+        stop37 = active & (d148 == 37)
+        self.status[stop37] = 0
+        self.current_level[stop37] = 0
+        mode[stop37] = STOPPING
+        self.hold[stop37] = self.STOP_HOLD
+
+        idle = active & ~hold36 & ~stop37 & (mode == WAIT)
+        tour = idle & (d148 == 10)
+        mode[tour] = TOURING
+
+        free = idle & (d148 == 35)
+        self.free_end_x[free] = x_max[free]
+        self.free_end_y[free] = 500 + (level_end[free] - 1) * 1000
+        mode[free] = FREE_MOVING
+
+        arm = idle & (d148 == 38)
+        self.status[arm] = 78
+        self.prep_start[arm] = level_start[arm]
+        self.prep_end[arm] = level_end[arm]
+        mode[arm] = PREP_WAIT
+        self.hold[arm] = self.prep_hold
+
+        go = active & ~hold36 & ~stop37 & ~arm
+        in_prep = go & (mode == PREP)
+        in_move_x = go & (mode == MOVING) & (self.phase == MOVE_X)
+        in_move_y = go & (mode == MOVING) & (self.phase == MOVE_Y)
+        in_tour = go & (mode == TOURING)
+        in_free = go & (mode == FREE_MOVING)
+        in_rest = go & ~in_prep & ~in_move_x & ~in_move_y & ~in_tour & ~in_free
+
+        # --- PREP: back off to the start bay ---
+        prep_move = in_prep & (x > x_min)
+        x[prep_move] = np.maximum(x_min, x - x_step)[prep_move]
+        prep_ready = in_prep & ~prep_move
+        self.status[prep_ready] = 7
+        self.phase[prep_ready] = MOVE_X
+        mode[prep_ready] = MOVING
+
+        # --- MOVING / MOVE_X: serpentine pass along the bay ---
+        right = (self.current_level - level_start) % 2 == 0
+        x_target = np.where(right, x_max, x_min)
+        pass_move = in_move_x & ((right & (x < x_target)) | (~right & (x > x_target)))
+        new_x = np.where(right, np.minimum(x_max, x + x_step), np.maximum(x_min, x - x_step))
+        x[pass_move] = new_x[pass_move]
+        self.status[pass_move] = 7
+        pass_end = in_move_x & ~pass_move
+        finished = pass_end & (self.current_level >= level_end)
+        self.status[finished] = 0
+        mode[finished] = STOPPED
+        self.phase[pass_end & ~finished] = MOVE_Y
+
+        # --- MOVING / MOVE_Y: climb to the next level ---
+        next_level = self.current_level + 1
+        y_target = self.start_y + (next_level - level_start) * 1000
+        climb = in_move_y & (y < y_target)
+        y[climb] = np.minimum(y_target, y + y_step)[climb]
+        self.level[climb] = level_of(y[climb], self.max_present_level[climb])
+        self.status[climb] = 2
+        arrived = in_move_y & ~climb
+        self.current_level[arrived] = next_level[arrived]
+        self.level[arrived] = next_level[arrived]
+        self.status[arrived] = 7
+        self.phase[arrived] = MOVE_X
+
+        # --- Touring: X first, then Y, to D0131 / D0133 ---
+        expected_y = 500 + (level_start - 1) * 1000
+        tour_x = in_tour & (x != x_min)
+        x[tour_x] = step_towards(x, x_min, x_step)[tour_x]
+        tour_y = in_tour & ~tour_x & (y != expected_y)
+        y[tour_y] = step_towards(y, expected_y, y_step)[tour_y]
+        self.level[tour_y] = level_of(y[tour_y], self.max_present_level[tour_y])
+        self.status[tour_x | tour_y] = 2
+        tour_done = in_tour & ~tour_x & ~tour_y
+        clear_d148 |= tour_done
+        self.status[tour_done] = 0
+        mode[tour_done] = WAIT
+        self.phase[tour_done] = PHASE_NONE
+
+        # --- FREE_MOVING: X and Y together to D0135 / D0137 ---
+        free_x = in_free & (x != self.free_end_x)
+        free_y = in_free & (y != self.free_end_y)
+        x[free_x] = step_towards(x, self.free_end_x, x_step)[free_x]
+        y[free_y] = step_towards(y, self.free_end_y, y_step)[free_y]
+        self.level[free_y] = level_of(y[free_y], self.max_present_level[free_y])
+        self.status[free_x | free_y] = 2
+        free_done = in_free & ~free_x & ~free_y
+        clear_d148 |= free_done
+        self.status[free_done] = 0
+        mode[free_done] = WAIT
+        self.phase[free_done] = PHASE_NONE
+        in_rest |= free_done
+
+        # --- Final level overshoot guard ---
+        past_end = in_rest & (self.current_level > 0) & (self.current_level > level_end)
+        final_right = level_end % 2 == 1
+        stop_at = np.where(final_right, x_max, x_min)
+        final_move = past_end & ((final_right & (x < stop_at)) | (~final_right & (x > stop_at)))
+        x[final_move] = np.where(final_right, x + x_step, x - x_step)[final_move]
+        final_stop = past_end & ~final_move
+        self.status[final_stop] = 0
+        mode[final_stop] = STOPPED
+
+        self._publish(clear_d148, clears)
+
+    @staticmethod
+    def _set_values(changes):
+        for node, value in changes:
+            node.set_value(value)
+
+    def _publish(self, clear_d148, clears):
+        changes = []
+        values = {
+            "Distance_X": self.x,
+            "Distance_Y": self.y,
+            "PresentLevel": self.level,
+            "D0328": self.status,
+        }
+        for name, current in values.items():
+            last = self.published[name]
+            changed = current != last
+            if name in self.deadband:
+                # past the deadband, first value, or the axis stopped short of it
+                previous = self.previous[name]
+                changed &= (np.abs(current - last) > self.deadband[name]) | (last < 0) | (current == previous)
+                previous[:] = current
+            for i in np.flatnonzero(changed):
+                value = int(current[i])
+                changes.append((self.node_maps[i][name], value))
+                if name == "D0328":
+                    changes.append((self.node_maps[i]["D0147"], value))
+            last[changed] = current[changed]
+
+        clears = dict(clears, D0148=clear_d148)
+        for name, mask in clears.items():
+            if name in self.input_index:
+                self.inputs[self.input_index[name], mask] = 0
+            for i in np.flatnonzero(mask):
+                changes.append((self.node_maps[i][name], 0))
+
+        if changes:
+            self.commit(changes)
+
+    def snapshot(self):
+        """Per-line state in the LineSimulation.snapshot() format, plus the hold counter."""
+        columns = {name: getattr(self, name).tolist() for name in
+                   ("x", "y", "level", "status", "mode", "phase", "current_level", "start_y",
+                    "free_end_x", "free_end_y", "prep_start", "prep_end", "hold")}
+        inputs = {name: self.inputs[row].tolist() for name, row in self.input_index.items()}
+        states = {}
+        for i, line_no in enumerate(self.line_numbers):
+            c = {name: values[i] for name, values in columns.items()}
+            registers = {"Distance_X": c["x"], "Distance_Y": c["y"], "PresentLevel": c["level"],
+                         "D0328": c["status"], "D0147": c["status"]}
+            registers.update({name: values[i] for name, values in inputs.items()})
+            states[line_no] = {
+                "mode": MODE_NAMES[c["mode"]],
+                "phase": PHASE_NAMES[c["phase"]],
+                "current_level": c["current_level"] or None,
+                "start_y_position": c["start_y"],
+                "free_move_end_x": c["free_end_x"],
+                "free_move_end_y": c["free_end_y"],
+                "prep_levels": [c["prep_start"], c["prep_end"]],
+                "hold": c["hold"],
+                "registers": registers,
+            }
+        return states
+
+    def restore(self, states):
+        """Load snapshot() states (line number -> state); returns how many lines were restored."""
+        restored = 0
+        for i, line_no in enumerate(self.line_numbers):
+            state = states.get(line_no)
+            if state is None:
+                continue
+            registers = state.get("registers", {})
+            for name, array in (("Distance_X", self.x), ("Distance_Y", self.y),
+                                ("PresentLevel", self.level), ("D0328", self.status)):
+                if name in registers:
+                    array[i] = registers[name]
+            for name, row in self.input_index.items():
+                if name in registers:
+                    self.inputs[row, i] = registers[name]
+            mode = MODE_NAMES.index(state["mode"]) if state.get("mode") in MODE_NAMES else WAIT
+            self.mode[i] = mode
+            self.phase[i] = PHASE_NAMES.index(state.get("phase"))
+            self.current_level[i] = state.get("current_level") or 0
+            self.start_y[i] = state.get("start_y_position") or 0
+            self.free_end_x[i] = state.get("free_move_end_x") or 0
+            self.free_end_y[i] = state.get("free_move_end_y") or 0
+            self.prep_start[i], self.prep_end[i] = state.get("prep_levels") or (0, 0)
+            # a LineSimulation snapshot has no hold: finish a pending hold on the next step
+            self.hold[i] = state.get("hold", 1 if mode in (PREP_WAIT, STOPPING) else 0)
+            restored += 1
+        return restored
+
+    def line_modes(self):
+        return {line_no: MODE_NAMES[mode] for line_no, mode in zip(self.line_numbers, self.mode.tolist())}
+
+    def run(self, stop_event=None, clock=None, metrics=None, checkpoint=None):
+        # metrics: optional Metrics.SimMetrics, gets one tick per engine step
+        # checkpoint: optional Checkpoint.Checkpointer, gets snapshot() between steps
+        stop_event = stop_event or threading.Event()
+        clock = clock or SimClock()
+        step_at = clock.now()
+        while not stop_event.is_set():
+            lateness = max(0.0, clock.now() - step_at)
+            started = time.perf_counter()
+            modes = self.mode.copy() if metrics else None
+            try:
+                self.step()
+            except Exception as e:
+                log.error("❌ Error in vector engine: %s", e)
+            if metrics:
+                metrics.observe_tick(time.perf_counter() - started, clock.wall(lateness), clock.wall(self.step_time))
+                for i in np.flatnonzero(self.mode != modes):
+                    metrics.transitions.inc(1, self.line_numbers[i], MODE_NAMES[self.mode[i]])
+            if checkpoint and checkpoint.due("vector"):
+                checkpoint.put(self.snapshot())
+            step_at += self.step_time
+            if clock.free_run:
+                clock.advance(step_at)
+                continue
+            wait = clock.wall(step_at - clock.now())
+            if wait > 0:
+                stop_event.wait(wait)
+            else:
+                step_at = clock.now()
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+from opcua import ua
+from opcua.common.utils import Buffer
+from opcua.ua.ua_binary import Primitives
+
+from History import WIN_EPOCH, RingHistory
+
+T0 = datetime(2026, 1, 1)  # HistoryRead times arrive as naive UTC
+NODE = ua.NodeId("LINE01-MP.ASRS.D0328", 2)
+
+
+def make_history(count=10):
+    history = RingHistory(capacity=100)
+    history.add_node(NODE, ua.VariantType.UInt16)
+    for i in range(count):
+        history.record(T0 + timedelta(seconds=i), [(NODE, i)])
+    return history
+
+
+def read_pages(history, start, end, per_page):
+    # the way opcua's HistoryManager pages: cont goes out as a DateTime and
+    # comes back as the next StartTime, EndTime stays the same
+    pages = []
+    while True:
+        values, cont = history.read_node_history(NODE, start, end, per_page)
+        pages.append([dv.Value.Value for dv in values])
+        if cont is None:
+            return pages
+        start = Primitives.DateTime.unpack(Buffer(Primitives.DateTime.pack(cont)))
+
+
+def test_ascending_pages():
+    pages = read_pages(make_history(), T0, WIN_EPOCH, 4)
+    assert pages == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+
+def test_start_after_end_pages_newest_first():
+    pages = read_pages(make_history(), T0 + timedelta(seconds=9), T0, 4)
+    assert pages == [[9, 8, 7, 6], [5, 4, 3, 2], [1, 0]]
+
+
+def test_no_start_reads_newest_without_continuation():
+    values, cont = make_history().read_node_history(NODE, WIN_EPOCH, WIN_EPOCH, 4)
+    assert [dv.Value.Value for dv in values] == [9, 8, 7, 6]
+    assert cont is None
@@ -0,0 +1,165 @@
+import random
+import threading
+
+import pytest
+
+from SimEngine import D_REGISTERS, LINE_SETTINGS, LineSimulation, RegisterCache, SimClock, TickScheduler
+
+SEED = 1234
+X_STEP = LINE_SETTINGS["x_step"]
+Y_STEP = LINE_SETTINGS["y_step"]
+# D0131 / D0135 bays and D0133 / D0137 levels of the audit sweep used below
+AUDIT = {"D0131": 1800, "D0135": 6000, "D0133": 2, "D0137": 3}
+
+
+def make_line(line_no=1, seed=SEED):
+    random.seed(seed)
+    return LineSimulation(line_no, RegisterCache({name: 0 for name in D_REGISTERS}))
+
+
+def command(sim, d148, **bounds):
+    # a client write: bounds first, D0148 last, like the Control.py command methods
+    for name, value in bounds.items():
+        sim.regs.update(name, value)
+    sim.regs.update("D0148", d148)
+
+
+def run(sim, clock, until, limit=2000):
+    """Step sim on a free-run clock until until(sim); one (time, mode, D0328, X, Y, level) row per step."""
+    trace = []
+    for _ in range(limit):
+        started = clock.now()
+        delay = sim.step()
+        regs = sim.regs
+        trace.append((started, sim.mode, regs.D0328, regs.Distance_X, regs.Distance_Y, regs.PresentLevel))
+        clock.advance(started + delay)
+        if until(sim):
+            return trace
+    raise AssertionError(f"line still in {sim.mode} after {limit} steps")
+
+
+def runs(values):
+    # consecutive duplicates collapsed: [78, 78, 2, 2, 7] -> [78, 2, 7]
+    return [v for i, v in enumerate(values) if i == 0 or values[i - 1] != v]
+
+
+def test_random_start_position():
+    sim = make_line()
+    regs = sim.regs
+    assert sim.mode == "WAIT"
+    assert 5000 <= regs.Distance_X <= 28000
+    assert 3000 <= regs.Distance_Y <= 6000
+    assert regs.PresentLevel == (regs.Distance_Y - 500) // 1000 + 1
+
+
+def test_audit_sweep_follows_serpentine():
+    sim = make_line()
+    clock = SimClock(free_run=True)
+    start_x = sim.regs.Distance_X
+    command(sim, 38, **AUDIT)
+    trace = run(sim, clock, lambda s: s.mode == "STOPPED")
+
+    times, modes, statuses, xs, ys, levels = zip(*trace)
+    # 78 for the 1 s hold, 2 in PREP, 7 on level 2, 2 while climbing, 7 on level 3, 0 at the end
+    assert runs(list(statuses)) == [78, 2, 7, 2, 7, 0]
+    assert modes[0] == "PREP_WAIT" and times[0] == 0
+    assert times[1] == LINE_SETTINGS["prep_hold_time"]
+    assert all(b - a == LINE_SETTINGS["step_time"] for a, b in zip(times[1:], times[2:]))
+
+    # PREP: Y jumps to level 2, X backs off to the start bay
+    assert (ys[1], levels[1]) == (1500, 2)
+    assert xs[1] < start_x
+
+    # from there every X / Y move is one random step, or lands on the bound it was heading for
+    for (x1, y1), (x2, y2) in zip(zip(xs[1:], ys[1:]), zip(xs[2:], ys[2:])):
+        dx, dy = abs(x2 - x1), abs(y2 - y1)
+        assert dx == 0 or X_STEP[0] <= dx <= X_STEP[1] or x2 in (1800, 6000)
+        assert dy == 0 or Y_STEP[0] <= dy <= Y_STEP[1] or y2 == 2500
+
+    # level 2 runs right to bay end, level 3 back left to bay start
+    level2 = [x for x, level, status in zip(xs, levels, statuses) if level == 2 and status == 7]
+    level3 = [x for x, level, status in zip(xs, levels, statuses) if level == 3 and status == 7]
+    assert level2 == sorted(level2) and level2[-1] == 6000
+    assert level3 == sorted(level3, reverse=True) and level3[-1] == 1800
+    assert trace[-1][1:] == ("STOPPED", 0, 1800, 2500, 3)
+    assert sim.regs.D0147 == 0
+
+
+def test_same_seed_same_trace():
+    traces = []
+    for _ in range(2):
+        sim = make_line()
+        command(sim, 38, **AUDIT)
+        traces.append(run(sim, SimClock(free_run=True), lambda s: s.mode == "STOPPED"))
+    assert traces[0] == traces[1]
+
+
+def test_emergency_stop_clears_d148_after_hold():
+    sim = make_line()
+    clock = SimClock(free_run=True)
+    command(sim, 38, **AUDIT)
+    run(sim, clock, lambda s: s.mode == "MOVING")
+    command(sim, 37)
+    assert sim.step() == LINE_SETTINGS["step_time"]
+    assert (sim.mode, sim.regs.D0328, sim.regs.D0148) == ("STOPPING", 0, 37)
+    sim.step()
+    assert (sim.mode, sim.regs.D0148) == ("WAIT", 0)
+
+
+@pytest.mark.parametrize("levels", [(5, 3), (0, 3), (2, 20)])
+def test_invalid_level_range_is_cleared(levels):
+    sim = make_line()
+    command(sim, 38, D0131=1800, D0135=6000, D0133=levels[0], D0137=levels[1])
+    assert sim.step() == LINE_SETTINGS["prep_hold_time"]
+    sim.step()
+    regs = sim.regs
+    assert (sim.mode, regs.D0133, regs.D0137, regs.D0148) == ("WAIT", 0, 0, 0)
+
+
+def test_touring_goes_x_first_then_y():
+    sim = make_line()
+    command(sim, 10, D0131=3000, D0133=4)
+    trace = run(sim, SimClock(free_run=True), lambda s: s.mode == "WAIT")
+    xs = [row[3] for row in trace]
+    first_y_move = next(i for i, row in enumerate(trace) if row[4] != trace[0][4])
+    assert xs[first_y_move - 1] == 3000
+    assert trace[-1][2:] == (0, 3000, 3500, 4)
+    assert sim.regs.D0148 == 0
+
+
+def test_reset_flag_randomizes_and_clears():
+    sim = make_line()
+    command(sim, 38, **AUDIT)
+    run(sim, SimClock(free_run=True), lambda s: s.mode == "MOVING")
+    sim.regs.update("ResetFlag", 1)
+    sim.step()
+    regs = sim.regs
+    assert sim.mode == "WAIT"
+    assert all(getattr(regs, name) == 0 for name in ("D0148", "D0328", "ResetFlag", "D0131", "D0135", "D0133", "D0137"))
+    assert 5000 <= regs.Distance_X <= 28000
+
+
+def test_scheduler_steps_lines_on_tick_not_per_line():
+    random.seed(SEED)
+    lines = [LineSimulation(n, RegisterCache({name: 0 for name in D_REGISTERS})) for n in range(1, 5)]
+    for sim in lines:
+        command(sim, 38, **AUDIT)
+    clock = SimClock(free_run=True)
+    stop_event = threading.Event()
+    ticks = []
+
+    def commit(sims):
+        ticks.append(clock.now())
+        if all(sim.mode == "STOPPED" for sim in lines):
+            stop_event.set()
+
+    TickScheduler(lines, tick=0.1, stop_event=stop_event, commit=commit, clock=clock).run()
+
+    for sim in lines:
+        regs = sim.regs
+        assert (regs.D0328, regs.Distance_X, regs.Distance_Y, regs.PresentLevel) == (0, 1800, 2500, 3)
+    # every line steps on the same 0.5 s grid, so a free-run scheduler only
+    # runs the ticks where something is due, however many lines there are
+    step_time = LINE_SETTINGS["step_time"]
+    assert len(ticks) <= clock.now() / step_time + 2
+    assert all(round(t / step_time, 6).is_integer() for t in ticks)
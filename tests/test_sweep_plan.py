@@ -0,0 +1,122 @@
+import math
+import random
+
+from SimEngine import D_REGISTERS, LINE_SETTINGS, LineSimulation, RegisterCache, SweepPlan
+
+SEED = 1234
+STEP_TIME = LINE_SETTINGS["step_time"]
+AUDIT = {"D0131": 1800, "D0135": 6000, "D0133": 2, "D0137": 4}
+
+
+def start_sweep(seed=SEED, **bounds):
+    """A seeded line that has just taken the first planned step of an audit sweep."""
+    random.seed(seed)
+    sim = LineSimulation(1, RegisterCache({name: 0 for name in D_REGISTERS}))
+    for name, value in dict(AUDIT, **bounds).items():
+        sim.regs.update(name, value)
+    sim.regs.update("D0148", 38)
+    sim.step()  # status 78 hold
+    sim.step()  # PREP starts and the sweep is planned
+    return sim
+
+
+def finish(sim, limit=2000):
+    """Step to the end of the sweep; one (mode, phase, level, X, Y, SweepETA) row per step."""
+    rows = []
+    for _ in range(limit):
+        if sim.mode == "STOPPED":
+            return rows
+        sim.step()
+        regs = sim.regs
+        rows.append((sim.mode, sim.phase, sim.current_level, regs.Distance_X, regs.Distance_Y, regs.SweepETA))
+    raise AssertionError(f"sweep still in {sim.mode} after {limit} steps")
+
+
+def test_plan_covers_the_whole_sweep():
+    sim = start_sweep()
+    plan = sim.plan
+    assert plan.bounds == (1800, 6000, 2, 4)
+    rows = finish(sim)
+    # the first row was taken by start_sweep, every later step takes one more
+    assert len(rows) == len(plan.rows) - 1
+    assert plan.done and sim.plan is None
+    # the planned rows are the positions the line went through
+    planned_x = [row[3] for row in plan.rows if row[3] is not None]
+    assert planned_x[-1] == sim.regs.Distance_X == 6000
+    assert (sim.regs.Distance_Y, sim.regs.PresentLevel, sim.regs.D0328) == (3500, 4, 0)
+
+
+def test_sweep_eta_counts_down():
+    sim = start_sweep()
+    plan = sim.plan
+    assert sim.regs.SweepETA == math.ceil((len(plan.rows) - 1) * STEP_TIME)
+    etas = [row[5] for row in finish(sim)]
+    assert etas == sorted(etas, reverse=True)
+    assert all(0 <= a - b <= math.ceil(STEP_TIME) for a, b in zip(etas, etas[1:]))
+    assert etas[-1] == 0
+
+
+def test_level_eta_matches_the_run():
+    sim = start_sweep()
+    plan = sim.plan
+    assert list(plan.level_eta) == [2, 3, 4]
+    assert plan.level_eta[4] == len(plan.rows) * STEP_TIME
+
+    # a level is done on the step that ends its pass: the climb starts or the sweep stops
+    rows = [(sim.mode, sim.phase, sim.current_level)] + [row[:3] for row in finish(sim)]
+    done = {}
+    for step, (mode, phase, level) in enumerate(rows):
+        if phase == "MOVE_Y" or mode == "STOPPED":
+            done.setdefault(level, (step + 1) * STEP_TIME)
+    assert done == plan.level_eta
+
+
+def test_serpentine_rows():
+    sim = start_sweep()
+    for mode, phase, level, x, y, level_reg, status in sim.plan.rows:
+        if mode == "MOVING" and phase == "MOVE_X" and x is not None:
+            assert status == 7
+        if y is not None:
+            assert phase == "MOVE_Y" and status == 2
+    # after PREP the passes alternate: right on level 2, left on 3, right on 4
+    xs = {}
+    for mode, phase, level, x, *_ in sim.plan.rows:
+        if mode == "MOVING" and x is not None:
+            xs.setdefault(level, []).append(x)
+    assert xs[2] == sorted(xs[2]) and xs[2][-1] == 6000
+    assert xs[3] == sorted(xs[3], reverse=True) and xs[3][-1] == 1800
+    assert xs[4] == sorted(xs[4]) and xs[4][-1] == 6000
+
+
+def test_moved_bounds_are_planned_again():
+    sim = start_sweep()
+    first = sim.plan
+    while sim.phase != "MOVE_X":
+        sim.step()
+    sim.regs.update("D0135", 9000)
+    sim.step()
+    assert sim.plan is not first and sim.plan.bounds == (1800, 9000, 2, 4)
+    finish(sim)
+    assert (sim.regs.Distance_X, sim.regs.PresentLevel) == (9000, 4)
+
+
+def test_stop_and_reset_clear_sweep_eta():
+    for name, value in (("D0148", 37), ("ResetFlag", 1)):
+        sim = start_sweep()
+        assert sim.regs.SweepETA > 0
+        sim.regs.update(name, value)
+        sim.step()
+        assert sim.plan is None and sim.regs.SweepETA == 0
+
+
+def test_cut_short_plan_estimates_the_rest(monkeypatch):
+    monkeypatch.setattr(SweepPlan, "LIMIT", 25)
+    sim = start_sweep(D0135=20000, D0133=1, D0137=6)
+    first = sim.plan
+    assert len(first.rows) == 25 and first.unplanned > 0
+    eta = sim.regs.SweepETA
+    rows = finish(sim)
+    actual = len(rows) * STEP_TIME
+    # planned again every 25 steps; the estimate stays close and never hits 0 early
+    assert abs(eta - actual) <= 0.1 * actual
+    assert all(row[5] > 0 for row in rows[:-1]) and rows[-1][5] == 0
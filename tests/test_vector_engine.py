@@ -0,0 +1,149 @@
+import random
+
+import numpy as np
+
+from SimEngine import D_REGISTERS, LINE_SETTINGS, LineSimulation, RegisterCache
+from VectorSim import MODE_NAMES, VectorEngine
+
+SEED = 1234
+X_STEP = LINE_SETTINGS["x_step"]
+# (D0131, D0135, D0133, D0137) per line; the last one is an invalid level range
+BOUNDS = [(1800, 6000, 2, 3), (1800, 9000, 1, 1), (3000, 12000, 4, 7), (1800, 6000, 5, 3)]
+
+
+class Recorder:
+    """commit target for VectorEngine: the last value written to each (line, register)."""
+
+    def __init__(self, n):
+        self.node_maps = [{name: (i, name) for name in D_REGISTERS} for i in range(n)]
+        self.values = [dict.fromkeys(D_REGISTERS, 0) for _ in range(n)]
+
+    def __call__(self, changes):
+        for (i, name), value in changes:
+            self.values[i][name] = value
+
+
+def make_engine(n=len(BOUNDS), seed=SEED):
+    recorder = Recorder(n)
+    engine = VectorEngine(range(1, n + 1), recorder.node_maps, seed=seed, commit=recorder)
+    return engine, recorder
+
+
+def command(engine, i, d148, bounds=None):
+    if bounds:
+        for name, value in zip(("D0131", "D0135", "D0133", "D0137"), bounds):
+            engine.set_input(i, name, value)
+    engine.set_input(i, "D0148", d148)
+
+
+def run(engine, recorder, until, limit=2000):
+    """Step until until(engine); per line one (mode, D0328, X, Y, level) row per step."""
+    traces = [[] for _ in engine.line_numbers]
+    for _ in range(limit):
+        engine.step()
+        for i, values in enumerate(recorder.values):
+            traces[i].append((MODE_NAMES[engine.mode[i]], values["D0328"], values["Distance_X"],
+                              values["Distance_Y"], values["PresentLevel"]))
+        if until(engine):
+            return traces
+    raise AssertionError(f"engine still in {engine.line_modes()} after {limit} steps")
+
+
+def runs(values):
+    return [v for i, v in enumerate(values) if i == 0 or values[i - 1] != v]
+
+
+def idle(engine):
+    return bool(np.isin(engine.mode, [MODE_NAMES.index("STOPPED"), MODE_NAMES.index("WAIT")]).all())
+
+
+def test_start_positions_are_published():
+    engine, recorder = make_engine()
+    for values in recorder.values:
+        assert 5000 <= values["Distance_X"] <= 28000
+        assert 3000 <= values["Distance_Y"] <= 6000
+        assert values["PresentLevel"] == (values["Distance_Y"] - 500) // 1000 + 1
+
+
+def test_audit_sweeps_on_all_lines():
+    engine, recorder = make_engine()
+    for i, bounds in enumerate(BOUNDS):
+        command(engine, i, 38, bounds)
+    traces = run(engine, recorder, idle)
+
+    for i, (x_min, x_max, level_start, level_end) in enumerate(BOUNDS[:3]):
+        trace = traces[i]
+        statuses = [row[1] for row in trace]
+        levels = level_end - level_start + 1
+        # 2 in PREP, then 7 per level with a 2 climb between levels, 0 at the end
+        assert runs(statuses) == [78, 2] + [7, 2] * (levels - 1) + [7, 0]
+        # PREP starts after the 1 s hold, two 0.5 s steps
+        assert statuses.index(2) == round(LINE_SETTINGS["prep_hold_time"] / engine.step_time)
+        end_x = x_max if levels % 2 else x_min
+        end_y = 500 + (level_end - 1) * 1000
+        assert trace[-1] == ("STOPPED", 0, end_x, end_y, level_end)
+        xs = [row[2] for row in trace[statuses.index(2):]]
+        for a, b in zip(xs, xs[1:]):
+            assert a == b or X_STEP[0] <= abs(b - a) <= X_STEP[1] or b in (x_min, x_max)
+        assert recorder.values[i]["D0147"] == 0
+
+    # invalid range: bounds and D0148 cleared after the hold
+    values = recorder.values[3]
+    assert MODE_NAMES[engine.mode[3]] == "WAIT"
+    assert (values["D0133"], values["D0137"], values["D0148"]) == (0, 0, 0)
+
+
+def test_matches_line_simulation():
+    # random step sizes differ, but states, step timing and end positions are the same
+    engine, recorder = make_engine(n=1)
+    command(engine, 0, 38, BOUNDS[2])
+    vector = run(engine, recorder, lambda e: MODE_NAMES[e.mode[0]] == "STOPPED")[0]
+
+    random.seed(SEED)
+    sim = LineSimulation(1, RegisterCache({name: 0 for name in D_REGISTERS}))
+    for name, value in zip(("D0131", "D0135", "D0133", "D0137", "D0148"), BOUNDS[2] + (38,)):
+        sim.regs.update(name, value)
+    line = []
+    while sim.mode != "STOPPED":
+        regs = sim.regs
+        delay = sim.step()
+        # one row per engine step: repeat the state for a wait longer than one step
+        rows = round(delay / engine.step_time)
+        line += [(sim.mode, regs.D0328, regs.Distance_X, regs.Distance_Y, regs.PresentLevel)] * rows
+
+    assert runs([row[1] for row in vector]) == runs([row[1] for row in line])
+    assert [row[1] for row in vector][:3] == [row[1] for row in line][:3] == [78, 78, 2]
+    assert vector[-1] == line[-1]
+
+
+def test_emergency_stop_clears_d148_after_one_step():
+    engine, recorder = make_engine(n=1)
+    command(engine, 0, 38, BOUNDS[0])
+    run(engine, recorder, lambda e: MODE_NAMES[e.mode[0]] == "MOVING")
+    command(engine, 0, 37)
+    engine.step()
+    assert MODE_NAMES[engine.mode[0]] == "STOPPING" and recorder.values[0]["D0328"] == 0
+    engine.step()
+    assert MODE_NAMES[engine.mode[0]] == "WAIT" and recorder.values[0]["D0148"] == 0
+
+
+def test_touring_and_free_move():
+    engine, recorder = make_engine(n=2)
+    command(engine, 0, 10, (3000, 0, 4, 0))
+    command(engine, 1, 35, (0, 12000, 0, 6))
+    run(engine, recorder, lambda e: MODE_NAMES[e.mode[0]] == MODE_NAMES[e.mode[1]] == "WAIT")
+    tour, free = recorder.values
+    assert (tour["Distance_X"], tour["Distance_Y"], tour["PresentLevel"], tour["D0148"]) == (3000, 3500, 4, 0)
+    assert (free["Distance_X"], free["Distance_Y"], free["PresentLevel"], free["D0148"]) == (12000, 5500, 6, 0)
+
+
+def test_same_seed_same_run():
+    snapshots = []
+    for _ in range(2):
+        engine, recorder = make_engine()
+        for i, bounds in enumerate(BOUNDS):
+            command(engine, i, 38, bounds)
+        for _ in range(40):
+            engine.step()
+        snapshots.append(engine.snapshot())
+    assert snapshots[0] == snapshots[1]